@@ -20,9 +20,13 @@ from camml import draw
 
 from ptzipcam import logs, ui, convert
 from ptzipcam.ptz_camera import PtzCam
-import ptzipcam.ptz_camera as ctlrs
+from ptzipcam.command_queue import PtzCommandQueue
+import ptzipcam.motor_controllers as ctlrs
 from ptzipcam.camera import Camera
+from ptzipcam.dual_stream_camera import DualStreamCamera, scale_lbox
+from ptzipcam.frame_bus import FrameBusWorker
 from ptzipcam.io import ImageStreamRecorder
+from ptzipcam.video_writer import PassthroughRecorder
 
 # quick and dirty way to detect if on Pi (and thus likely using coral
 # for inference) or on something else and relying on CPU
@@ -62,6 +66,53 @@ PASS = configs['PASS']
 FFMPEG_PASS = PASS
 
 STREAM = configs['STREAM']
+# capture from e.g. a synthetic source instead of the camera
+FRAME_SOURCE = configs.get('FRAME_SOURCE')
+DECODE_ON_DEMAND = configs.get('DECODE_ON_DEMAND', False)
+DECODE_RATE = configs.get('DECODE_RATE')
+LOW_LATENCY = configs.get('LOW_LATENCY', False)
+RTSP_TRANSPORT = configs.get('RTSP_TRANSPORT')
+# opencv or pyav (see ptzipcam/av_capture.py)
+CAPTURE_BACKEND = configs.get('CAPTURE_BACKEND', 'opencv')
+CAPTURE_BACKEND_OPTIONS = configs.get('CAPTURE_BACKEND_OPTIONS')
+# capture into a ring of this many frames, which are recorded as
+# pre-roll when recording only detections and one starts
+FRAME_RING_SIZE = configs.get('FRAME_RING_SIZE')
+# detect on STREAM but record from this (higher resolution) stream
+RECORD_STREAM = configs.get('RECORD_STREAM')
+# record activity as the stream's own packets, in segments of
+# RECORD_SEGMENT_SECONDS, instead of as stills (needs the pyav backend)
+RECORD_PASSTHROUGH = configs.get('RECORD_PASSTHROUGH', False)
+RECORD_SEGMENT_SECONDS = configs.get('RECORD_SEGMENT_SECONDS', 600)
+# write stills from a queue of this size in background threads so
+# encoding them takes no time from tracking
+RECORD_QUEUE_SIZE = configs.get('RECORD_QUEUE_SIZE')
+RECORD_WRITER_THREADS = configs.get('RECORD_WRITER_THREADS', 1)
+RECORD_OVERFLOW = configs.get('RECORD_OVERFLOW', 'drop_oldest')
+# JPEG quality of stills, and of those recorded around a detection
+RECORD_JPEG_QUALITY = configs.get('RECORD_JPEG_QUALITY', 95)
+RECORD_BURST_QUALITY = configs.get('RECORD_BURST_QUALITY')
+# append stills to segment files of up to RECORD_SEGMENT_MB (or
+# RECORD_SEGMENT_SECONDS) rather than writing a file each
+RECORD_IMAGE_SEGMENTS = configs.get('RECORD_IMAGE_SEGMENTS', False)
+RECORD_SEGMENT_MB = configs.get('RECORD_SEGMENT_MB', 256)
+# also record the stills' metadata in an SQLite database, for querying
+RECORD_DATABASE = configs.get('RECORD_DATABASE', False)
+
+# reuse what was learned about the camera on previous runs
+DISCOVERY_CACHE = configs.get('DISCOVERY_CACHE')
+# send the per-frame PTZ commands as pre-serialized SOAP
+FAST_TRANSPORT = configs.get('FAST_TRANSPORT', False)
+# refresh PTZ status in the background this many times a second
+STATUS_POLL_RATE = configs.get('STATUS_POLL_RATE')
+# skip resending continuous moves that haven't (meaningfully) changed
+COMMAND_TOLERANCE = configs.get('COMMAND_TOLERANCE')
+KEEPALIVE_INTERVAL = configs.get('KEEPALIVE_INTERVAL')
+# send continuous moves from a worker thread so the loop never waits
+ASYNC_COMMANDS = configs.get('ASYNC_COMMANDS', False)
+# run the detector in its own process, handing it frames through
+# shared memory
+DETECT_IN_PROCESS = configs.get('DETECT_IN_PROCESS', False)
 
 # ptz camera setup constants
 INIT_POS = configs['INIT_POS']
@@ -87,13 +138,103 @@ CLASSES = nn.read_classes_from_file(CLASSES_FILE)
 HEADLESS = configs['HEADLESS']
 
 
+def make_detector():
+    """Build the object detector
+
+    """
+    return nn.TargetDetector(MODEL_CONFIG,
+                             MODEL_WEIGHTS,
+                             INPUT_WIDTH,
+                             INPUT_HEIGHT,
+                             CONF_THRESHOLD,
+                             NMS_THRESHOLD,
+                             CLASSES,
+                             TRACKED_CLASS)
+
+
+def make_detect_function():
+    """Build the detector's detect, for the inference process
+
+    """
+    return make_detector().detect
+
+
+def record_pre_roll(cam, recorder, record_seq, position):
+    """Record the frames captured before record_seq that are still kept
+
+    record_seq is a sequence number of the stream cam.pre_roll() keeps
+    (the main stream's with a RECORD_STREAM), as frame_to_record
+    returns.
+
+    """
+    pre_roll = cam.pre_roll()
+    earlier = [seq for _, seq, _ in pre_roll if seq < record_seq]
+    log.info('Recording %d pre-roll frames.', len(earlier))
+    for frame, seq, _ in pre_roll:
+        if seq < record_seq:
+            recorder.record_image(ui.orient_frame(frame, ORIENTATION),
+                                  position,
+                                  'n/a: pre-roll frame',
+                                  None,
+                                  burst=True)
+        cam.release_frame(seq)
+
+
+def frame_to_record(cam, raw_frame, frame_seq, frame_time, target_lbox):
+    """Frame, box, and sequence number to record for a frame detected on
+
+    With a RECORD_STREAM, the matching main stream frame (oriented),
+    the box rescaled to it, and its main stream sequence number;
+    otherwise raw_frame, target_lbox, and frame_seq.  If no main stream
+    frame matches, the substream frame is recorded and the sequence
+    number is infinite, so that all the main stream frames kept count
+    as pre-roll.
+
+    """
+    if not isinstance(cam, DualStreamCamera):
+        return raw_frame, target_lbox, frame_seq
+
+    frame, seq, _ = cam.get_matching_frame(frame_time)
+    if frame is None:
+        log.warning('No main stream frame to record; recording substream.')
+        return raw_frame, target_lbox, math.inf
+    frame = ui.orient_frame(frame, ORIENTATION)
+    return (frame,
+            scale_lbox(target_lbox, raw_frame.shape, frame.shape),
+            seq)
+
+
 def main():  # pylint: disable=R0912, R0915, R0914
     """Main function for this example
 
     """
 
-    ptz = PtzCam(IP, PORT, USER, PASS)
-    cam = Camera(ip=IP, user=USER, passwd=FFMPEG_PASS, stream=STREAM)
+    ptz = PtzCam(IP, PORT, USER, PASS,
+                 fast_transport=FAST_TRANSPORT,
+                 status_poll_rate=STATUS_POLL_RATE,
+                 command_tolerance=COMMAND_TOLERANCE,
+                 keepalive_interval=KEEPALIVE_INTERVAL,
+                 discovery_cache=DISCOVERY_CACHE)
+    if RECORD_STREAM and not FRAME_SOURCE:
+        cam = DualStreamCamera(IP, USER, FFMPEG_PASS,
+                               detect_stream=STREAM,
+                               record_stream=RECORD_STREAM,
+                               ring_size=FRAME_RING_SIZE or 25,
+                               decode_on_demand=DECODE_ON_DEMAND,
+                               low_latency=LOW_LATENCY,
+                               rtsp_transport=RTSP_TRANSPORT,
+                               backend=CAPTURE_BACKEND,
+                               backend_options=CAPTURE_BACKEND_OPTIONS)
+    else:
+        cam = Camera(ip=IP, user=USER, passwd=FFMPEG_PASS, stream=STREAM,
+                     source=FRAME_SOURCE,
+                     decode_on_demand=DECODE_ON_DEMAND,
+                     decode_rate=DECODE_RATE,
+                     low_latency=LOW_LATENCY,
+                     rtsp_transport=RTSP_TRANSPORT,
+                     backend=CAPTURE_BACKEND,
+                     backend_options=CAPTURE_BACKEND_OPTIONS,
+                     ring_size=FRAME_RING_SIZE)
     frame = cam.get_frame()
     if frame is None:
         log.warning('Frame is None.')
@@ -104,14 +245,15 @@ def main():  # pylint: disable=R0912, R0915, R0914
                                               frame,
                                               zoom_pickup=.001)
 
-    detector = nn.TargetDetector(MODEL_CONFIG,
-                                 MODEL_WEIGHTS,
-                                 INPUT_WIDTH,
-                                 INPUT_HEIGHT,
-                                 CONF_THRESHOLD,
-                                 NMS_THRESHOLD,
-                                 CLASSES,
-                                 TRACKED_CLASS)
+    if DETECT_IN_PROCESS:
+        log.info('Running detection in a separate process.')
+        detect = FrameBusWorker(make_detect_function,
+                                ui.orient_frame(frame, ORIENTATION).shape)
+        class_names = CLASSES
+    else:
+        detector = make_detector()
+        detect = detector.detect
+        class_names = detector.class_names
 
     window_name = 'Detect, Track, Zoom'
 
@@ -123,7 +265,35 @@ def main():  # pylint: disable=R0912, R0915, R0914
     logs.log_configuration(log, configs)
 
     if RECORD:
-        recorder = ImageStreamRecorder(configs['RECORD_FOLDER'])
+        recorder = ImageStreamRecorder(configs['RECORD_FOLDER'],
+                                       queue_size=RECORD_QUEUE_SIZE,
+                                       writer_threads=RECORD_WRITER_THREADS,
+                                       overflow=RECORD_OVERFLOW,
+                                       jpeg_quality=RECORD_JPEG_QUALITY,
+                                       burst_quality=RECORD_BURST_QUALITY,
+                                       segments=RECORD_IMAGE_SEGMENTS,
+                                       segment_bytes=RECORD_SEGMENT_MB * 2**20,
+                                       segment_seconds=RECORD_SEGMENT_SECONDS,
+                                       database=RECORD_DATABASE)
+    record_shape = None
+    if RECORD and RECORD_PASSTHROUGH:
+        video_recorder = PassthroughRecorder(configs['RECORD_FOLDER'],
+                                             RECORD_SEGMENT_SECONDS)
+        if isinstance(cam, DualStreamCamera):
+            record_cam = cam.record_camera
+        else:
+            record_cam = cam
+        record_cam.add_packet_sink(video_recorder)
+        if not RECORD_ONLY_DETECTIONS:
+            video_recorder.start()
+        # boxes are recorded in the recorded stream's (oriented) frame
+        record_shape = ui.orient_frame(record_cam.get_frame(),
+                                       ORIENTATION).shape
+
+    if ASYNC_COMMANDS:
+        commander = PtzCommandQueue(ptz)
+    else:
+        commander = ptz
 
     # initialize position of camera
     zoom_command = 0
@@ -156,6 +326,7 @@ def main():  # pylint: disable=R0912, R0915, R0914
     frames_since_last_target = 10000
     frames_since_last_return = 10000
 
+    frame_seq = 0
     start_time = time.time()
     timelapse_delay_start_time = time.time()
 
@@ -167,19 +338,26 @@ def main():  # pylint: disable=R0912, R0915, R0914
         start_time = time.time()
         log.debug('     Loop time: %.1f milliseconds', elapsed_time)
 
-        pan, tilt, zoom = ptz.get_position()
-        raw_frame = cam.get_frame()
+        # only process each frame once
+        raw_frame, frame_seq, frame_time = cam.wait_for_new_frame(
+            frame_seq, timeout=1.0)
         if raw_frame is None:
-            print('Frame is None.')
+            # stream down: hold still rather than keep moving blind
+            health = cam.get_health()
+            log.warning('No new frame: stream %s, reconnects: %d.',
+                        health['state'], health['reconnects'])
+            commander.stop()
             continue
+        pan, tilt, zoom = ptz.get_position()
+        activity_started = False
 
         raw_frame = ui.orient_frame(raw_frame, ORIENTATION)
         frame = raw_frame.copy()
 
-        target_lbox = detector.detect(frame)
+        target_lbox = detect(frame)
 
         if target_lbox:
-            detected_class = detector.class_names[target_lbox['class_id']]
+            detected_class = class_names[target_lbox['class_id']]
             score = 100 * target_lbox['confidence']
 
             strng = ("[INFO] Detected: "
@@ -191,10 +369,12 @@ def main():  # pylint: disable=R0912, R0915, R0914
                                convert.command_to_degrees(tilt, 90),
                                convert.zoom_to_power(zoom, CAM_ZOOM_POWER)))
 
+            activity_started = (frames_since_last_target
+                                >= MIN_FRAMES_RECORD_PER_DETECT)
             frames_since_last_target = 0
             if DRAW_BOX:
                 draw.labeled_box(frame,
-                                 detector.class_names,
+                                 class_names,
                                  target_lbox,
                                  thickness=2,
                                  draw_label=False)
@@ -227,6 +407,8 @@ def main():  # pylint: disable=R0912, R0915, R0914
                    or not math.isclose(zoom, zoom_init, rel_tol=.05)):
                     log.info('Returning to home position.')
                     frames_since_last_return = 0
+                    if ASYNC_COMMANDS:
+                        commander.wait_until_sent()
                     ptz.absmove_w_zoom_waitfordone(pan_init,
                                                    tilt_init,
                                                    zoom_init,
@@ -243,21 +425,57 @@ def main():  # pylint: disable=R0912, R0915, R0914
             if ((RECORD_ONLY_DETECTIONS and target_lbox)
                or not RECORD_ONLY_DETECTIONS
                or frames_since_last_target < MIN_FRAMES_RECORD_PER_DETECT):
-                log.info('Recording activity frame.')
-                recorder.record_image(raw_frame,
-                                      (pan, tilt, zoom),
-                                      detected_class,
-                                      target_lbox)
+                if RECORD_PASSTHROUGH:
+                    # starts from the last keyframe, which gives some
+                    # pre-roll
+                    video_recorder.start()
+                    video_recorder.annotate(frame_time,
+                                            (pan, tilt, zoom),
+                                            detected_class,
+                                            scale_lbox(target_lbox,
+                                                       raw_frame.shape,
+                                                       record_shape))
+                else:
+                    log.info('Recording activity frame.')
+                    (record_frame,
+                     record_lbox,
+                     record_seq) = frame_to_record(cam,
+                                                   raw_frame,
+                                                   frame_seq,
+                                                   frame_time,
+                                                   target_lbox)
+                    if (RECORD_ONLY_DETECTIONS and target_lbox
+                       and activity_started and FRAME_RING_SIZE):
+                        record_pre_roll(cam,
+                                        recorder,
+                                        record_seq,
+                                        (pan, tilt, zoom))
+                    recorder.record_image(record_frame,
+                                          (pan, tilt, zoom),
+                                          detected_class,
+                                          record_lbox,
+                                          burst=True)
             elif (time.time() - timelapse_delay_start_time) > TIMELAPSE_DELAY:
                 now = datetime.now()
                 strng = now.strftime("%m/%d/%Y, %H:%M:%S")
                 log.info('Recording timelapse frame at %s', strng)
-                recorder.record_image(raw_frame,
+                record_frame, _, _ = frame_to_record(cam,
+                                                     raw_frame,
+                                                     frame_seq,
+                                                     frame_time,
+                                                     None)
+                recorder.record_image(record_frame,
                                       (pan, tilt, zoom),
                                       'n/a: timelapse frame',
                                       None)
                 timelapse_delay_start_time = time.time()
 
+            if (RECORD_PASSTHROUGH and video_recorder.recording
+               and RECORD_ONLY_DETECTIONS
+               and frames_since_last_target >= MIN_FRAMES_RECORD_PER_DETECT):
+                log.info('Activity over; stopping recording.')
+                video_recorder.stop()
+
         # run position controller on ptz system
         commands = motor_controller.update(x_err,
                                            y_err,
@@ -282,15 +500,32 @@ def main():  # pylint: disable=R0912, R0915, R0914
         log.debug('x_vel: %.2f || y_vel: %.2f', x_velocity, y_velocity)
 
         if x_velocity == 0 and y_velocity == 0 and zoom < 0.001:
-            ptz.stop()
+            commander.stop()
 
-        ptz.move_w_zoom(x_velocity, y_velocity, zoom_command)
+        commander.move_w_zoom(x_velocity, y_velocity, zoom_command)
 
         milliseconds = (time.perf_counter() - tic)*1000
         log.debug("This bit: %.1f milliseconds.", milliseconds)
 
+    if RECORD:
+        recorder.close()
+        log.info('Images queued: %d, dropped: %d, written: %d',
+                 recorder.counts['queued'],
+                 recorder.counts['dropped'],
+                 recorder.counts['written'])
+    if RECORD and RECORD_PASSTHROUGH:
+        record_cam.remove_packet_sink(video_recorder)
+        video_recorder.close()
     del cam
+    if DETECT_IN_PROCESS:
+        detect.close()
+    if ASYNC_COMMANDS:
+        commander.close(send_pending=False)
     ptz.stop()
+    log.info('PTZ commands sent: %d, suppressed: %d, coalesced: %d',
+             ptz.command_counts['sent'],
+             ptz.command_counts['suppressed'],
+             ptz.command_counts['coalesced'])
     if not HEADLESS:
         uih.clean_up()
 
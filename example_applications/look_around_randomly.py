@@ -37,6 +37,8 @@ PORT = configs['PORT']
 USER = configs['USER']
 PASS = configs['PASS']
 STREAM = configs['STREAM']
+# refresh PTZ status in the background this many times a second
+STATUS_POLL_RATE = configs.get('STATUS_POLL_RATE')
 
 # ptz camera setup constants
 INIT_POS = configs['INIT_POS']
@@ -50,7 +52,7 @@ HEADLESS = configs['HEADLESS']
 
 def main():
     # construct core objects
-    ptz = PtzCam(IP, PORT, USER, PASS)
+    ptz = PtzCam(IP, PORT, USER, PASS, status_poll_rate=STATUS_POLL_RATE)
     cam = Camera(ip=IP, user=USER, passwd=PASS, stream=STREAM)
     frame = cam.get_frame()
     if frame is None:
@@ -10,11 +10,6 @@ from datetime import datetime
 import yaml
 import numpy as np
 
-from ptzipcam import logs, ui, convert
-from ptzipcam.ptz_camera import PtzCam, MotorController
-from ptzipcam.camera import Camera
-from ptzipcam.io import ImageStreamRecorder
-
 try:
     from dnntools import neuralnetwork_coral as nn
 except ImportError as e:
@@ -23,6 +18,12 @@ except ImportError as e:
 
 from dnntools import draw
 
+from ptzipcam import logs, ui, convert
+from ptzipcam.motor_controllers import MotorController
+from ptzipcam.shared_ptz_cams import get_shared_ptz_cam
+from ptzipcam.camera import Camera
+from ptzipcam.io import ImageStreamRecorder
+
 log = logs.prep_log(logging.INFO)
 
 parser = argparse.ArgumentParser()
@@ -53,6 +54,8 @@ PORT = configs['PORT']
 USER = configs['USER']
 PASS = configs['PASS']
 STREAM = configs['STREAM']
+# refresh PTZ status in the background this many times a second
+STATUS_POLL_RATE = configs.get('STATUS_POLL_RATE')
 
 # ptz camera setup constants
 INIT_POS = configs['INIT_POS']
@@ -85,12 +88,14 @@ def assemble_diptych(cam_top, frame):
 
 if __name__ == '__main__':
     # construct core objects
-    ptz = PtzCam(IP, PORT, USER, PASS)
+    ptz = get_shared_ptz_cam(IP, PORT, USER, PASS,
+                             status_poll_rate=STATUS_POLL_RATE)
 
     bits = IP.split('.')
     new_end = str(int(bits[-1]) - 1)
     ip2 = '.'.join(bits[0:3] + [new_end])
-    ptz_top = PtzCam(ip2, PORT, USER, PASS)
+    ptz_top = get_shared_ptz_cam(ip2, PORT, USER, PASS,
+                                 status_poll_rate=STATUS_POLL_RATE)
     # cam = Camera()
     cam = Camera(ip=IP, user=USER, passwd=PASS, stream=STREAM)
     cam_top = Camera(ip=ip2, user=USER, passwd=PASS, stream=STREAM)
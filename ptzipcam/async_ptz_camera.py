@@ -0,0 +1,345 @@
+"""asyncio version of PtzCam for driving many cameras from one loop
+
+AsyncPtzCam mirrors the PtzCam API with coroutine methods.  The PTZ
+operations go out as pre-serialized SOAP (see ptzipcam.soap) over an
+aiohttp session, so one event loop can keep requests in flight to any
+number of cameras at once without a thread per camera.
+
+Discovery and imaging settings are rare and involved enough that they
+are still done by a regular PtzCam, run in the loop's default executor
+so they don't block the loop either.
+
+That PtzCam is the process-wide one for the camera, and PTZ commands
+go through its bookkeeping (PtzCam.claim_command) as if it had sent
+them: a move cancels a stop it is holding back, and, with its
+command_tolerance, a move repeating the last one sent (by either) is
+suppressed.  So the two can be used together, though commands from
+both at once still race at the camera.  Status is answered from its
+status poller's cache (PtzCam.cached_status) when that is fresh
+enough.
+
+Requires aiohttp (pip install ptzipcam[async]).
+
+"""
+import asyncio
+import functools
+import logging
+import time
+
+from onvif.exceptions import ONVIFError
+
+from ptzipcam.ptz_camera import STOP_VELOCITY, _check_zeroness
+from ptzipcam.shared_ptz_cams import get_shared_ptz_cam
+from ptzipcam.soap import PtzRequestTemplates, parse_status, check_response
+from ptzipcam.status_poller import PtzStatus
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+log = logging.getLogger(__name__)
+
+
+class AsyncPtzCam():  # pylint: disable=too-many-public-methods
+    """Coroutine-based control of PTZ on ONVIF-compliant PTZ IP Camera
+
+    Don't construct directly; use ``await AsyncPtzCam.create(...)``.
+
+    Parameters
+    ----------
+    ptz_cam : PtzCam
+        Already-connected PtzCam used for discovery and imaging.
+    user : str
+        Valid username of account on the IP camera.
+    pword : str
+        Password for the account on the IP camera.
+    session : aiohttp.ClientSession
+        Session the PTZ requests are sent over.
+    timeout : float
+        Seconds to wait for the camera before giving up on a request.
+    owns_session : bool
+        Whether close() should close session.
+
+    """
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 ptz_cam,
+                 user,
+                 pword,
+                 session,
+                 timeout=5.0,
+                 owns_session=False):
+        self.ptz_cam = ptz_cam
+        self.session = session
+        self.owns_session = owns_session
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.address = ptz_cam.xaddrs['ptz']
+
+        self.templates = PtzRequestTemplates(user,
+                                             pword,
+                                             ptz_cam.profile_token,
+                                             ptz_cam.default_speed)
+
+    @classmethod
+    async def create(cls,  # pylint: disable=too-many-arguments
+                     ip_address=None,
+                     port='80',
+                     user=None,
+                     pword=None,
+                     session=None,
+                     timeout=5.0):
+        """Connect to a camera and return an AsyncPtzCam for it
+
+        The PtzCam used for discovery and imaging is the process-wide
+        one for the camera (see get_shared_ptz_cam).
+
+        Parameters
+        ----------
+        ip_address : str
+           The IP address of the camera to connect to.
+        port : str
+           ONVIF port on the camera. This is usually 80
+        user : str
+           Valid username of account on the IP camera being connected to.
+        pword : str
+           Password for the account on the IP camera.
+        session : aiohttp.ClientSession, optional
+           Session to send requests over. Sharing one session across
+           cameras shares its connection pool. If not given, the
+           AsyncPtzCam makes its own (closed by close()).
+        timeout : float
+           Seconds to wait for the camera before giving up on a request.
+
+        """
+        if aiohttp is None:
+            raise ImportError('AsyncPtzCam requires aiohttp. '
+                              'Install it with: pip install aiohttp')
+
+        loop = asyncio.get_running_loop()
+        ptz_cam = await loop.run_in_executor(
+            None,
+            functools.partial(get_shared_ptz_cam,
+                              ip_address, port, user, pword))
+
+        owns_session = session is None
+        if owns_session:
+            session = aiohttp.ClientSession()
+
+        return cls(ptz_cam, user, pword, session, timeout, owns_session)
+
+    async def _post(self, operation, envelope):
+        try:
+            async with self.session.post(
+                    self.address,
+                    data=envelope,
+                    headers=self.templates.headers[operation],
+                    timeout=self.timeout) as response:
+                content = await response.read()
+                check_response(operation,
+                               response.status,
+                               content,
+                               response.reason)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            raise ONVIFError(err) from err
+
+        return content
+
+    async def _run_in_executor(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, function, *args)
+
+    async def _send_command(self, operation, render, velocity=None):
+        """Send a PTZ command unless the shared PtzCam finds it redundant
+
+        render renders the command's envelope.  A continuous move
+        replacing a stop the PtzCam was holding back may go out as a
+        stop instead (see PtzCam.claim_command).
+
+        """
+        operation = self.ptz_cam.claim_command(operation, velocity)
+        if operation is None:
+            return
+        if operation == 'Stop':
+            render = self.templates.stop
+
+        try:
+            await self._post(operation, render())
+        except ONVIFError:
+            self.ptz_cam.rollback_command(velocity)
+            raise
+
+    async def get_status(self, max_age=None):
+        """Get pan, tilt, zoom, and move status
+
+        Parameters
+        ----------
+        max_age : float, optional
+            As for PtzCam.get_status: with the shared PtzCam's status
+            poller running, its cached status is returned if no older
+            than this (any age if None) instead of asking the camera.
+
+        Returns
+        -------
+        status : PtzStatus
+
+        """
+        status = self.ptz_cam.cached_status(max_age)
+        if status is not None:
+            return status
+
+        content = await self._post('GetStatus', self.templates.get_status())
+        pan, tilt, zoom, move_status = parse_status(content)
+        return PtzStatus(pan, tilt, zoom, move_status, time.monotonic())
+
+    async def get_position(self, max_age=None):
+        """Get pan, tilt, and zoom
+
+        See get_status for max_age.
+
+        """
+        status = await self.get_status(max_age)
+        return status.pan, status.tilt, status.zoom
+
+    async def move(self, x_velocity, y_velocity):
+        """Continuous pan/tilt move
+
+        """
+        await self.move_w_zoom(x_velocity, y_velocity, 0.0)
+
+    async def move_w_zoom(self, x_velocity, y_velocity, zoom_command):
+        """Continuous pan/tilt/zoom move
+
+        """
+        x_velocity = float(_check_zeroness(x_velocity))
+        y_velocity = float(_check_zeroness(y_velocity))
+        zoom_command = _check_zeroness(zoom_command)
+
+        velocity = (x_velocity, y_velocity, zoom_command)
+        await self._send_command(
+            'ContinuousMove',
+            functools.partial(self.templates.continuous_move, *velocity),
+            velocity)
+
+    async def absmove_w_zoom(self, pan_pos, tilt_pos, zoom_pos):
+        """Move to an absolute pan, tilt, zoom state
+
+        See PtzCam.absmove_w_zoom for the ranges.
+
+        """
+        await self._send_command(
+            'AbsoluteMove',
+            functools.partial(self.templates.absolute_move,
+                              _check_zeroness(pan_pos),
+                              _check_zeroness(tilt_pos),
+                              _check_zeroness(zoom_pos)))
+
+    async def absmove(self, x_pos, y_pos, max_age=None):
+        """Move to an absolute pan, tilt, keeping the current zoom
+
+        The current zoom comes from the status poller's cache if it is
+        running (see get_status for max_age).
+
+        """
+        _, _, zoom = await self.get_position(max_age)
+        await self.absmove_w_zoom(x_pos, y_pos, zoom)
+
+    async def zoom(self, zoom_command, max_age=None):
+        """Zoom to an absolute zoom, keeping the current pan and tilt
+
+        The current pan and tilt come from the status poller's cache
+        if it is running (see get_status for max_age).
+
+        """
+        pan, tilt, _ = await self.get_position(max_age)
+        await self.absmove_w_zoom(pan, tilt, zoom_command)
+
+    async def zoom_out_full(self):
+        """Zoom all the way out, keeping the current pan and tilt
+
+        """
+        await self.zoom(0.0)
+
+    async def zoom_in_full(self):
+        """Zoom all the way in, keeping the current pan and tilt
+
+        """
+        await self.zoom(1.0)
+
+    async def stop(self):
+        """Stop all PTZ motion
+
+        Unlike PtzCam.stop, the stop is sent right away rather than
+        held back for coalescing, though one repeating the last
+        command sent is still suppressed with command_tolerance set.
+
+        """
+        await self._send_command('Stop', self.templates.stop, STOP_VELOCITY)
+
+    async def get_exposure(self):
+        """Get the exposure time, gain, and iris
+
+        """
+        return await self._run_in_executor(self.ptz_cam.get_exposure)
+
+    async def set_exposure_to_auto(self):
+        """Set the exposure mode to auto
+
+        """
+        await self._run_in_executor(self.ptz_cam.set_exposure_to_auto)
+
+    async def set_focus_to_auto(self):
+        """Set the focus mode to auto
+
+        """
+        await self._run_in_executor(self.ptz_cam.set_focus_to_auto)
+
+    async def set_focus_to_manual(self):
+        """Set the focus mode to manual
+
+        """
+        await self._run_in_executor(self.ptz_cam.set_focus_to_manual)
+
+    async def set_exposure_time(self, exposure_time):
+        """Set the exposure time (exposure mode manual)
+
+        """
+        await self._run_in_executor(self.ptz_cam.set_exposure_time,
+                                    exposure_time)
+
+    async def set_iris(self, iris):
+        """Set the iris (exposure mode manual)
+
+        """
+        await self._run_in_executor(self.ptz_cam.set_iris, iris)
+
+    async def set_gain(self, gain):
+        """Set the gain (exposure mode manual)
+
+        """
+        await self._run_in_executor(self.ptz_cam.set_gain, gain)
+
+    async def focus_out(self):
+        """Start focusing out (continuously, until focus_stop)
+
+        """
+        await self._run_in_executor(self.ptz_cam.focus_out)
+
+    async def focus_in(self):
+        """Start focusing in (continuously, until focus_stop)
+
+        """
+        await self._run_in_executor(self.ptz_cam.focus_in)
+
+    async def focus_stop(self):
+        """Stop focusing
+
+        """
+        await self._run_in_executor(self.ptz_cam.focus_stop)
+
+    async def close(self):
+        """Close the HTTP session if this AsyncPtzCam made it
+
+        """
+        if self.owns_session:
+            await self.session.close()
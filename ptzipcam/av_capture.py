@@ -0,0 +1,210 @@
+"""Capture backend built on PyAV instead of OpenCV's FFmpeg backend
+
+AvCapture demuxes and decodes a stream with PyAV behind the same
+read()/grab()/retrieve()/release() interface as cv2.VideoCapture, so
+Camera can use either (see Camera's backend).  Going through PyAV
+gives control OpenCV does not:
+
+- the decoder's threading (thread_type and threads);
+- each frame's presentation timestamp and how long after its packet
+  came in it was decoded (pts_time and decode_latency);
+- the compressed packets themselves, for recording them without
+  re-encoding (packet_sinks);
+- converting decoded frames straight to the size and pixel format
+  wanted, in one step (width, height, and pixel_format).
+
+Requires PyAV (pip install av).
+
+"""
+import collections
+import logging
+import time
+
+try:
+    import av
+except ImportError:
+    av = None
+
+log = logging.getLogger(__name__)
+
+# decoder threads for live streams; with frame threading each thread
+# past the first holds back a frame, so this bounds the latency added
+LIVE_STREAM_THREADS = 2
+
+
+def _is_live(address):
+    """Whether address is a stream (e.g. rtsp://...) rather than a file
+
+    """
+    return '://' in address and not address.startswith('file:')
+
+
+class AvCapture():  # pylint: disable=too-many-instance-attributes
+    """Captures a video stream or file with PyAV
+
+    Parameters
+    ----------
+    address : str
+        Stream URL (e.g. rtsp://...) or filename.
+    options : dict, optional
+        FFmpeg options for opening it (e.g. Camera's
+        LOW_LATENCY_OPTIONS or {'rtsp_transport': 'tcp'}).
+    timeout : float or tuple, optional
+        Seconds to wait for the stream to open and then for each read,
+        or an (open, read) tuple.
+    threads : int, optional
+        Decoder threads; 0 to pick by the number of cores.  If not
+        given, LIVE_STREAM_THREADS for streams and 0 for files.
+    thread_type : str
+        'SLICE', 'FRAME', or 'AUTO' (both).  Frame threading decodes
+        several frames at once, which holds back a frame per extra
+        thread; slice threading does not, but only helps with streams
+        encoded in several slices, which camera streams seldom are.
+        See utilities/benchmark_decode.py for the tradeoff measured.
+    width, height : int, optional
+        Size to convert frames to as they are retrieved; the stream's
+        own if not given.
+    pixel_format : str
+        Pixel format of retrieved frames.
+    skip_frame : str, optional
+        Frames for the decoder to skip, by FFmpeg's AVDiscard names:
+        e.g. 'NONKEY' only decodes keyframes, for when a frame every
+        keyframe interval is enough (say, to detect on while recording
+        the packets, see packet_sinks).
+
+    Attributes
+    ----------
+    stream : av.video.stream.VideoStream
+        The video stream being decoded.
+    packet_sinks : list
+        Callables each demuxed packet of the video stream is passed to
+        before it is decoded.
+    pts_time : float
+        Presentation time in seconds of the frame last grabbed.
+    decode_latency : float
+        Seconds from the frame last grabbed's packet being demuxed to
+        the frame coming out of the decoder.
+
+    """
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 address,
+                 options=None,
+                 timeout=None,
+                 threads=None,
+                 thread_type='AUTO',
+                 width=None,
+                 height=None,
+                 pixel_format='bgr24',
+                 skip_frame=None):
+        if av is None:
+            raise ImportError('AvCapture requires PyAV. '
+                              'Install it with: pip install av')
+
+        self.address = address
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.packet_sinks = []
+        self.pts_time = None
+        self.decode_latency = None
+
+        self.container = av.open(address,
+                                 options=dict(options or {}),
+                                 timeout=timeout)
+        self.stream = self.container.streams.video[0]
+        if threads is None:
+            threads = LIVE_STREAM_THREADS if _is_live(address) else 0
+        self.stream.codec_context.thread_type = thread_type
+        self.stream.codec_context.thread_count = threads
+        if skip_frame is not None:
+            self.stream.codec_context.skip_frame = skip_frame
+
+        self._packets = self.container.demux(self.stream)
+        self._decoded = collections.deque()
+        self._demuxed_at = {}
+        self._frame = None
+        self.released = False
+
+    def _decode(self):
+        """Demux and decode packets until there is a decoded frame
+
+        """
+        while not self._decoded:
+            packet = next(self._packets)
+            for sink in self.packet_sinks:
+                sink(packet)
+            if packet.pts is not None:
+                self._demuxed_at[packet.pts] = time.monotonic()
+            self._decoded.extend(packet.decode())
+
+    def grab(self):
+        """Decode the next frame (as in cv2.VideoCapture)
+
+        Returns False at the end of the stream or on an error.
+
+        """
+        if self.released:
+            return False
+        try:
+            self._decode()
+        except StopIteration:
+            return False
+        except (av.error.FFmpegError, OSError) as e:
+            log.debug('Reading %s failed: %s', self.address, e)
+            return False
+
+        frame = self._decoded.popleft()
+        self._frame = frame
+        if frame.pts is None:
+            self.pts_time = None
+            self.decode_latency = None
+        else:
+            self.pts_time = float(frame.pts * frame.time_base)
+            demuxed_at = self._demuxed_at.pop(frame.pts, None)
+            self.decode_latency = (None if demuxed_at is None
+                                   else time.monotonic() - demuxed_at)
+            # packets whose frames were dropped
+            for pts in [pts for pts in self._demuxed_at if pts < frame.pts]:
+                del self._demuxed_at[pts]
+        return True
+
+    def retrieve(self, image=None):  # pylint: disable=unused-argument
+        """Convert the frame last grabbed to an array
+
+        The frame is converted to width x height and pixel_format in
+        one step.  image is accepted for compatibility with
+        cv2.VideoCapture but ignored: PyAV converts into an array of
+        its own, so a new array is always returned (copying it into
+        image would only add a copy), and a Camera's FrameRing keeps
+        these arrays rather than reusing its own.
+
+        """
+        if self._frame is None:
+            return False, None
+        return True, self._frame.to_ndarray(width=self.width,
+                                            height=self.height,
+                                            format=self.pixel_format)
+
+    def read(self, image=None):
+        """Decode and return the next frame (as in cv2.VideoCapture)
+
+        """
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def isOpened(self):  # pylint: disable=invalid-name
+        """Whether the stream is open (as in cv2.VideoCapture)
+
+        """
+        return not self.released
+
+    def release(self):
+        """Close the stream
+
+        """
+        if not self.released:
+            self.released = True
+            self._frame = None
+            self.container.close()
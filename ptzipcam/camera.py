@@ -1,92 +1,444 @@
 """Elements for image capture aspects of network cameras
 
 """
+import contextlib
+import functools
 import logging
+import os
 import threading
+import time
+
 import cv2
 
-# latest_frame = None
-# latest_frame_return = None
-# lo = threading.Lock()
+from ptzipcam.frame_buffers import FrameRing, LatestFrameBuffer
+from ptzipcam.frame_sources import open_capture, open_frame_source
+from ptzipcam.stream_health import STALL_TIMEOUT, StreamHealth
 
 log = logging.getLogger(__name__)
 
+# seconds to wait before reading again after a failed read
+READ_RETRY_DELAY = .01
+
+# environment variable OpenCV reads FFmpeg options for opening streams
+# from, as key;value pairs separated by |
+FFMPEG_OPTIONS_VARIABLE = 'OPENCV_FFMPEG_CAPTURE_OPTIONS'
+# FFmpeg options for a stream to be passed on as soon as it comes in:
+# no input buffering or reordering, and as little probing as possible
+# before the first frame
+LOW_LATENCY_OPTIONS = {'fflags': 'nobuffer',
+                       'flags': 'low_delay',
+                       'analyzeduration': '0',
+                       'probesize': '32768',
+                       'max_delay': '0',
+                       'reorder_queue_size': '0'}
+
+_ffmpeg_options_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def ffmpeg_capture_options(options):
+    """Open cv2.VideoCaptures with these FFmpeg options in the with block
+
+    OpenCV only takes FFmpeg options through an environment variable,
+    so it is set for the duration of the block (one block at a time)
+    and then restored.
+
+    Parameters
+    ----------
+    options : dict
+        FFmpeg option names and values, e.g. {'rtsp_transport': 'tcp'}.
+
+    """
+    if not options:
+        yield
+        return
+
+    with _ffmpeg_options_lock:
+        previous = os.environ.get(FFMPEG_OPTIONS_VARIABLE)
+        os.environ[FFMPEG_OPTIONS_VARIABLE] = '|'.join(
+            f'{key};{value}' for key, value in options.items())
+        try:
+            yield
+        finally:
+            if previous is None:
+                del os.environ[FFMPEG_OPTIONS_VARIABLE]
+            else:
+                os.environ[FFMPEG_OPTIONS_VARIABLE] = previous
+
 
-def camera_thread_function(cap, frame):
-    """Thread function to constantly capture frames
+def _read_into(read, image):
+    """Call a cv2.VideoCapture-style read or retrieve, into image if given
 
     """
-    # global latest_frame, lo, latest_frame_return
-    while True:
-        # with lo:
-        # latest_frame_return, latest_frame = cap.read()
-        _, frame[0] = cap.read()
+    if image is None:
+        return read()
+    return read(image)
+
 
+def _rtsp_address(ip, user, passwd,  # pylint: disable=too-many-arguments
+                  stream, rtsp_port, cam_brand):
+    """Build the address of a camera's RTSP stream
+
+    """
+    if cam_brand == 'axis':
+        stream_string = (':'
+                         + str(rtsp_port)
+                         + '/axis-media/media.amp')
+    elif cam_brand == 'hikvision':
+        stream_string = (':'
+                         + str(rtsp_port)
+                         + '/Streaming/Channels/10'
+                         + str(stream))
+    else:
+        print('[ERROR] Camera type not recognized.')
 
-class Camera():
+    address = ('rtsp://'
+               + user
+               + ':'
+               + passwd
+               + '@'
+               + ip
+               + stream_string)
+    return address
+
+
+class Camera():  # pylint: disable=too-many-instance-attributes
     """Handles image capture from network camera
 
+    Parameters
+    ----------
+    ip, user, passwd, stream, rtsp_port, cam_brand
+        Where to find the camera's RTSP stream.
+    source : str or frame source, optional
+        Capture from this instead of the camera's RTSP stream: a
+        configuration string for ptzipcam.frame_sources.open_frame_source
+        (e.g. 'synthetic:1280x720@25') or an object with the read() and
+        release() of cv2.VideoCapture. The camera arguments are then
+        ignored.
+    decode_on_demand : bool
+        Only decode the frames that are asked for: frames are still
+        grabbed off the stream as they arrive but only retrieved as
+        images while someone is waiting in wait_for_new_frame (or
+        get_frame), which saves the capture thread the work for frames
+        nobody uses.  Captures without grab() and retrieve() are read
+        as usual.
+    decode_rate : float, optional
+        With decode_on_demand, also decode at least this many frames a
+        second.
+    ring_size : int, optional
+        Capture into a FrameRing of this many preallocated frames
+        instead of allocating each frame, which also keeps them
+        available as pre-roll (see borrow_frame and pre_roll).  A
+        source object must then accept the array to read into, as
+        cv2.VideoCapture.read does.
+    stall_timeout : float
+        Seconds without a frame before the stream is considered
+        stalled and, with reconnect, reopened.  Also the timeout for
+        opening and reading the camera's stream.
+    reconnect : bool
+        Reopen the stream when it stalls or fails, waiting
+        RECONNECT_DELAY before the first attempt and twice as long
+        before each further one (up to MAX_RECONNECT_DELAY; see
+        ptzipcam.stream_health).  A source object cannot be reopened.
+    low_latency : bool
+        Open the stream with LOW_LATENCY_OPTIONS so frames are passed
+        on as soon as they come in rather than after FFmpeg has
+        buffered a few.
+    rtsp_transport : str, optional
+        'tcp' or 'udp' for the RTSP stream's transport.  If not given
+        it is TCP, as OpenCV opens streams by default: once any FFmpeg
+        options are set (e.g. low_latency), OpenCV's defaults no longer
+        apply, so 'tcp' is set along with them rather than fall back to
+        FFmpeg's UDP.  UDP has less latency, TCP survives lossy
+        networks (e.g. Wi-Fi) without smeared or corrupted frames.
+    backend : str
+        Capture backend: 'opencv' for cv2.VideoCapture or 'pyav' for
+        ptzipcam.av_capture.AvCapture, which can decode with threads,
+        convert frames straight to a given size, and hand over the
+        compressed packets (see AvCapture).
+    backend_options : dict, optional
+        Passed on to AvCapture (e.g. threads, thread_type, width,
+        height).
+
     """
 
     # def __init__(self, address='udp://127.0.0.1:5000'):
-    def __init__(self,
-                 ip,
-                 user,
-                 passwd,
+    def __init__(self,  # pylint: disable=R0913, R0914
+                 ip=None,
+                 user=None,
+                 passwd=None,
                  stream=3,
                  rtsp_port=554,
-                 cam_brand='hikvision'):
-
-        if cam_brand == 'axis':
-            stream_string = (':'
-                             + str(rtsp_port)
-                             + '/axis-media/media.amp')
-        elif cam_brand == 'hikvision':
-            stream_string = (':'
-                             + str(rtsp_port)
-                             + '/Streaming/Channels/10'
-                             + str(stream))
+                 cam_brand='hikvision',
+                 source=None,
+                 decode_on_demand=False,
+                 decode_rate=None,
+                 ring_size=None,
+                 stall_timeout=STALL_TIMEOUT,
+                 reconnect=True,
+                 low_latency=False,
+                 rtsp_transport=None,
+                 backend='opencv',
+                 backend_options=None):
+
+        if ring_size:
+            self.frame_buffer = FrameRing(ring_size)
         else:
-            print('[ERROR] Camera type not recognized.')
-
-        address = ('rtsp://'
-                   + user
-                   + ':'
-                   + passwd
-                   + '@'
-                   + ip
-                   + stream_string)
-        self.frame = [None]
-        # self.cap = cv2.VideoCapture(address, cv2.CAP_FFMPEG)
-        self.cap = cv2.VideoCapture(address)
-        _, self.frame[0] = self.cap.read()
-
-        self.cam_thread = threading.Thread(target=camera_thread_function,
-                                           args=(self.cap, self.frame))
+            self.frame_buffer = LatestFrameBuffer()
+        self.decode_on_demand = decode_on_demand
+        self.decode_rate = decode_rate
+        self.stall_timeout = stall_timeout
+        self.reconnect = reconnect
+
+        self.capture_options = {}
+        if low_latency:
+            self.capture_options.update(LOW_LATENCY_OPTIONS)
+        if self.capture_options or rtsp_transport:
+            self.capture_options['rtsp_transport'] = rtsp_transport or 'tcp'
+        self.backend = backend
+        self.backend_options = dict(backend_options or {})
+        if backend == 'pyav':
+            self.backend_options.setdefault('options', self.capture_options)
+            self.backend_options.setdefault('timeout', stall_timeout)
+
+        self.packet_sinks = []
+        self._health = StreamHealth(stall_timeout)
+
+        # set before opening, which can fail, for release() to go by
+        self.cap = None
+        self.cam_thread = None
+        self._stop_capture = threading.Event()
+
+        if source is None:
+            self._address = _rtsp_address(ip, user, passwd,
+                                          stream, rtsp_port, cam_brand)
+            self._opener = self._open_rtsp
+        elif isinstance(source, str):
+            log.info('Capturing from frame source %s', source)
+            self._address = source
+            self._opener = functools.partial(open_frame_source,
+                                             source,
+                                             backend,
+                                             **self.backend_options)
+        else:
+            self._address = None
+            self._opener = None
+        self.cap = self._open() if self._opener is not None else source
+
+        ret, frame = _read_into(self.cap.read, self.frame_buffer.next_buffer())
+        if ret and frame is not None:
+            now = time.monotonic()
+            self._health.frame_arrived(now)
+            self.frame_buffer.put(frame, now)
+
+        self.cam_thread = threading.Thread(target=self._capture_frames)
         self.cam_thread.daemon = True
         self.cam_thread.start()
 
+    def _open(self):
+        """Open the stream with capture_options
+
+        """
+        self._health.opening()
+        try:
+            with ffmpeg_capture_options(self.capture_options):
+                cap = self._opener()
+        finally:
+            self._health.opened()
+        if self.packet_sinks:
+            cap.packet_sinks.extend(self.packet_sinks)
+        return cap
+
+    def _open_rtsp(self):
+        """Open the camera's RTSP stream
+
+        """
+        if self.backend != 'opencv':
+            return open_capture(self._address,
+                                self.backend,
+                                **self.backend_options)
+        if hasattr(cv2, 'CAP_PROP_READ_TIMEOUT_MSEC'):
+            timeout = int(1000 * self.stall_timeout)
+            return cv2.VideoCapture(self._address,
+                                    cv2.CAP_FFMPEG,
+                                    [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout,
+                                     cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout])
+        return cv2.VideoCapture(self._address)
+
+    def _read(self, on_demand, decode_due):
+        """Read the next frame of the stream for _capture_frames
+
+        Returns whether the stream delivered a frame and the frame,
+        which is None if it was grabbed but not retrieved.
+
+        """
+        if not on_demand:
+            ret, frame = _read_into(self.cap.read,
+                                    self.frame_buffer.next_buffer())
+            return ret and frame is not None, frame
+
+        if not self.cap.grab():
+            return False, None
+        if not (self.frame_buffer.wanted or decode_due()):
+            return True, None
+        ret, frame = _read_into(self.cap.retrieve,
+                                self.frame_buffer.next_buffer())
+        return ret and frame is not None, frame
+
+    def _capture_frames(self):
+        """Thread function to constantly capture frames
+
+        Reads frames into frame_buffer (into the arrays from its
+        next_buffer(), if any) until release() is called.  Failed reads
+        are retried after READ_RETRY_DELAY; once there have been no
+        frames for stall_timeout, the stream is reopened with backoff,
+        also when reopening it fails.
+
+        """
+        on_demand = (self.decode_on_demand
+                     and hasattr(self.cap, 'grab')
+                     and hasattr(self.cap, 'retrieve'))
+        decode_interval = 1/self.decode_rate if self.decode_rate else None
+        last_decode = float('-inf')
+
+        def decode_due():
+            nonlocal last_decode
+            if (decode_interval is None
+               or time.monotonic() - last_decode < decode_interval):
+                return False
+            last_decode = time.monotonic()
+            return True
+
+        try:
+            while not self._stop_capture.is_set():
+                ret, frame = self._read(on_demand, decode_due)
+                now = time.monotonic()
+                if ret:
+                    self._health.frame_arrived(now)
+                    if frame is not None:
+                        self.frame_buffer.put(frame, now)
+                    continue
+
+                if (not self.reconnect or self._opener is None
+                   or not self._health.stalled(now)):
+                    self._stop_capture.wait(READ_RETRY_DELAY)
+                    continue
+
+                if self._stop_capture.wait(self._health.reconnecting(now)):
+                    break
+                self.cap.release()
+                try:
+                    self.cap = self._open()
+                except Exception as e:  # pylint: disable=broad-except
+                    # e.g. av.error.FileNotFoundError; reads of the
+                    # released capture fail until the next attempt
+                    log.warning('Reopening stream failed: %s', e)
+        finally:
+            self._health.stopped()
+            self.frame_buffer.stop()
+
+    def add_packet_sink(self, sink):
+        """Pass each compressed packet of the stream to sink
+
+        Requires the 'pyav' backend (see AvCapture's packet_sinks).
+        sink (e.g. a video_writer.PassthroughRecorder) is called from
+        the capture thread, and kept when the stream is reopened.
+
+        """
+        if not hasattr(self.cap, 'packet_sinks'):
+            raise ValueError('Packets are only available with the pyav '
+                             'backend.')
+        self.packet_sinks.append(sink)
+        self.cap.packet_sinks.append(sink)
+
+    def remove_packet_sink(self, sink):
+        """Stop passing packets to sink
+
+        """
+        self.packet_sinks.remove(sink)
+        self.cap.packet_sinks.remove(sink)
+
+    def get_health(self):
+        """Get the health of the stream
+
+        See StreamHealth.report.
+
+        """
+        return self._health.report()
+
     def get_frame(self):
         """Grab frame from RTSP stream
 
+        Returns the latest frame, which may be one already returned.
+        Use wait_for_new_frame to only get each frame once.  With
+        decode_on_demand, the next frame is waited for (up to a
+        second) so that the frame returned is current.
+
         """
-        # if (latest_frame_return is not None) and (latest_frame is not None):
-        #     self.frame = latest_frame.copy()
+        frame, seq, _ = self.frame_buffer.get()
+        if self.decode_on_demand:
+            new_frame, _, _ = self.wait_for_new_frame(seq, timeout=1.0)
+            if new_frame is not None:
+                frame = new_frame
+        return frame
+
+    def wait_for_new_frame(self, after_seq=0, timeout=None):
+        """Wait for a frame newer than after_seq
 
-        return self.frame[0]
+        See LatestFrameBuffer.wait_for_new_frame: returns (frame, seq,
+        timestamp), with frame None on timeout or once the camera is
+        released.
+
+        """
+        return self.frame_buffer.wait_for_new_frame(after_seq, timeout)
+
+    def borrow_frame(self, after_seq=0, timeout=None):
+        """Wait for a frame newer than after_seq without copying it
+
+        With a ring_size, the frame is the one in the ring and must be
+        given back with release_frame(seq) once done with (and not
+        modified).  See FrameRing.borrow.
+
+        """
+        return self.frame_buffer.borrow(after_seq, timeout)
+
+    def release_frame(self, seq):
+        """Give back a frame from borrow_frame or pre_roll
+
+        """
+        self.frame_buffer.release(seq)
+
+    def pre_roll(self, count=None):
+        """Borrow the last count (or all) frames kept, oldest first
+
+        Returns a list of (frame, seq, timestamp), each to be given back
+        with release_frame(seq).  Without a ring_size only the latest
+        frame is kept.
+
+        """
+        return self.frame_buffer.pre_roll(count)
 
     def get_resolution(self):
         """Get resolution of current camera stream
 
         """
-        return self.frame[0].shape[1], self.frame[0].shape[0]
+        frame = self.get_frame()
+        return frame.shape[1], frame.shape[0]
 
     def release(self):
         """Release the cv2.VideoCapture object
 
+        The capture thread is stopped first: releasing the capture
+        while it is being read from can crash.
+
         """
         log.info("Release camera object's capture object.")
-        self.cap.release()
+        self._stop_capture.set()
+        self.frame_buffer.stop()
+        if self.cam_thread is not None:
+            self.cam_thread.join(timeout=2.0)
+        if self.cap is not None:
+            self.cap.release()
 
     def __del__(self):
         """Destructor
@@ -99,4 +451,4 @@ class Camera():
         """
 
         log.info('Camera object deletion')
-        self.cap.release()
+        self.release()
@@ -0,0 +1,167 @@
+"""Deduplication and coalescing of PTZ commands
+
+Control loops send a continuous move every frame whether or not the
+velocity changed, and often stop the camera only to start it moving
+again a frame later.  Each of those commands costs a round trip to
+the camera.  CommandDeduplicator keeps track of what was last sent so
+that PtzCam (and anything sending commands along with it, e.g.
+AsyncPtzCam) can leave out the ones that would change nothing.
+
+"""
+import threading
+import time
+
+STOP_VELOCITY = (0.0, 0.0, 0.0)
+
+
+class CommandDeduplicator():  # pylint: disable=too-many-instance-attributes
+    """Bookkeeping of the PTZ commands sent to a camera
+
+    A continuous move (or stop) within tolerance of the last velocity
+    sent is suppressed, and a stop can be held back briefly so that a
+    move right after it replaces it.  The bookkeeping is done under a
+    lock of its own, held only briefly and never while anything is
+    sent.
+
+    Parameters
+    ----------
+    tolerance : float, optional
+        Velocity difference below which a continuous move repeats the
+        last one.  If None, nothing is suppressed or held back.
+    keepalive_interval : float, optional
+        Seconds after which an unchanged continuous move is sent again
+        anyway.
+    stop_coalesce_window : float
+        Seconds a stop is held back for a move to replace it.
+
+    Attributes
+    ----------
+    counts : dict
+        Numbers of commands 'sent', 'suppressed', and 'coalesced' (a
+        move sent in place of a stop).
+
+    """
+
+    def __init__(self, tolerance=None, keepalive_interval=None,
+                 stop_coalesce_window=.05):
+        self.tolerance = tolerance
+        self.keepalive_interval = keepalive_interval
+        self.stop_coalesce_window = stop_coalesce_window
+        self.counts = {'sent': 0, 'suppressed': 0, 'coalesced': 0}
+        self._last_velocity = None
+        self._last_command_time = 0.0
+        self._pending_stop = None
+        self._lock = threading.Lock()
+
+    def _is_redundant(self, velocity):
+        """Check if velocity would just repeat the last command sent
+
+        """
+        if self.tolerance is None or self._last_velocity is None:
+            return False
+
+        for new, last in zip(velocity, self._last_velocity):
+            if abs(new - last) > self.tolerance:
+                return False
+
+        if self.keepalive_interval is not None:
+            since_last = time.monotonic() - self._last_command_time
+            if since_last >= self.keepalive_interval:
+                return False
+
+        return True
+
+    def _cancel_pending_stop(self):
+        """Drop a deferred stop, returning whether there was one
+
+        """
+        if self._pending_stop is None:
+            return False
+
+        self._pending_stop.cancel()
+        self._pending_stop = None
+        return True
+
+    def claim(self, operation, velocity=None):
+        """Do the bookkeeping for a PTZ command about to be sent
+
+        A move replaces any stop being held back and, with tolerance
+        set, a continuous move (or stop) repeating the last one sent is
+        suppressed.  Otherwise the command is taken for sent.
+
+        Parameters
+        ----------
+        operation : str
+            'ContinuousMove', 'Stop', or 'AbsoluteMove'.
+        velocity : 3-tuple, optional
+            Pan, tilt, and zoom velocity of a continuous move or (all
+            zero) stop. None for an absolute move.
+
+        Returns
+        -------
+        operation : str or None
+            What to send: operation, 'Stop' for a zero velocity
+            continuous move replacing a stop held back, or None if
+            nothing should be sent.
+
+        """
+        with self._lock:
+            if self._cancel_pending_stop():
+                if velocity is not None and not any(velocity):
+                    # a zero velocity move right after a stop is the stop
+                    operation = 'Stop'
+                else:
+                    self.counts['coalesced'] += 1
+            elif velocity is not None and self._is_redundant(velocity):
+                self.counts['suppressed'] += 1
+                return None
+
+            # an absolute move leaves the velocity unknown
+            self._last_velocity = velocity
+            if velocity is not None:
+                self._last_command_time = time.monotonic()
+                self.counts['sent'] += 1
+
+        return operation
+
+    def rollback(self, velocity=None):
+        """Undo claim's bookkeeping for a command that failed
+
+        So that it isn't taken for sent and a retry suppressed.
+
+        Parameters
+        ----------
+        velocity : 3-tuple, optional
+            As given to claim.
+
+        """
+        with self._lock:
+            if velocity is not None:
+                self.counts['sent'] -= 1
+            self._last_velocity = None
+
+    def defer_stop(self, send_stop):
+        """Hold back a stop for stop_coalesce_window
+
+        A stop while already stopped is suppressed.  Otherwise, unless
+        a stop is already being held back, send_stop is called once the
+        window is up if no move came along to replace the stop by then
+        (see take_pending_stop).
+
+        """
+        with self._lock:
+            if self._is_redundant(STOP_VELOCITY):
+                self.counts['suppressed'] += 1
+            elif self._pending_stop is None:
+                self._pending_stop = threading.Timer(
+                    self.stop_coalesce_window, send_stop)
+                self._pending_stop.start()
+
+    def take_pending_stop(self):
+        """Stop holding back a stop, returning whether there was one
+
+        Whoever gets True is the one to send the stop.
+
+        """
+        with self._lock:
+            return self._cancel_pending_stop()
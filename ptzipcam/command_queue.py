@@ -0,0 +1,163 @@
+"""Non-blocking dispatch of PTZ commands
+
+Every PtzCam command blocks its caller for a full round trip to the
+camera.  PtzCommandQueue moves that wait onto a worker thread so the
+frame-processing loop only ever hands over the command it wants sent
+next.
+
+"""
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class PtzCommandQueue():
+    """Sends PtzCam motion commands from a worker thread
+
+    Only the most recently submitted motion command is kept: if the
+    worker is still busy with the previous command when a new one
+    arrives, any command waiting behind it is dropped in favor of the
+    new one.  A stale velocity is never worth sending once a newer one
+    exists.
+
+    The methods mirror the PtzCam motion methods so a PtzCommandQueue
+    can stand in for the PtzCam in a control loop.
+
+    Parameters
+    ----------
+    ptz_cam : PtzCam
+        The camera the commands are sent to.
+
+    """
+
+    def __init__(self, ptz_cam):
+        self.ptz_cam = ptz_cam
+
+        self.counts = {'submitted': 0, 'sent': 0, 'dropped': 0, 'failed': 0}
+
+        self._pending = None
+        self._in_flight = False
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._worker = threading.Thread(target=self._dispatch)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def _submit(self, method_name, *args):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('PtzCommandQueue is closed.')
+            if self._pending is not None:
+                self.counts['dropped'] += 1
+            self._pending = (method_name, args)
+            self.counts['submitted'] += 1
+            self._condition.notify()
+
+    def _dispatch(self):
+        """Thread function sending whatever command is latest
+
+        """
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                method_name, args = self._pending
+                self._pending = None
+                self._in_flight = True
+
+            try:
+                getattr(self.ptz_cam, method_name)(*args)
+            except Exception as err:  # pylint: disable=broad-except
+                self.counts['failed'] += 1
+                log.warning('PTZ command %s failed: %s', method_name, err)
+            else:
+                self.counts['sent'] += 1
+
+            with self._condition:
+                self._in_flight = False
+                self._condition.notify_all()
+
+    def wait_until_sent(self, timeout=None):
+        """Block until no command is waiting or being sent
+
+        Useful before talking to the PtzCam directly so that a queued
+        command doesn't land after (and undo) a direct one.
+
+        Returns
+        -------
+        bool
+            False if timeout expired first.
+
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._pending is None and not self._in_flight,
+                timeout)
+
+    def move(self, x_velocity, y_velocity):
+        """Submit a continuous pan/tilt move
+
+        """
+        self._submit('move', x_velocity, y_velocity)
+
+    def move_w_zoom(self, x_velocity, y_velocity, zoom_command):
+        """Submit a continuous pan/tilt/zoom move
+
+        """
+        self._submit('move_w_zoom', x_velocity, y_velocity, zoom_command)
+
+    def absmove(self, x_pos, y_pos):
+        """Submit an absolute pan/tilt move
+
+        """
+        self._submit('absmove', x_pos, y_pos)
+
+    def absmove_w_zoom(self, pan_pos, tilt_pos, zoom_pos):
+        """Submit an absolute pan/tilt/zoom move
+
+        """
+        self._submit('absmove_w_zoom', pan_pos, tilt_pos, zoom_pos)
+
+    def zoom(self, zoom_command):
+        """Submit an absolute zoom move
+
+        """
+        self._submit('zoom', zoom_command)
+
+    def stop(self):
+        """Submit a stop
+
+        """
+        self._submit('stop')
+
+    def get_position(self, max_age=None):
+        """Pass through to PtzCam.get_position
+
+        Not queued: with the PtzCam's status poller running this
+        doesn't block anyway.
+
+        """
+        return self.ptz_cam.get_position(max_age)
+
+    def close(self, send_pending=True):
+        """Stop the worker thread
+
+        Parameters
+        ----------
+        send_pending : bool
+            Whether a command still waiting to be sent should be sent
+            before the worker stops (otherwise it is dropped).
+
+        """
+        with self._condition:
+            if not send_pending and self._pending is not None:
+                self._pending = None
+                self.counts['dropped'] += 1
+            self._closed = True
+            self._condition.notify()
+
+        self._worker.join()
@@ -0,0 +1,254 @@
+"""Caching of what PtzCam learns about a camera when connecting
+
+Connecting to a camera the usual way (onvif.ONVIFCamera) parses the
+device management WSDL, asks the camera for its capabilities, and then
+each service parses its own WSDL before the media profiles, video
+sources, and imaging settings can be fetched.  On a Pi that adds up to
+several seconds, paid by every script and thread that connects.
+
+This module saves the results of that discovery to disk, keyed by
+camera address and checked against the camera's firmware version, and
+creates services straight from the saved addresses.  Parsed WSDLs are
+shared by every service in the process that uses the same WSDL and
+credentials.
+
+"""
+import functools
+import json
+import logging
+import os
+import re
+import threading
+
+import requests
+import onvif
+from onvif import ONVIFCamera, ONVIFService
+from onvif.client import UsernameDigestTokenDtDiff
+from onvif.definition import SERVICES
+from onvif.exceptions import ONVIFError
+from zeep.cache import SqliteCache
+from zeep.client import CachingClient, Settings
+from zeep.transports import Transport
+
+from ptzipcam import soap
+
+log = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ptzipcam')
+WSDL_DIR = os.path.join(os.path.dirname(os.path.dirname(onvif.__file__)),
+                        'wsdl')
+
+DEVICE_NS = b'http://www.onvif.org/ver10/device/wsdl'
+FIRMWARE_PATTERN = re.compile(rb'FirmwareVersion>([^<]*)<')
+
+_zeep_clients = {}
+_zeep_clients_lock = threading.Lock()
+_default_transport_lock = threading.Lock()
+
+
+def _device_address(ip_address, port):
+    return f'http://{ip_address}:{port}/onvif/device_service'
+
+
+def get_firmware_version(ip_address, port, user, pword, transport=None):
+    """Ask the camera for its firmware version
+
+    Sent as pre-serialized SOAP (as in ptzipcam.soap) so that checking
+    whether cached discovery results still apply doesn't cost parsing
+    the device management WSDL.
+
+    """
+    envelope = b''.join((soap.ENVELOPE_START,
+                         soap.UsernameTokenHeader(user, pword).render(),
+                         b'<s:Body><GetDeviceInformation xmlns="',
+                         DEVICE_NS,
+                         b'"/></s:Body>',
+                         soap.ENVELOPE_END))
+    action = DEVICE_NS.decode() + '/GetDeviceInformation'
+    headers = {'Content-Type': ('application/soap+xml; charset=utf-8; '
+                                f'action="{action}"')}
+
+    address = _device_address(ip_address, port)
+    try:
+        if transport is not None:
+            response = transport.post(address, envelope, headers)
+        else:
+            response = requests.post(address,
+                                     data=envelope,
+                                     headers=headers,
+                                     timeout=5.0)
+    except requests.RequestException as err:
+        raise ONVIFError(err) from err
+
+    soap.check_response('GetDeviceInformation',
+                        response.status_code,
+                        response.content,
+                        response.reason)
+
+    match = FIRMWARE_PATTERN.search(response.content)
+    if match is None:
+        raise ONVIFError('GetDeviceInformation response has no '
+                         'FirmwareVersion')
+    return match.group(1).decode().strip()
+
+
+def _cache_filename(cache_dir, ip_address, port):
+    name = f'{ip_address}_{port}.json'.replace(os.sep, '_')
+    return os.path.join(cache_dir, name)
+
+
+def load_discovery(cache_dir, ip_address, port, firmware_version):
+    """Load cached discovery results for a camera
+
+    Returns
+    -------
+    discovery : dict or None
+        None if nothing is cached for the camera or what is cached was
+        discovered under different firmware.
+
+    """
+    filename = _cache_filename(cache_dir, ip_address, port)
+    try:
+        with open(filename, encoding='utf-8') as cache_file:
+            discovery = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+
+    if discovery.get('firmware_version') != firmware_version:
+        log.info('Camera firmware changed; ignoring cached discovery.')
+        return None
+
+    return discovery
+
+
+def save_discovery(cache_dir, ip_address, port, discovery):
+    """Save discovery results for a camera
+
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    filename = _cache_filename(cache_dir, ip_address, port)
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w', encoding='utf-8') as cache_file:
+        json.dump(discovery, cache_file, indent=2)
+    os.replace(temp_filename, filename)
+
+
+def _speed_to_tuple(speed):
+    if speed is None:
+        return None
+    return (speed.PanTilt.x, speed.PanTilt.y, speed.Zoom.x)
+
+
+def discover(ip_address, port, user, pword, transport=None):
+    """Connect to a camera the usual way and gather what PtzCam needs
+
+    Returns
+    -------
+    discovery : dict
+        Service addresses, firmware version, media profile and video
+        source tokens, default PTZ speed, and imaging bounds.
+    services : dict
+        The media, ptz, and imaging services built along the way.
+
+    """
+    mycam = ONVIFCamera(ip_address, port, user, pword, transport=transport)
+    media_service = mycam.create_media_service()
+    ptz_service = mycam.create_ptz_service()
+    imaging_service = mycam.create_imaging_service()
+
+    device_information = mycam.devicemgmt.GetDeviceInformation()
+
+    # on hikvision cameras there have been 3 profiles: one for each stream
+    media_profile = media_service.GetProfiles()[0]
+    video_source = media_service.GetVideoSources()[0]
+
+    vst = {'VideoSourceToken': video_source.token}
+    imaging_settings = imaging_service.GetImagingSettings(vst)
+    exposure = imaging_settings.Exposure
+
+    ptz_configuration = media_profile.PTZConfiguration
+    default_speed = None
+    if ptz_configuration is not None:
+        default_speed = _speed_to_tuple(ptz_configuration.DefaultPTZSpeed)
+
+    discovery = {
+        'firmware_version': device_information.FirmwareVersion.strip(),
+        'xaddrs': {'media': media_service.xaddr,
+                   'ptz': ptz_service.xaddr,
+                   'imaging': imaging_service.xaddr},
+        'profile_token': media_profile.token,
+        'video_source_token': video_source.token,
+        'default_speed': default_speed,
+        'iris_bounds': [exposure.MinIris, exposure.MaxIris],
+        'exposure_time_bounds': [exposure.MinExposureTime,
+                                 exposure.MaxExposureTime],
+    }
+    services = {'media': media_service,
+                'ptz': ptz_service,
+                'imaging': imaging_service}
+
+    return discovery, services
+
+
+def get_default_transport():
+    """Get the zeep transport shared by cameras not given their own
+
+    Sharing the transport shares its requests session, so each
+    camera's connection is kept alive and reused by all of its
+    services (and the fast transport) instead of every service
+    opening its own.
+
+    """
+    # the lock keeps racing first calls from each creating one
+    with _default_transport_lock:
+        return _create_default_transport()
+
+
+@functools.lru_cache(maxsize=None)
+def _create_default_transport():
+    return Transport(cache=SqliteCache())
+
+
+def _get_zeep_client(wsdl_path, user, pword, transport):
+    """Get the process-wide zeep client for a WSDL and set of credentials
+
+    """
+    key = (wsdl_path, user, pword, id(transport))
+    with _zeep_clients_lock:
+        client = _zeep_clients.get(key)
+        if client is None:
+            settings = Settings()
+            settings.strict = False
+            settings.xml_huge_tree = True
+            wsse = UsernameDigestTokenDtDiff(user, pword, use_digest=True)
+            client = CachingClient(wsdl=wsdl_path,
+                                   wsse=wsse,
+                                   transport=transport,
+                                   settings=settings)
+            _zeep_clients[key] = client
+
+    return client
+
+
+def create_service(name, xaddr, user, pword, transport=None):
+    """Create an ONVIF service at a known address
+
+    Skips the device management round trips ONVIFCamera goes through
+    to find the address and reuses an already parsed WSDL if there is
+    one.
+
+    """
+    definition = SERVICES[name]
+    wsdl_path = os.path.join(WSDL_DIR, definition['wsdl'])
+    binding_name = '{%s}%s' % (definition['ns'], definition['binding'])
+
+    return ONVIFService(xaddr,
+                        user,
+                        pword,
+                        wsdl_path,
+                        zeep_client=_get_zeep_client(wsdl_path,
+                                                     user,
+                                                     pword,
+                                                     transport),
+                        binding_name=binding_name,
+                        transport=transport)
@@ -0,0 +1,235 @@
+"""Detection on a camera's substream, recording from its main stream
+
+"""
+import time
+
+from ptzipcam.camera import Camera
+
+
+def scale_box(box, from_shape, to_shape):
+    """Rescale a box (x, y, w, h) from one frame size to another
+
+    Parameters
+    ----------
+    box : tuple
+        (x, y, w, h) in pixels of a frame of from_shape.
+    from_shape, to_shape : tuple
+        Shapes (height, width, ...) of the frames, oriented the same
+        way.
+
+    Returns
+    -------
+    tuple
+        (x, y, w, h) in pixels of a frame of to_shape.
+
+    """
+    x_scale = to_shape[1] / from_shape[1]
+    y_scale = to_shape[0] / from_shape[0]
+    x, y, w, h = box
+    return (int(round(x * x_scale)),
+            int(round(y * y_scale)),
+            int(round(w * x_scale)),
+            int(round(h * y_scale)))
+
+
+def scale_lbox(lbox, from_shape, to_shape):
+    """Copy of a labeled box with its box rescaled (see scale_box)
+
+    None is passed through.
+
+    """
+    if not lbox:
+        return lbox
+    lbox = dict(lbox)
+    lbox['box'] = scale_box(lbox['box'], from_shape, to_shape)
+    return lbox
+
+
+class DualStreamCamera():
+    """Captures a camera's substream for detection and main stream for
+    recording
+
+    Detecting on a low resolution substream saves decoding and
+    resizing full resolution frames, while recording from the main
+    stream keeps the quality.  Both streams are captured in parallel,
+    each by its own Camera; the last ring_size main stream frames are
+    kept so that the one captured closest to a substream frame can be
+    found by timestamp (get_matching_frame), and boxes found on
+    substream frames are rescaled to it with scale_lbox.
+
+    get_frame, wait_for_new_frame, and get_resolution are the
+    substream's, so a DualStreamCamera can stand in for a Camera in a
+    detection loop; pre_roll and release_frame are the main stream's.
+
+    Parameters
+    ----------
+    ip, user, passwd, rtsp_port, cam_brand
+        Where to find the camera's RTSP streams (Hikvision only).
+    detect_stream, record_stream : int
+        Channels of the substream to detect on and the main stream to
+        record (for Hikvision, 1 is main, 2 sub, and 3 third).
+    ring_size : int
+        Number of main stream frames kept for matching.
+    record_offset : float
+        Seconds to add to main stream timestamps to line them up with
+        the substream's, if the main stream consistently arrives later
+        or earlier.
+    detect_source, record_source : optional
+        Frame sources (as Camera's source) to use instead of the
+        camera's streams.
+    **camera_kwargs
+        Passed on to both Cameras (e.g. low_latency).
+
+    """
+
+    def __init__(self,  # pylint: disable=R0913
+                 ip=None,
+                 user=None,
+                 passwd=None,
+                 rtsp_port=554,
+                 cam_brand='hikvision',
+                 detect_stream=2,
+                 record_stream=1,
+                 ring_size=25,
+                 record_offset=0.0,
+                 detect_source=None,
+                 record_source=None,
+                 **camera_kwargs):
+        if cam_brand != 'hikvision' and (detect_source is None
+                                         or record_source is None):
+            raise ValueError('Dual streams are only supported for '
+                             'Hikvision cameras.')
+
+        self.record_offset = record_offset
+        self.detect_camera = Camera(ip, user, passwd,
+                                    stream=detect_stream,
+                                    rtsp_port=rtsp_port,
+                                    cam_brand=cam_brand,
+                                    source=detect_source,
+                                    **camera_kwargs)
+        self.record_camera = Camera(ip, user, passwd,
+                                    stream=record_stream,
+                                    rtsp_port=rtsp_port,
+                                    cam_brand=cam_brand,
+                                    source=record_source,
+                                    ring_size=ring_size,
+                                    **camera_kwargs)
+
+    def get_frame(self):
+        """Grab the latest frame from the substream
+
+        """
+        return self.detect_camera.get_frame()
+
+    def wait_for_new_frame(self, after_seq=0, timeout=None):
+        """Wait for a substream frame newer than after_seq
+
+        See Camera.wait_for_new_frame.
+
+        """
+        return self.detect_camera.wait_for_new_frame(after_seq, timeout)
+
+    def get_resolution(self):
+        """Get resolution of the substream
+
+        """
+        return self.detect_camera.get_resolution()
+
+    def get_record_resolution(self):
+        """Get resolution of the main stream
+
+        """
+        return self.record_camera.get_resolution()
+
+    def get_matching_frame(self, timestamp, max_offset=None, timeout=.1):
+        """Copy of the main stream frame captured closest to timestamp
+
+        Parameters
+        ----------
+        timestamp : float
+            Capture time of a substream frame (from
+            wait_for_new_frame).
+        max_offset : float, optional
+            Only match frames captured at most this many seconds from
+            timestamp.
+        timeout : float
+            If no main stream frame has been captured since timestamp
+            yet, wait up to this many seconds for one, since the main
+            stream's bigger frames usually take longer to come in.
+
+        Returns
+        -------
+        tuple
+            (frame, seq, timestamp) of the main stream frame, or (None,
+            0, None) if there is none (close enough).
+
+        """
+        self._wait_for_record_frame(timestamp, timeout)
+        frames = self.record_camera.pre_roll()
+        try:
+            if not frames:
+                return None, 0, None
+            frame, seq, frame_time = min(
+                frames,
+                key=lambda f: abs(f[2] + self.record_offset - timestamp))
+            if (max_offset is not None
+               and abs(frame_time + self.record_offset - timestamp)
+               > max_offset):
+                return None, 0, None
+            return frame.copy(), seq, frame_time
+        finally:
+            for _, borrowed_seq, _ in frames:
+                self.record_camera.release_frame(borrowed_seq)
+
+    def _wait_for_record_frame(self, timestamp, timeout):
+        """Wait for a main stream frame captured at or after timestamp
+
+        """
+        deadline = time.monotonic() + timeout
+        latest = self.record_camera.pre_roll(1)
+        seq = latest[0][1] if latest else 0
+        frame_time = latest[0][2] if latest else None
+        for _, latest_seq, _ in latest:
+            self.record_camera.release_frame(latest_seq)
+
+        while (frame_time is None
+               or frame_time + self.record_offset < timestamp):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            frame, seq, frame_time = self.record_camera.borrow_frame(
+                seq, remaining)
+            if frame is None:
+                return
+            self.record_camera.release_frame(seq)
+
+    def pre_roll(self, count=None):
+        """Borrow the main stream frames kept, oldest first
+
+        See Camera.pre_roll; give them back with release_frame.
+
+        """
+        return self.record_camera.pre_roll(count)
+
+    def release_frame(self, seq):
+        """Give back a main stream frame from pre_roll
+
+        """
+        self.record_camera.release_frame(seq)
+
+    def get_health(self):
+        """Health of the substream, with the main stream's under 'record'
+
+        See Camera.get_health.
+
+        """
+        health = self.detect_camera.get_health()
+        health['record'] = self.record_camera.get_health()
+        return health
+
+    def release(self):
+        """Release both streams
+
+        """
+        self.detect_camera.release()
+        self.record_camera.release()
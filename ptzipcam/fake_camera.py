@@ -0,0 +1,535 @@
+"""Local stand-in for an ONVIF PTZ camera
+
+Serves the subset of ONVIF that PtzCam uses (device capabilities and
+information, media profiles and video sources, PTZ status and moves,
+imaging settings and focus moves) over HTTP on localhost, backed by a
+simulated set of motors.  Point a PtzCam (or a utility's config file)
+at its address to exercise and benchmark everything without a camera
+or network:
+
+    python -m ptzipcam.fake_camera --port 8080 --latency 20 --jitter 5
+
+Authentication is not checked.
+
+"""
+import argparse
+import http.server
+import logging
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+ENVELOPE = ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<s:Envelope'
+            ' xmlns:s="http://www.w3.org/2003/05/soap-envelope"'
+            ' xmlns:tt="http://www.onvif.org/ver10/schema"'
+            ' xmlns:tds="http://www.onvif.org/ver10/device/wsdl"'
+            ' xmlns:trt="http://www.onvif.org/ver10/media/wsdl"'
+            ' xmlns:tptz="http://www.onvif.org/ver20/ptz/wsdl"'
+            ' xmlns:timg="http://www.onvif.org/ver20/imaging/wsdl">'
+            '<s:Body>{}</s:Body></s:Envelope>')
+
+FAULT = ('<s:Fault><s:Code><s:Value>s:Sender</s:Value></s:Code>'
+         '<s:Reason><s:Text xml:lang="en">{}</s:Text></s:Reason>'
+         '</s:Fault>')
+
+CAPABILITIES = (
+    '<tds:GetCapabilitiesResponse><tds:Capabilities>'
+    '<tt:Imaging><tt:XAddr>{address}/onvif/imaging</tt:XAddr></tt:Imaging>'
+    '<tt:Media><tt:XAddr>{address}/onvif/media</tt:XAddr>'
+    '<tt:StreamingCapabilities><tt:RTPMulticast>false</tt:RTPMulticast>'
+    '<tt:RTP_TCP>true</tt:RTP_TCP><tt:RTP_RTSP_TCP>true</tt:RTP_RTSP_TCP>'
+    '</tt:StreamingCapabilities></tt:Media>'
+    '<tt:PTZ><tt:XAddr>{address}/onvif/ptz</tt:XAddr></tt:PTZ>'
+    '</tds:Capabilities></tds:GetCapabilitiesResponse>')
+
+DEVICE_INFORMATION = (
+    '<tds:GetDeviceInformationResponse>'
+    '<tds:Manufacturer>ptzipcam</tds:Manufacturer>'
+    '<tds:Model>FakePtzCamera</tds:Model>'
+    '<tds:FirmwareVersion>{firmware_version}</tds:FirmwareVersion>'
+    '<tds:SerialNumber>0</tds:SerialNumber>'
+    '<tds:HardwareId>0</tds:HardwareId>'
+    '</tds:GetDeviceInformationResponse>')
+
+PROFILES = (
+    '<trt:GetProfilesResponse><trt:Profiles token="Profile_1">'
+    '<tt:Name>mainStream</tt:Name>'
+    '<tt:PTZConfiguration token="PTZToken">'
+    '<tt:Name>PTZ</tt:Name><tt:UseCount>1</tt:UseCount>'
+    '<tt:NodeToken>PTZNodeToken</tt:NodeToken>'
+    '<tt:DefaultPTZSpeed><tt:PanTilt x="1.0" y="1.0"/>'
+    '<tt:Zoom x="1.0"/></tt:DefaultPTZSpeed>'
+    '</tt:PTZConfiguration>'
+    '</trt:Profiles></trt:GetProfilesResponse>')
+
+VIDEO_SOURCES = (
+    '<trt:GetVideoSourcesResponse>'
+    '<trt:VideoSources token="VideoSource_1">'
+    '<tt:Framerate>25</tt:Framerate>'
+    '<tt:Resolution><tt:Width>1280</tt:Width>'
+    '<tt:Height>720</tt:Height></tt:Resolution>'
+    '</trt:VideoSources></trt:GetVideoSourcesResponse>')
+
+IMAGING_SETTINGS = (
+    '<timg:GetImagingSettingsResponse><timg:ImagingSettings>'
+    '<tt:Exposure><tt:Mode>{Mode}</tt:Mode>'
+    '<tt:MinExposureTime>10</tt:MinExposureTime>'
+    '<tt:MaxExposureTime>40000</tt:MaxExposureTime>'
+    '<tt:MinGain>0</tt:MinGain><tt:MaxGain>100</tt:MaxGain>'
+    '<tt:MinIris>0</tt:MinIris><tt:MaxIris>100</tt:MaxIris>'
+    '<tt:ExposureTime>{ExposureTime}</tt:ExposureTime>'
+    '<tt:Gain>{Gain}</tt:Gain><tt:Iris>{Iris}</tt:Iris></tt:Exposure>'
+    '<tt:Focus><tt:AutoFocusMode>{AutoFocusMode}</tt:AutoFocusMode>'
+    '</tt:Focus>'
+    '</timg:ImagingSettings></timg:GetImagingSettingsResponse>')
+
+STATUS = (
+    '<tptz:GetStatusResponse><tptz:PTZStatus>'
+    '<tt:Position><tt:PanTilt x="{:.6f}" y="{:.6f}"/>'
+    '<tt:Zoom x="{:.6f}"/></tt:Position>'
+    '<tt:MoveStatus><tt:PanTilt>{}</tt:PanTilt>'
+    '<tt:Zoom>{}</tt:Zoom></tt:MoveStatus>'
+    '<tt:UtcTime>{}</tt:UtcTime>'
+    '</tptz:PTZStatus></tptz:GetStatusResponse>')
+
+OPERATION_PATTERN = re.compile(rb'Body[^>]*>\s*<(?:\w+:)?(\w+)')
+PAN_TILT_PATTERN = re.compile(rb'<(?:\w+:)?PanTilt\s([^>]*)>')
+ZOOM_PATTERN = re.compile(rb'<(?:\w+:)?Zoom\s([^>]*)>')
+X_PATTERN = re.compile(rb'\bx="([^"]*)"')
+Y_PATTERN = re.compile(rb'\by="([^"]*)"')
+SETTING_PATTERN = re.compile(
+    rb'<(?:\w+:)?(Mode|ExposureTime|Gain|Iris|AutoFocusMode)>'
+    rb'\s*([^<]*?)\s*<')
+
+
+def _section(content, element):
+    """Contents of the first element with the given (local) name
+
+    """
+    match = re.search(rb'<(?:\w+:)?' + element + rb'\b[^>]*>(.*?)'
+                      rb'</(?:\w+:)?' + element + rb'>', content, re.S)
+    return match.group(1) if match else None
+
+
+def _parse_vector(content, element):
+    """Pull pan, tilt, and zoom out of a PTZVector/PTZSpeed element
+
+    Returns
+    -------
+    vector : 3-tuple
+        Pan, tilt, and zoom, with None for any left out.
+
+    """
+    section = _section(content, element)
+    if section is None:
+        return (None, None, None)
+
+    pan = tilt = zoom = None
+    pan_tilt = PAN_TILT_PATTERN.search(section)
+    if pan_tilt:
+        pan = float(X_PATTERN.search(pan_tilt.group(1)).group(1))
+        tilt = float(Y_PATTERN.search(pan_tilt.group(1)).group(1))
+    zoom_match = ZOOM_PATTERN.search(section)
+    if zoom_match:
+        zoom = float(X_PATTERN.search(zoom_match.group(1)).group(1))
+
+    return (pan, tilt, zoom)
+
+
+class MotorModel():
+    """Simulated pan, tilt, and zoom motors
+
+    Each axis accelerates (and decelerates) at a fixed rate up to its
+    commanded velocity, which for absolute moves is whatever gets it
+    to the goal fastest without overshooting.  Axes stop at their
+    limits.  The state is advanced lazily, whenever it is asked for.
+
+    Parameters
+    ----------
+    max_speeds : 3-tuple
+        Pan, tilt, and zoom speed (in ONVIF units a second) at full
+        velocity.
+    accelerations : 3-tuple
+        Pan, tilt, and zoom acceleration in ONVIF units a second a
+        second.
+    time_step : float
+        Seconds per integration step.
+
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self,
+                 max_speeds=(1.0, 1.0, 0.5),
+                 accelerations=(4.0, 4.0, 2.0),
+                 time_step=.005):
+        self.max_speeds = np.array(max_speeds, dtype=float)
+        self.accelerations = np.array(accelerations, dtype=float)
+        self.time_step = time_step
+        self.lower_bounds = np.array([-1.0, -1.0, 0.0])
+        self.upper_bounds = np.array([1.0, 1.0, 1.0])
+
+        self.position = np.zeros(3)
+        self.velocity = np.zeros(3)
+        self._commanded_velocity = np.zeros(3)
+        self._goal = np.full(3, np.nan)
+        self._goal_speed = self.max_speeds.copy()
+
+        self._last_update = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _desired_velocity(self):
+        desired = self._commanded_velocity.copy()
+
+        has_goal = ~np.isnan(self._goal)
+        error = np.where(has_goal, self._goal - self.position, 0.0)
+        # fastest speed that can still stop at the goal
+        stopping_speed = np.sqrt(2 * self.accelerations * np.abs(error))
+        speed = np.minimum(self._goal_speed, stopping_speed)
+        desired[has_goal] = (np.sign(error) * speed)[has_goal]
+
+        return desired, has_goal, error
+
+    def _update(self):
+        now = time.monotonic()
+        elapsed = now - self._last_update
+        self._last_update = now
+
+        while elapsed > 0:
+            step = min(self.time_step, elapsed)
+            elapsed -= step
+
+            desired, has_goal, error = self._desired_velocity()
+            if not self.velocity.any() and not desired.any():
+                # at rest and staying there
+                break
+
+            max_change = self.accelerations * step
+            self.velocity += np.clip(desired - self.velocity,
+                                     -max_change, max_change)
+
+            travel = self.velocity * step
+            arriving = has_goal & (np.abs(travel) >= np.abs(error))
+            self.position += travel
+            self.position[arriving] = self._goal[arriving]
+            self.velocity[arriving] = 0.0
+            self._goal[arriving] = np.nan
+
+            at_limit = ((self.position <= self.lower_bounds)
+                        | (self.position >= self.upper_bounds))
+            self.position = np.clip(self.position,
+                                    self.lower_bounds,
+                                    self.upper_bounds)
+            self.velocity[at_limit] = 0.0
+            self._commanded_velocity[at_limit] = 0.0
+            self._goal[at_limit & has_goal] = np.nan
+
+    def continuous_move(self, velocity):
+        """Move each given axis at a fraction (-1 to 1) of its max speed
+
+        """
+        with self._lock:
+            self._update()
+            for axis, value in enumerate(velocity):
+                if value is not None:
+                    self._goal[axis] = np.nan
+                    self._commanded_velocity[axis] = (
+                        np.clip(value, -1.0, 1.0) * self.max_speeds[axis])
+
+    def absolute_move(self, position, speed=(None, None, None)):
+        """Move each given axis to a position
+
+        Speeds are fractions (0 to 1) of the max speeds; axes without
+        one go at full speed.
+
+        """
+        with self._lock:
+            self._update()
+            for axis, value in enumerate(position):
+                if value is None:
+                    continue
+                self._commanded_velocity[axis] = 0.0
+                self._goal[axis] = np.clip(value,
+                                           self.lower_bounds[axis],
+                                           self.upper_bounds[axis])
+                fraction = 1.0 if speed[axis] is None else speed[axis]
+                self._goal_speed[axis] = (np.clip(fraction, 0.0, 1.0)
+                                          * self.max_speeds[axis])
+
+    def stop(self, pan_tilt=True, zoom=True):
+        """Stop (decelerating) the pan/tilt and/or zoom motors
+
+        """
+        axes = [0, 1] * pan_tilt + [2] * zoom
+        with self._lock:
+            self._update()
+            self._commanded_velocity[axes] = 0.0
+            self._goal[axes] = np.nan
+
+    def status(self):
+        """Current position and whether pan/tilt and zoom are moving
+
+        """
+        with self._lock:
+            self._update()
+            moving = self.velocity != 0.0
+            return (tuple(self.position),
+                    bool(moving[0] or moving[1]),
+                    bool(moving[2]))
+
+
+class _FakeCameraHandler(http.server.BaseHTTPRequestHandler):
+    """Answers ONVIF requests for a FakePtzCamera
+
+    """
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out as separate writes, which Nagle's
+    # algorithm would otherwise hold up waiting for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Handle a SOAP request
+
+        """
+        camera = self.server.fake_camera
+        length = int(self.headers.get('Content-Length', 0))
+        content = self.rfile.read(length)
+
+        match = OPERATION_PATTERN.search(content)
+        service = self.path.rstrip('/').rsplit('/', 1)[-1]
+        operation = match.group(1).decode() if match else ''
+
+        try:
+            body = camera.respond(service, operation, content)
+            status_code = 200
+        except KeyError:
+            body = FAULT.format(f'{operation} is not supported')
+            status_code = 400
+
+        delay = camera.latency
+        if camera.jitter:
+            delay += random.gauss(0.0, camera.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        response = ENVELOPE.format(body).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/soap+xml')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        log.debug(format, *args)
+
+
+class FakePtzCamera():
+    """Local HTTP server posing as an ONVIF PTZ camera
+
+    Parameters
+    ----------
+    host : str
+        Address to listen on.
+    port : int
+        Port to listen on (0 for any free port; see port attribute).
+    latency : float
+        Seconds each response is held back, simulating the network
+        round trip and the camera's processing time.
+    jitter : float
+        Standard deviation (seconds) of random variation added to
+        latency.
+    motors : MotorModel, optional
+        Simulated motors. A MotorModel with default limits if not
+        given.
+    firmware_version : str
+        Reported by GetDeviceInformation.
+
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 host='127.0.0.1',
+                 port=0,
+                 latency=0.0,
+                 jitter=0.0,
+                 motors=None,
+                 firmware_version='V1.0.0'):
+        self.latency = latency
+        self.jitter = jitter
+        self.motors = motors if motors is not None else MotorModel()
+        self.firmware_version = firmware_version
+
+        self.imaging_settings = {'Mode': 'AUTO',
+                                 'ExposureTime': '10000',
+                                 'Gain': '50',
+                                 'Iris': '50',
+                                 'AutoFocusMode': 'AUTO'}
+        self.focus_moving = False
+
+        self.counts = {}
+        self._counts_lock = threading.Lock()
+
+        self._server = http.server.ThreadingHTTPServer((host, port),
+                                                       _FakeCameraHandler)
+        self._server.daemon_threads = True
+        self._server.fake_camera = self
+        self.host, self.port = self._server.server_address[:2]
+        self.address = f'http://{self.host}:{self.port}'
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """Start serving in a background thread
+
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        log.info('Fake camera listening at %s', self.address)
+
+    def serve_forever(self):
+        """Serve in the calling thread until interrupted
+
+        """
+        log.info('Fake camera listening at %s', self.address)
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        self._server.server_close()
+
+    def close(self):
+        """Stop serving and release the port
+
+        """
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def reset_counts(self):
+        """Zero the per-operation request counts
+
+        """
+        with self._counts_lock:
+            self.counts = {}
+
+    def respond(self, service, operation, content):
+        """Carry out a request and render the response body
+
+        Raises KeyError for anything not supported.
+
+        """
+        with self._counts_lock:
+            self.counts[operation] = self.counts.get(operation, 0) + 1
+
+        handler = getattr(self, f'_{service}_{operation}', None)
+        if handler is None:
+            raise KeyError(operation)
+        return handler(content)
+
+    def _device_service_GetCapabilities(self, _):  # pylint: disable=C0103
+        return CAPABILITIES.format(address=self.address)
+
+    def _device_service_GetDeviceInformation(self, _):  # pylint: disable=C0103
+        return DEVICE_INFORMATION.format(
+            firmware_version=self.firmware_version)
+
+    def _media_GetProfiles(self, _):  # pylint: disable=C0103
+        return PROFILES
+
+    def _media_GetVideoSources(self, _):  # pylint: disable=C0103
+        return VIDEO_SOURCES
+
+    def _ptz_GetStatus(self, _):  # pylint: disable=C0103
+        position, pan_tilt_moving, zoom_moving = self.motors.status()
+        utc_time = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        return STATUS.format(*position,
+                             'MOVING' if pan_tilt_moving else 'IDLE',
+                             'MOVING' if zoom_moving else 'IDLE',
+                             utc_time)
+
+    def _ptz_ContinuousMove(self, content):  # pylint: disable=C0103
+        self.motors.continuous_move(_parse_vector(content, b'Velocity'))
+        return '<tptz:ContinuousMoveResponse/>'
+
+    def _ptz_AbsoluteMove(self, content):  # pylint: disable=C0103
+        self.motors.absolute_move(_parse_vector(content, b'Position'),
+                                  _parse_vector(content, b'Speed'))
+        return '<tptz:AbsoluteMoveResponse/>'
+
+    def _ptz_Stop(self, content):  # pylint: disable=C0103
+        pan_tilt = _section(content, b'PanTilt')
+        zoom = _section(content, b'Zoom')
+        self.motors.stop(pan_tilt is None or pan_tilt.strip() != b'false',
+                         zoom is None or zoom.strip() != b'false')
+        return '<tptz:StopResponse/>'
+
+    def _imaging_GetImagingSettings(self, _):  # pylint: disable=C0103
+        return IMAGING_SETTINGS.format(**self.imaging_settings)
+
+    def _imaging_SetImagingSettings(self, content):  # pylint: disable=C0103
+        for name, value in SETTING_PATTERN.findall(content):
+            if value:
+                self.imaging_settings[name.decode()] = value.decode()
+        return '<timg:SetImagingSettingsResponse/>'
+
+    def _imaging_Move(self, _):  # pylint: disable=C0103
+        self.focus_moving = True
+        return '<timg:MoveResponse/>'
+
+    def _imaging_Stop(self, _):  # pylint: disable=C0103
+        self.focus_moving = False
+        return '<timg:StopResponse/>'
+
+
+def main():
+    """Run a fake camera until interrupted
+
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('--host',
+                        default='127.0.0.1',
+                        help='Address to listen on.')
+    parser.add_argument('-p',
+                        '--port',
+                        type=int,
+                        default=8080,
+                        help='Port to listen on.')
+    parser.add_argument('-l',
+                        '--latency',
+                        type=float,
+                        default=0.0,
+                        help='Response latency in milliseconds.')
+    parser.add_argument('-j',
+                        '--jitter',
+                        type=float,
+                        default=0.0,
+                        help=('Standard deviation of the latency in '
+                              'milliseconds.'))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    camera = FakePtzCamera(args.host,
+                           args.port,
+                           latency=args.latency/1000,
+                           jitter=args.jitter/1000)
+    camera.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""Buffers handing frames from a capture thread to any number of readers
+
+LatestFrameBuffer holds just the latest frame; FrameRing captures into
+a ring of reused frames and keeps the last few as pre-roll.  Camera
+uses one or the other (see its ring_size).
+
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def _copy(frame):
+    return None if frame is None else frame.copy()
+
+
+class LatestFrameBuffer():
+    """Holds the most recent frame captured, for any number of readers
+
+    The capture thread puts each frame it reads, which replaces the
+    previous one.  Every frame is given the next of a monotonically
+    increasing sequence number and the time.monotonic() it was
+    captured, so readers can tell new frames from ones they have
+    already seen and wait for the next one instead of polling.
+
+    Frames are handed out as is, not copied: readers must not modify
+    them in place (copy first, as ui.orient_frame does).
+
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._timestamp = None
+        self._num_waiting = 0
+        self.stopped = False
+
+    @property
+    def wanted(self):
+        """Whether anyone is waiting for a new frame
+
+        """
+        return self._num_waiting > 0
+
+    def put(self, frame, timestamp=None):
+        """Make frame the latest frame and wake anyone waiting for it
+
+        Returns the frame's sequence number.
+
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._condition:
+            self._seq += 1
+            self._frame = frame
+            self._timestamp = timestamp
+            self._condition.notify_all()
+            return self._seq
+
+    def get(self):
+        """Return the latest frame with its sequence number and timestamp
+
+        Returns
+        -------
+        tuple
+            (frame, seq, timestamp); (None, 0, None) before the first
+            frame.
+
+        """
+        with self._condition:
+            return self._frame, self._seq, self._timestamp
+
+    def wait_for_new_frame(self, after_seq=0, timeout=None):
+        """Wait for a frame newer than after_seq
+
+        Parameters
+        ----------
+        after_seq : int
+            Sequence number of the last frame the caller has seen (0
+            for none).
+        timeout : float, optional
+            Seconds to wait at most; forever if None.
+
+        Returns
+        -------
+        tuple
+            (frame, seq, timestamp) of the newest frame, or (None,
+            after_seq, None) if no newer frame came within timeout or
+            the buffer was stopped.
+
+        """
+        with self._condition:
+            self._num_waiting += 1
+            try:
+                self._condition.wait_for(lambda: (self._seq > after_seq
+                                                  or self.stopped),
+                                         timeout)
+            finally:
+                self._num_waiting -= 1
+            if self._seq > after_seq:
+                return self._frame, self._seq, self._timestamp
+            return None, after_seq, None
+
+    def next_buffer(self):
+        """Array for the capture thread to read the next frame into
+
+        None, for the capture to allocate a new one.
+
+        """
+        return None
+
+    def borrow(self, after_seq=0, timeout=None):
+        """Wait for a frame newer than after_seq and hold on to it
+
+        As wait_for_new_frame, but the frame is not copied and stays
+        valid until release(seq) is called.
+
+        """
+        return self.wait_for_new_frame(after_seq, timeout)
+
+    def release(self, seq):
+        """Give back a frame from borrow() or pre_roll()
+
+        """
+
+    def pre_roll(self, count=None):
+        """Borrow the frames held, oldest first
+
+        Only the latest frame is held here (see FrameRing).  Returns a
+        list of (frame, seq, timestamp), each to be given back with
+        release(seq).
+
+        """
+        frame, seq, timestamp = self.get()
+        if frame is None or count == 0:
+            return []
+        return [(frame, seq, timestamp)]
+
+    def stop(self):
+        """Stop the buffer, waking everyone waiting on it
+
+        """
+        with self._condition:
+            self.stopped = True
+            self._condition.notify_all()
+
+
+class FrameRing(LatestFrameBuffer):
+    """LatestFrameBuffer that captures into a fixed ring of frames
+
+    Instead of a new array being allocated for every frame captured,
+    the capture thread decodes into the oldest of size preallocated
+    frames (see next_buffer), and the last size frames stay available
+    as pre-roll, e.g. for recording the moments before a detection.
+
+    Since frames are reused, get() and wait_for_new_frame() hand out
+    copies.  To use a frame without copying it, borrow() it and
+    release() it when done: a borrowed frame is not reused until then.
+    If every frame is borrowed the ring grows rather than overwrite
+    one, so borrowers should release promptly.
+
+    Parameters
+    ----------
+    size : int
+        Number of frames in the ring (at least 2).
+
+    """
+
+    def __init__(self, size):
+        if size < 2:
+            raise ValueError('FrameRing needs at least 2 frames.')
+        super().__init__()
+        self.size = size
+        # each slot is a dict of frame, seq (None while being filled),
+        # timestamp, and borrows
+        self._slots = []
+        self._filling = None
+
+    def _slot(self, seq):
+        for slot in self._slots:
+            if slot['seq'] == seq:
+                return slot
+        raise ValueError(f'Frame {seq} is not in the ring.')
+
+    def next_buffer(self):
+        """Array for the capture thread to read the next frame into
+
+        The oldest frame not borrowed and not the latest, or None
+        (for the capture to allocate one) while the ring fills up.
+
+        """
+        with self._condition:
+            free = [slot for slot in self._slots
+                    if slot['borrows'] == 0 and slot['seq'] != self._seq]
+            if len(self._slots) < self.size or not free:
+                if len(self._slots) >= self.size:
+                    log.warning('All %d frames in the ring are borrowed; '
+                                'adding another.', len(self._slots))
+                slot = {'frame': None, 'seq': None,
+                        'timestamp': None, 'borrows': 0}
+                self._slots.append(slot)
+            else:
+                slot = min(free, key=lambda slot: slot['seq'] or 0)
+            slot['seq'] = None
+            self._filling = slot
+            return slot['frame']
+
+    def put(self, frame, timestamp=None):
+        """Make frame (read into next_buffer()) the latest frame
+
+        Returns the frame's sequence number.
+
+        """
+        with self._condition:
+            if self._filling is None:
+                self.next_buffer()
+            seq = super().put(frame, timestamp)
+            slot = self._filling
+            slot['frame'] = frame
+            slot['seq'] = seq
+            slot['timestamp'] = self._timestamp
+            self._filling = None
+            return seq
+
+    def get(self):
+        """Return a copy of the latest frame with its sequence number
+        and timestamp
+
+        """
+        with self._condition:
+            frame, seq, timestamp = super().get()
+            return _copy(frame), seq, timestamp
+
+    def wait_for_new_frame(self, after_seq=0, timeout=None):
+        """Wait for a frame newer than after_seq and return a copy
+
+        See LatestFrameBuffer.wait_for_new_frame.
+
+        """
+        with self._condition:
+            frame, seq, timestamp = super().wait_for_new_frame(after_seq,
+                                                               timeout)
+            return _copy(frame), seq, timestamp
+
+    def borrow(self, after_seq=0, timeout=None):
+        """Wait for a frame newer than after_seq and hold on to it
+
+        Returns (frame, seq, timestamp) as wait_for_new_frame, but the
+        frame is the one in the ring, not a copy, and is not reused
+        until release(seq) is called.
+
+        """
+        with self._condition:
+            frame, seq, timestamp = super().wait_for_new_frame(after_seq,
+                                                               timeout)
+            if frame is not None:
+                self._slot(seq)['borrows'] += 1
+            return frame, seq, timestamp
+
+    def release(self, seq):
+        """Give back a frame from borrow() or pre_roll()
+
+        """
+        with self._condition:
+            slot = self._slot(seq)
+            slot['borrows'] = max(0, slot['borrows'] - 1)
+
+    def pre_roll(self, count=None):
+        """Borrow the frames in the ring, oldest first
+
+        Parameters
+        ----------
+        count : int, optional
+            Borrow only the latest count frames.
+
+        Returns
+        -------
+        list
+            (frame, seq, timestamp) for each frame, each to be given
+            back with release(seq).
+
+        """
+        with self._condition:
+            slots = sorted((slot for slot in self._slots
+                            if slot['seq'] is not None),
+                           key=lambda slot: slot['seq'])
+            if count is not None:
+                slots = slots[len(slots) - count:] if count else []
+            for slot in slots:
+                slot['borrows'] += 1
+            return [(slot['frame'], slot['seq'], slot['timestamp'])
+                    for slot in slots]
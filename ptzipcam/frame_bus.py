@@ -0,0 +1,485 @@
+"""Hands frames between processes through shared memory
+
+A FrameBus is a ring of frame slots in a multiprocessing.shared_memory
+block.  The process capturing frames writes each one, along with its
+sequence number, timestamp, and the PTZ position it was captured at,
+into the next slot; any number of FrameBusReaders, in any process,
+attach to the bus by name and get the frames as numpy arrays mapped
+straight onto the shared memory, so frames are never pickled or
+copied on their way across.
+
+A reader's frame stays valid until the writer comes back around the
+ring to its slot, num_slots - 1 frames later; is_valid tells whether
+that has happened.
+
+FrameBusWorker builds on the bus to run a function, e.g. an object
+detector, on frames in a separate process, escaping the GIL.
+
+"""
+import logging
+import multiprocessing
+import pickle
+import queue
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+MAGIC = 0x50545a46  # 'PTZF'
+
+HEADER_DTYPE = np.dtype([('magic', '<u4'),
+                         ('num_slots', '<u4'),
+                         ('height', '<u4'),
+                         ('width', '<u4'),
+                         ('channels', '<u4'),
+                         ('dtype', 'S8'),
+                         ('latest_seq', '<i8')])
+
+SLOT_DTYPE = np.dtype([('seq', '<i8'),
+                       ('timestamp', '<f8'),
+                       ('pan', '<f8'),
+                       ('tilt', '<f8'),
+                       ('zoom', '<f8')])
+
+# slot seq while the slot is being written
+WRITING = -1
+
+ALIGNMENT = 64
+
+# names of the FrameBuses created (and not yet closed) in this process
+_created_names = set()
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _attach(name):
+    """Attach to an existing shared memory block without owning it
+
+    Before Python 3.13, attaching registers the block with this
+    process's resource tracker, which then unlinks it when this process
+    exits, out from under the writer.  Processes started by
+    multiprocessing share their parent's tracker, so only an
+    independent process needs to undo that, and not for a block it
+    created itself, which the tracker has to keep.
+
+    """
+    try:
+        # pylint: disable=unexpected-keyword-arg
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if (multiprocessing.parent_process() is None
+                and shm.name not in _created_names):
+            # pylint: disable=protected-access
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class _FrameBusBase():
+    """Views onto the header, slot headers, and frames of a bus
+
+    """
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.header = np.ndarray((), HEADER_DTYPE, shm.buf, 0)
+        if self.header['magic'] != MAGIC:
+            raise ValueError(f'{shm.name} is not a frame bus.')
+
+        self.num_slots = int(self.header['num_slots'])
+        self.shape = (int(self.header['height']),
+                      int(self.header['width']),
+                      int(self.header['channels']))
+        self.dtype = np.dtype(self.header['dtype'].item().decode())
+
+        slots_offset = _align(HEADER_DTYPE.itemsize)
+        self.slots = np.ndarray((self.num_slots,), SLOT_DTYPE,
+                                shm.buf, slots_offset)
+        frames_offset = _align(slots_offset
+                               + self.num_slots * SLOT_DTYPE.itemsize)
+        self.frames = np.ndarray((self.num_slots,) + self.shape, self.dtype,
+                                 shm.buf, frames_offset)
+
+    @staticmethod
+    def _size(shape, dtype, num_slots):
+        slots_offset = _align(HEADER_DTYPE.itemsize)
+        frames_offset = _align(slots_offset + num_slots * SLOT_DTYPE.itemsize)
+        return frames_offset + num_slots * int(np.prod(shape)) * dtype.itemsize
+
+    @property
+    def name(self):
+        """Name to attach readers to the bus by
+
+        """
+        return self.shm.name
+
+    @property
+    def latest_seq(self):
+        """Sequence number of the latest frame written (0 for none)
+
+        """
+        return int(self.header['latest_seq'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Detach from the shared memory
+
+        """
+        # the views must go before the memory they are onto
+        self.header = self.slots = self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            log.debug('Frames of %s still in use; leaving it mapped.',
+                      self.shm.name)
+
+
+class FrameBus(_FrameBusBase):
+    """Writes frames into a ring of slots in shared memory
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the frames, (height, width, channels).
+    dtype : numpy dtype
+        Type of the frames' pixels.
+    num_slots : int
+        Number of frames in the ring.
+    name : str, optional
+        Name of the shared memory block; a unique one is made up if
+        not given (see the name attribute).
+
+    """
+
+    def __init__(self, shape, dtype=np.uint8, num_slots=4, name=None):
+        if len(shape) == 2:
+            shape = tuple(shape) + (1,)
+        dtype = np.dtype(dtype)
+        size = self._size(shape, dtype, num_slots)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        header = np.ndarray((), HEADER_DTYPE, shm.buf, 0)
+        header['num_slots'] = num_slots
+        header['height'], header['width'], header['channels'] = shape
+        header['dtype'] = dtype.str.encode()
+        header['latest_seq'] = 0
+        header['magic'] = MAGIC
+        del header
+
+        super().__init__(shm)
+        self.slots['seq'] = 0
+        self._seq = 0
+        _created_names.add(shm.name)
+
+    def write(self, frame, position=None, timestamp=None):
+        """Write frame into the next slot
+
+        Parameters
+        ----------
+        frame : numpy.ndarray
+            Frame of the bus's shape.
+        position : tuple, optional
+            (pan, tilt, zoom) the frame was captured at.
+        timestamp : float, optional
+            time.monotonic() the frame was captured at; now if not
+            given.
+
+        Returns
+        -------
+        int
+            The frame's sequence number.
+
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if position is None:
+            position = (np.nan, np.nan, np.nan)
+
+        self._seq += 1
+        index = self._seq % self.num_slots
+        slot = self.slots[index]
+
+        # readers check seq before and after using a slot, so marking
+        # it first tells them it has changed under them
+        slot['seq'] = WRITING
+        self.frames[index] = frame.reshape(self.shape)
+        slot['timestamp'] = timestamp
+        slot['pan'], slot['tilt'], slot['zoom'] = position
+        slot['seq'] = self._seq
+        self.header['latest_seq'] = self._seq
+
+        return self._seq
+
+    def close(self):
+        """Detach from and remove the shared memory
+
+        Readers already attached keep their mapping.
+
+        """
+        shm = self.shm
+        super().close()
+        shm.unlink()
+        _created_names.discard(shm.name)
+
+
+class FrameBusReader(_FrameBusBase):
+    """Reads frames from a FrameBus, possibly in another process
+
+    Frames are read-only views onto the shared memory, valid until
+    overwritten (see is_valid).
+
+    Parameters
+    ----------
+    name : str
+        The name of the FrameBus.
+    poll_interval : float
+        Seconds between checks for a new frame when waiting for one.
+
+    """
+
+    def __init__(self, name, poll_interval=.001):
+        super().__init__(_attach(name))
+        self.poll_interval = poll_interval
+        self.frames.flags.writeable = False
+
+    def get(self, seq=None):
+        """Return a frame with its metadata
+
+        Parameters
+        ----------
+        seq : int, optional
+            Sequence number of the frame; the latest if not given.
+
+        Returns
+        -------
+        tuple
+            (frame, seq, timestamp, (pan, tilt, zoom)), or (None, seq,
+            None, None) if the frame is no longer (or not yet) on the
+            bus.
+
+        """
+        if seq is None:
+            seq = self.latest_seq
+        index = seq % self.num_slots
+        slot = self.slots[index]
+        if seq <= 0 or slot['seq'] != seq:
+            return None, seq, None, None
+
+        timestamp = float(slot['timestamp'])
+        position = (float(slot['pan']),
+                    float(slot['tilt']),
+                    float(slot['zoom']))
+        if slot['seq'] != seq:
+            return None, seq, None, None
+        return self.frames[index], seq, timestamp, position
+
+    def is_valid(self, seq):
+        """Whether frame seq is still in its slot, not overwritten
+
+        Check after using a frame to know it did not change while in
+        use.
+
+        """
+        if seq <= 0:
+            return False
+        return self.slots[seq % self.num_slots]['seq'] == seq
+
+    def wait_for_new_frame(self, after_seq=0, timeout=None):
+        """Wait for a frame newer than after_seq
+
+        Returns the latest frame as get() does, or (None, after_seq,
+        None, None) if none came within timeout seconds.
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            seq = self.latest_seq
+            if seq > after_seq:
+                frame, seq, timestamp, position = self.get(seq)
+                if frame is not None:
+                    return frame, seq, timestamp, position
+            if deadline is not None and time.monotonic() >= deadline:
+                return None, after_seq, None, None
+            time.sleep(self.poll_interval)
+
+
+def _sendable(exception):
+    """exception, or a RuntimeError describing it if it can't be pickled
+
+    """
+    try:
+        pickle.dumps(exception)
+    except Exception:  # pylint: disable=broad-except
+        return RuntimeError(repr(exception))
+    return exception
+
+
+def _worker_main(bus_name, make_function, results, stop):
+    """Process function of FrameBusWorker
+
+    """
+    try:
+        function = make_function()
+    except Exception as e:  # pylint: disable=broad-except
+        # no frame's sequence number (None) marks a startup error
+        results.put((None, _sendable(e), True))
+        return
+    reader = FrameBusReader(bus_name)
+    seq = 0
+    try:
+        while not stop.is_set():
+            frame, seq, _, _ = reader.wait_for_new_frame(seq, timeout=.1)
+            if frame is None:
+                continue
+            try:
+                result = function(frame)
+            except Exception as e:  # pylint: disable=broad-except
+                result = _sendable(e)
+            results.put((seq, result, reader.is_valid(seq)))
+    finally:
+        reader.close()
+
+
+class FrameBusWorker():
+    """Runs a function on frames in a separate process
+
+    Frames submitted are written to a FrameBus, which the worker
+    process reads them from, so they are not pickled; only the
+    function's results come back through a queue.  The worker always
+    takes the latest frame, skipping any submitted while it was busy.
+
+    Parameters
+    ----------
+    shape, dtype, num_slots
+        Of the FrameBus to create.
+    make_function : callable
+        Called with no arguments in the worker process to build the
+        function to run on each frame (so that e.g. a model is loaded
+        there rather than in the submitting process). Must be
+        picklable, e.g. a module-level function.
+    start_method : str, optional
+        multiprocessing start method of the worker process; by default
+        'forkserver' where available and otherwise 'spawn'.  The
+        process is not forked from this one, which by the time there
+        are frames to submit usually has capture and polling threads
+        running (and locks they may hold), which a fork copies.
+
+    """
+    # seconds between checks that the worker process is still alive
+    poll_interval = .1
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 make_function,
+                 shape,
+                 dtype=np.uint8,
+                 num_slots=3,
+                 start_method=None):
+        if start_method is None:
+            start_method = ('forkserver' if 'forkserver'
+                            in multiprocessing.get_all_start_methods()
+                            else 'spawn')
+        context = multiprocessing.get_context(start_method)
+        self.bus = FrameBus(shape, dtype, num_slots)
+        self._results = context.Queue()
+        self._stop = context.Event()
+        self._startup_error = None
+        self.process = context.Process(target=_worker_main,
+                                       args=(self.bus.name,
+                                             make_function,
+                                             self._results,
+                                             self._stop))
+        self.process.daemon = True
+        self.process.start()
+
+    def submit(self, frame, position=None):
+        """Hand a frame to the worker, returning its sequence number
+
+        """
+        return self.bus.write(frame, position)
+
+    def result(self, seq, timeout=None):
+        """Wait for the result of the function on frame seq
+
+        Results for earlier frames are discarded; if the worker skipped
+        frame seq for a later one, that one's result is returned.
+        Exceptions raised in the worker (by the function, or by
+        make_function as it started) are raised here.
+
+        Raises
+        ------
+        TimeoutError
+            If no result comes within timeout seconds.
+        RuntimeError
+            If the worker process has exited.
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            result_seq, result, valid = self._get_result(seq, deadline)
+            if result_seq is None:
+                self._startup_error = result
+                raise result
+            if result_seq < seq:
+                continue
+            if not valid:
+                log.warning('Frame %d was overwritten while in use.',
+                            result_seq)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+    def _get_result(self, seq, deadline):
+        """Next result from the worker, checking on it while waiting
+
+        """
+        if self._startup_error is not None:
+            raise self._startup_error
+        while True:
+            wait = self.poll_interval
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - time.monotonic()))
+            try:
+                return self._results.get(timeout=wait)
+            except queue.Empty:
+                pass
+            if not self.process.is_alive():
+                # whatever it put before exiting is in the queue by now
+                try:
+                    return self._results.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    raise RuntimeError(
+                        'Worker process exited (exit code '
+                        f'{self.process.exitcode}).') from None
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f'No result for frame {seq}.')
+
+    def __call__(self, frame, position=None, timeout=None):
+        """Run the function on frame in the worker and return its result
+
+        """
+        return self.result(self.submit(frame, position), timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the worker process and remove the bus
+
+        """
+        self._stop.set()
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.bus.close()
@@ -0,0 +1,554 @@
+"""Frame sources Camera can capture from instead of a camera's stream
+
+Each source has the read()/grab()/retrieve()/release() interface of
+cv2.VideoCapture so the capture thread treats it like any other
+stream:
+
+- SyntheticSource renders targets moving across a background at a
+  chosen resolution and frame rate, deterministically, and stamps
+  each frame with its index so consumers can work out latency and
+  dropped frames (see read_frame_index).
+- FileSource plays a video file, looping, at the file's frame rate.
+- StreamStandIn serves any source as a live stream on localhost that
+  is then captured through the same FFmpeg path as a camera's RTSP
+  stream.
+
+open_frame_source builds one from a configuration string, and
+open_capture opens a stream with either capture backend.
+
+"""
+import logging
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from ptzipcam.av_capture import AvCapture
+
+try:
+    import av
+except ImportError:
+    av = None
+
+log = logging.getLogger(__name__)
+
+STAMP_BITS = 24
+
+
+def _stamp_block_size(width):
+    return max(2, min(16, width // (STAMP_BITS + 1)))
+
+
+def stamp_frame_index(frame, index):
+    """Write a frame index into the top left of a frame
+
+    The index is drawn as a row of black and white blocks big enough
+    to survive video compression.
+
+    """
+    block = _stamp_block_size(frame.shape[1])
+    for bit in range(STAMP_BITS):
+        value = 255 if (index >> bit) & 1 else 0
+        frame[:block, bit*block:(bit + 1)*block] = value
+
+
+def read_frame_index(frame):
+    """Read the index stamped by stamp_frame_index back out of a frame
+
+    """
+    block = _stamp_block_size(frame.shape[1])
+    margin = block // 4
+    index = 0
+    for bit in range(STAMP_BITS):
+        cell = frame[margin:block - margin,
+                     bit*block + margin:(bit + 1)*block - margin]
+        if cell.mean() > 127:
+            index |= 1 << bit
+    return index
+
+
+class _PacedSource():
+    """Base class for sources that produce frames in real time
+
+    A live camera produces frames at its frame rate whether or not
+    they are read, so when reading falls behind, the frames it missed
+    are skipped rather than queued (with realtime False every frame is
+    produced, as fast as it is read).
+
+    """
+
+    def __init__(self, fps, realtime):
+        self.fps = fps
+        self.realtime = realtime
+        self.frame_index = -1
+        self.frames_skipped = 0
+        self.released = False
+        self._start = None
+
+    def _next_index(self):
+        """Wait for the next frame to be due and return its index
+
+        """
+        if not self.realtime:
+            return self.frame_index + 1
+
+        now = time.monotonic()
+        if self._start is None:
+            self._start = now
+            return 0
+
+        due = int((now - self._start) * self.fps)
+        if due <= self.frame_index:
+            due = self.frame_index + 1
+            time.sleep(self._start + due/self.fps - now)
+        self.frames_skipped += due - self.frame_index - 1
+        return due
+
+    def isOpened(self):  # pylint: disable=invalid-name
+        """Whether the source can still be read (as in cv2.VideoCapture)
+
+        """
+        return not self.released
+
+    def release(self):
+        """Stop producing frames
+
+        """
+        self.released = True
+
+
+class SyntheticSource(_PacedSource):
+    """Renders targets moving across a background
+
+    Targets bounce around the frame at constant speeds.  Everything is
+    a function of the frame index, so runs are repeatable.
+
+    Parameters
+    ----------
+    width, height : int
+        Resolution of the frames.
+    fps : float
+        Frame rate.
+    num_targets : int
+        Number of targets.
+    target_size : float
+        Size of the targets as a fraction of frame height.
+    seed : int
+        Seed for the targets' starting positions, speeds, and colors.
+    realtime : bool
+        If True, frames are produced at fps (see _PacedSource).
+
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 width=1280,
+                 height=720,
+                 fps=25.0,
+                 num_targets=2,
+                 target_size=.15,
+                 seed=0,
+                 realtime=True):
+        super().__init__(fps, realtime)
+        self.width = width
+        self.height = height
+
+        rng = np.random.default_rng(seed)
+        size = int(target_size * height)
+        self.target_sizes = np.full(num_targets, size)
+        self.travel = np.array([width - size, height - size], dtype=float)
+        self.starts = rng.uniform(0, 1, (num_targets, 2)) * self.travel
+        # pixels a second, crossing the frame in 2 to 8 seconds
+        speeds = rng.uniform(1/8, 1/2, (num_targets, 2)) * self.travel
+        self.velocities = speeds * rng.choice([-1, 1], (num_targets, 2))
+        self.colors = [tuple(int(c) for c in color)
+                       for color in rng.integers(150, 256, (num_targets, 3))]
+
+        # dark gradient so targets stand out without being trivial
+        gradient = np.linspace(20, 80, width, dtype=np.uint8)
+        self.background = np.repeat(np.tile(gradient, (height, 1))[..., None],
+                                    3,
+                                    axis=2)
+
+        self.boxes = []
+        self._produced_at = {}
+
+    def target_boxes(self, index):
+        """Boxes (x, y, w, h) of the targets in frame index
+
+        """
+        elapsed = index / self.fps
+        positions = (self.starts + self.velocities * elapsed) % (2*self.travel)
+        positions = np.where(positions > self.travel,
+                             2*self.travel - positions,
+                             positions)
+        return [(int(x), int(y), int(size), int(size))
+                for (x, y), size in zip(positions, self.target_sizes)]
+
+    def produced_at(self, index):
+        """time.monotonic() when frame index was produced (or None)
+
+        Only the last few seconds' worth of frames are remembered.
+
+        """
+        return self._produced_at.get(index)
+
+    def grab(self):
+        """Produce the next frame without rendering it
+
+        As in cv2.VideoCapture, retrieve() then renders it.
+
+        """
+        if self.released:
+            return False
+
+        index = self._next_index()
+        self.frame_index = index
+        self.boxes = self.target_boxes(index)
+
+        self._produced_at[index] = time.monotonic()
+        # indices only increase, so the oldest are first
+        oldest = index - 10 * int(self.fps)
+        while next(iter(self._produced_at)) < oldest:
+            del self._produced_at[next(iter(self._produced_at))]
+
+        return True
+
+    def retrieve(self, image=None):
+        """Render the frame last grabbed (as in cv2.VideoCapture)
+
+        Into image, if given and of the right shape.
+
+        """
+        if self.released or self.frame_index < 0:
+            return False, None
+
+        if image is not None and image.shape == self.background.shape:
+            frame = image
+            np.copyto(frame, self.background)
+        else:
+            frame = self.background.copy()
+        for (x, y, w, h), color in zip(self.boxes, self.colors):
+            cv2.rectangle(frame, (x, y), (x + w, y + h), color, -1)
+        stamp_frame_index(frame, self.frame_index)
+
+        return True, frame
+
+    def read(self, image=None):
+        """Produce the next frame (as in cv2.VideoCapture)
+
+        """
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+
+class FileSource(_PacedSource):
+    """Plays a video file as if it were a live stream
+
+    Parameters
+    ----------
+    filename : str
+        Video file to play.
+    loop : bool
+        Start over at the end of the file (otherwise reads fail from
+        then on, as at the end of a stream).
+    fps : float, optional
+        Frame rate to play at. The file's own if not given.
+    realtime : bool
+        If True, frames are produced at fps (see _PacedSource).
+
+    """
+
+    def __init__(self, filename, loop=True, fps=None, realtime=True):
+        self.cap = cv2.VideoCapture(filename)
+        if not self.cap.isOpened():
+            raise IOError(f'Could not open video file {filename}')
+
+        fps = fps or self.cap.get(cv2.CAP_PROP_FPS) or 25.0
+        super().__init__(fps, realtime)
+        self.filename = filename
+        self.loop = loop
+
+    def _grab_file_frame(self):
+        ret = self.cap.grab()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret = self.cap.grab()
+        return ret
+
+    def grab(self):
+        """Produce the next frame without decoding it
+
+        As in cv2.VideoCapture, retrieve() then decodes it.
+
+        """
+        if self.released:
+            return False
+
+        index = self._next_index()
+        # frames that came due while nobody was reading are passed by
+        for _ in range(index - self.frame_index - 1):
+            self._grab_file_frame()
+        self.frame_index = index
+
+        return self._grab_file_frame()
+
+    def retrieve(self, image=None):
+        """Decode the frame last grabbed (as in cv2.VideoCapture)
+
+        """
+        if self.released:
+            return False, None
+        return self.cap.retrieve(image)
+
+    def read(self, image=None):
+        """Produce the next frame (as in cv2.VideoCapture)
+
+        """
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def release(self):
+        super().release()
+        self.cap.release()
+
+
+class StreamStandIn():
+    """Serves a frame source as a live network stream on localhost
+
+    Stand-in for a camera's RTSP stream: frames read from source are
+    encoded and sent as MPEG-TS over UDP to address, where capturing
+    from address goes through the same FFmpeg demuxing and decoding as
+    a camera's stream.  Requires PyAV.
+
+    The H.264 parser on the reading end only knows a frame is complete
+    when the next one starts, so this adds about a frame interval of
+    latency that an RTSP stream (which marks the end of each frame)
+    does not have.
+
+    Parameters
+    ----------
+    source
+        Anything with a cv2.VideoCapture-style read(), e.g. a
+        SyntheticSource.
+    port : int
+        UDP port to send to.
+    codec : str
+        Encoder to use.
+    bit_rate : int
+        Target bits per second.
+
+    """
+
+    def __init__(self, source, port=5004, codec='libx264', bit_rate=4000000):
+        if av is None:
+            raise ImportError('StreamStandIn requires PyAV. '
+                              'Install it with: pip install av')
+
+        self.source = source
+        self.port = port
+        self.codec = codec
+        self.bit_rate = bit_rate
+        self.frames_sent = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def address(self):
+        """Address to capture the stream from
+
+        """
+        return (f'udp://127.0.0.1:{self.port}'
+                '?overrun_nonfatal=1&fifo_size=1000000')
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        """Start streaming from a background thread
+
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._stream)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _stream(self):
+        """Thread function encoding and sending frames
+
+        """
+        # with the length of each frame's PES packet written, the
+        # reader can pass a frame on as soon as it is in rather than
+        # when the next one starts
+        output = av.open(f'udp://127.0.0.1:{self.port}?pkt_size=1316',
+                         mode='w',
+                         format='mpegts',
+                         options={'omit_video_pes_length': '0'})
+        stream = None
+        try:
+            while not self._stop.is_set():
+                ret, frame = self.source.read()
+                if not ret:
+                    break
+                if stream is None:
+                    stream = self._add_stream(output, frame)
+                video_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+                for packet in stream.encode(video_frame):
+                    output.mux(packet)
+                self.frames_sent += 1
+        finally:
+            output.close()
+
+    def _add_stream(self, output, frame):
+        fps = int(round(getattr(self.source, 'fps', 25)))
+        stream = output.add_stream(self.codec, rate=fps)
+        stream.width = frame.shape[1]
+        stream.height = frame.shape[0]
+        stream.pix_fmt = 'yuv420p'
+        stream.bit_rate = self.bit_rate
+        # a keyframe a second so a late reader can pick the stream up
+        stream.codec_context.gop_size = fps
+        if self.codec == 'libx264':
+            stream.codec_context.options = {'preset': 'ultrafast',
+                                            'tune': 'zerolatency'}
+        return stream
+
+    def close(self):
+        """Stop streaming
+
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class _StandInCapture():
+    """Capture of a StreamStandIn that shuts the stand-in down with it
+
+    """
+
+    def __init__(self, stand_in, cap):
+        self.stand_in = stand_in
+        self.cap = cap
+
+    def read(self, image=None):
+        """Read the next frame of the stream
+
+        """
+        return self.cap.read(image)
+
+    def grab(self):
+        """Grab the next frame of the stream
+
+        """
+        return self.cap.grab()
+
+    def retrieve(self, image=None):
+        """Decode the frame last grabbed
+
+        """
+        return self.cap.retrieve(image)
+
+    @property
+    def packet_sinks(self):
+        """The capture's packet_sinks (with the pyav backend)
+
+        """
+        return self.cap.packet_sinks
+
+    def isOpened(self):  # pylint: disable=invalid-name
+        """Whether the stream is open
+
+        """
+        return self.cap.isOpened()
+
+    def release(self):
+        """Release the capture and stop the stand-in
+
+        """
+        self.cap.release()
+        self.stand_in.close()
+
+
+def _parse_synthetic_spec(spec):
+    """Parse 'WIDTHxHEIGHT@FPS' (either part optional) into kwargs
+
+    """
+    kwargs = {}
+    if not spec:
+        return kwargs
+
+    resolution, _, fps = spec.partition('@')
+    if resolution:
+        width, height = resolution.split('x')
+        kwargs['width'] = int(width)
+        kwargs['height'] = int(height)
+    if fps:
+        kwargs['fps'] = float(fps)
+
+    return kwargs
+
+
+def open_capture(address, backend='opencv', **backend_options):
+    """Open a stream or video file with the given capture backend
+
+    Parameters
+    ----------
+    address : str
+        Stream URL or filename.
+    backend : str
+        'opencv' for cv2.VideoCapture or 'pyav' for
+        ptzipcam.av_capture.AvCapture.
+    **backend_options
+        Passed on to AvCapture.
+
+    """
+    if backend == 'pyav':
+        return AvCapture(address, **backend_options)
+    if backend != 'opencv':
+        raise ValueError(f'Unknown capture backend {backend}')
+    return cv2.VideoCapture(address)
+
+
+def open_frame_source(spec, backend='opencv', **backend_options):
+    """Open a frame source described by a configuration string
+
+    Parameters
+    ----------
+    spec : str
+        One of
+        'synthetic' or 'synthetic:WIDTHxHEIGHT@FPS' for a
+        SyntheticSource;
+        'file:FILENAME' for a (looping) FileSource;
+        'stream:' followed by either of the above for that source
+        served through a StreamStandIn;
+        anything else (e.g. an rtsp:// URL) is opened with
+        open_capture.
+    backend, **backend_options
+        For open_capture, when capturing a stream.
+
+    """
+    kind, _, rest = spec.partition(':')
+
+    if kind == 'synthetic':
+        return SyntheticSource(**_parse_synthetic_spec(rest))
+    if kind == 'file':
+        return FileSource(rest)
+    if kind == 'stream':
+        stand_in = StreamStandIn(open_frame_source(rest))
+        stand_in.start()
+        return _StandInCapture(stand_in,
+                               open_capture(stand_in.address,
+                                            backend,
+                                            **backend_options))
+
+    return open_capture(spec, backend, **backend_options)
@@ -4,14 +4,26 @@ At this stage, this amounts to a single class for recording stills.
 
 
 """
+import atexit
+import functools
 import logging
 import os
+import queue
+import threading
+import time
+import weakref
 
 from datetime import datetime
 import cv2
 
+from ptzipcam.metadata_index import DATABASE_SUFFIX, MetadataWriter
+from ptzipcam.segments import SEGMENT_BYTES, SEGMENT_SECONDS, SegmentWriter
+
 log = logging.getLogger(__name__)
 
+# what an asynchronous ImageStreamRecorder does when its queue is full
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
 
 def prep_timestamp(include_milliseconds=False):
     """Calculates, formats, and returns current timestamp
@@ -38,17 +50,110 @@ def prep_timestamp(include_milliseconds=False):
     return timestamp_string
 
 
-class ImageStreamRecorder():  # pylint: disable=too-few-public-methods
+def _close_at_exit(recorder_ref):
+    """atexit hook closing a recorder, if it is still around
+
+    """
+    recorder = recorder_ref()
+    if recorder is not None:
+        recorder.close()
+
+
+class ImageStreamRecorder():  # pylint: disable=too-many-instance-attributes
     """Handles recording images with their associate metadata
 
     The metadata are the PTZ state when the image was captured and
     objection detection (bounding box data, detected class, score)
     tied to that images capture.
 
+    With a queue_size, images are recorded asynchronously: record_image
+    only puts the image and its metadata on a queue, and writer threads
+    do the JPEG encoding and disk writes, so they take no time from the
+    caller's loop.  cv2.imencode releases the GIL, so several writer
+    threads encode in parallel, keeping up with bursts of frames on
+    more than one core; whichever thread finishes, images are written
+    (and their rows added to the CSV file) in the order recorded.
+
+    The CSV file is kept open and its rows buffered, to be written
+    together every flush_rows rows or flush_interval seconds, whichever
+    comes first, rather than the file being opened and closed for each
+    one.  close() (or the end of a with block) finishes writing
+    everything and closes it.  Call it (or use a with block) when done
+    with a recorder: the writer threads keep an asynchronous recorder,
+    and with it the CSV file, around until then.  Recorders still
+    around on exit are closed then, but the hook doing that only holds
+    a weak reference, so it doesn't keep them around itself.
+
+    With segments, images are appended to segment files (see
+    ptzipcam.segments) in the images folder rather than each written
+    to a file of its own, and the CSV file's IMAGE_FILE column refers
+    to them as 'NAME.seg:i' (read them with
+    ptzipcam.segments.RecordedImages).
+
+    With database, each row is also inserted (along with when the
+    image was recorded) into an SQLite database next to the CSV file,
+    to be queried with ptzipcam.metadata_index.MetadataIndex instead of
+    reading the CSV file whole.
+
+    Parameters
+    ----------
+    path : str
+        Folder to record into.
+    queue_size : int, optional
+        Most images waiting to be written; images are written
+        synchronously if not given.
+    writer_threads : int
+        Number of threads encoding and writing queued images.
+    overflow : str
+        What record_image does when the queue is full: 'block' until
+        there is room, 'drop_oldest' queued image, or 'drop_newest'
+        (the one being recorded).
+    flush_rows : int
+        Most CSV rows to buffer; 1 to write each row as it comes.
+    flush_interval : float, optional
+        Most seconds to keep a row buffered.
+    jpeg_quality : int
+        JPEG quality (0-100) images are encoded at.
+    burst_quality : int, optional
+        JPEG quality for images recorded as part of a burst (see
+        record_image), e.g. lower to encode them faster and smaller;
+        jpeg_quality if not given.
+    segments : bool
+        Record into segments.
+    segment_bytes, segment_seconds
+        Size and age at which to start a new segment.
+    database : bool
+        Also record the metadata in an SQLite database.
+
+    Attributes
+    ----------
+    database_filename : str
+        The SQLite database (None without database).
+    counts : dict
+        Numbers of images 'queued', 'dropped' (by the overflow
+        policy), and 'written' so far.  Every image recorded
+        asynchronously is counted as queued, under any overflow
+        policy and whether or not it is dropped later, so queued less
+        dropped and written is the number still waiting.
+
     """
 
-    def __init__(self, path):
+    def __init__(self,  # pylint: disable=R0913, R0914, R0915
+                 path,
+                 queue_size=None,
+                 writer_threads=1,
+                 overflow='block',
+                 flush_rows=100,
+                 flush_interval=1.0,
+                 jpeg_quality=95,
+                 burst_quality=None,
+                 segments=False,
+                 segment_bytes=SEGMENT_BYTES,
+                 segment_seconds=SEGMENT_SECONDS,
+                 database=False):
         log.debug('Initialize recorder.')
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'overflow must be one of {OVERFLOW_POLICIES}')
         self.path = path
         timestamp_string = prep_timestamp()
         image_folder_name = timestamp_string + '_images'
@@ -66,16 +171,82 @@ class ImageStreamRecorder():  # pylint: disable=too-few-public-methods
             log.warning(warning)
         self.record_filename = timestamp_string + '.csv'
         self.record_filename = os.path.join(self.path, self.record_filename)
-        with open(self.record_filename, 'w', encoding='utf-8') as record_file:
-            header_line = ('IMAGE_FILE,PAN_ANGLE,TILT_ANGLE,'
-                           'ZOOM_POWER,CLASS,SCORE,X,Y,W,H\n')
-            record_file.write(header_line)
+        # pylint: disable=consider-using-with
+        self._record_file = open(self.record_filename, 'w', encoding='utf-8')
+        header_line = ('IMAGE_FILE,PAN_ANGLE,TILT_ANGLE,'
+                       'ZOOM_POWER,CLASS,SCORE,X,Y,W,H\n')
+        self._record_file.write(header_line)
+        self._record_file.flush()
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._record_lock = threading.Lock()
+        self._unflushed_rows = 0
+        self._flush_timer = None
+        self.database_filename = None
+        self._database = None
+        if database:
+            self.database_filename = os.path.join(
+                self.path, timestamp_string + DATABASE_SUFFIX)
+            self._database = MetadataWriter(self.database_filename)
+        self._exit_hook = functools.partial(_close_at_exit,
+                                            weakref.ref(self))
+        atexit.register(self._exit_hook)
+
+        self._segments = None
+        if segments:
+            self._segments = SegmentWriter(self.image_path,
+                                           segment_bytes,
+                                           segment_seconds)
+        self.jpeg_quality = jpeg_quality
+        self.burst_quality = burst_quality
+        self.overflow = overflow
+        self.counts = {'queued': 0, 'dropped': 0, 'written': 0}
+        self._counts_lock = threading.Lock()
+        # images named in the same millisecond get _001, _002, ... added
+        self._last_name = None
+        self._name_repeats = 0
+        # images are numbered as recorded and written in that order
+        self._seq = 0
+        self._next_to_write = 0
+        self._encoded = {}
+        # seqs of images dropped, for the writer threads to skip
+        self._dropped = []
+        self._write_lock = threading.Lock()
+        self._queue = None
+        self._writers = []
+        if queue_size is not None:
+            self._queue = queue.Queue(queue_size)
+            for _ in range(writer_threads):
+                writer = threading.Thread(target=self._write_queued)
+                writer.daemon = True
+                writer.start()
+                self._writers.append(writer)
+
+    def _count(self, name):
+        with self._counts_lock:
+            self.counts[name] += 1
+
+    def _unique_name(self, timestamp_string):
+        """timestamp_string, with _001, _002, ... added if it repeats
+
+        Bursts come faster than a frame a millisecond, so the names
+        taken from their timestamps repeat.  Called with _counts_lock
+        held.
 
-    def record_image(self,  # pylint: disable=too-many-locals
+        """
+        if timestamp_string != self._last_name:
+            self._last_name = timestamp_string
+            self._name_repeats = 0
+            return timestamp_string
+        self._name_repeats += 1
+        return f'{timestamp_string}_{self._name_repeats:03d}'
+
+    def record_image(self,  # pylint: disable=too-many-arguments
                      image,
                      ptz_state,
                      detected_class,
-                     target_lbox):
+                     target_lbox,
+                     burst=False):
         """Record a single image to a file and append the associated PTZ state
         and object detection data to the recording CSV file.
 
@@ -83,7 +254,8 @@ class ImageStreamRecorder():  # pylint: disable=too-few-public-methods
         ----------
 
         image :
-            The image to record
+            The image to record.  When recording asynchronously, it is
+            written later, so it must not be changed afterwards.
 
         ptz_state : 3-tuple
             Contains the pan, tilt, zoom of the camera at the time the
@@ -95,20 +267,145 @@ class ImageStreamRecorder():  # pylint: disable=too-few-public-methods
         target_lbox : dict
             The parameters of the labeled bounding box of the detected target.
 
+        burst : bool
+            Whether the image is one of a burst (e.g. of frames after a
+            detection), to be encoded at burst_quality.
+
+        """
+        quality = self.jpeg_quality
+        if burst and self.burst_quality is not None:
+            quality = self.burst_quality
+        with self._counts_lock:
+            # named for when it is recorded, not when it is written
+            timestamp_string = self._unique_name(
+                prep_timestamp(include_milliseconds=True))
+            recorded_at = time.time()
+            seq = self._seq
+            self._seq += 1
+        metadata = (timestamp_string, recorded_at, ptz_state, detected_class,
+                    target_lbox)
+        if self._queue is None:
+            self._write_image(self._encode(image, quality), *metadata)
+            return
+
+        self._count('queued')
+        item = (seq, image, quality, metadata)
+        if self.overflow == 'block':
+            self._queue.put(item)
+        elif self.overflow == 'drop_newest':
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self._drop(seq)
+                return
+        else:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        dropped = self._queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    self._queue.task_done()
+                    self._drop(dropped[0])
+
+    def _drop(self, seq):
+        """Drop image seq, for the writer threads to skip over
+
+        Images are only dropped with the queue full, so a writer thread
+        will be along to take the drop into account (in
+        _write_in_order) rather than the recording thread having to
+        wait for the writers to do it.
+
+        """
+        with self._counts_lock:
+            self.counts['dropped'] += 1
+            self._dropped.append(seq)
+
+    def _encode(self, image, quality):
+        """Encode image as a JPEG
+
+        """
+        ret, encoded = cv2.imencode('.jpg', image,
+                                    [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ret:
+            raise cv2.error('JPEG encoding failed.')
+        return encoded
+
+    def _write_queued(self):
+        """Thread function encoding the images queued
+
         """
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                seq, image, quality, metadata = item
+                try:
+                    encoded_image = (self._encode(image, quality),) + metadata
+                except cv2.error as e:
+                    log.warning('Encoding %s failed: %s', metadata[0], e)
+                    encoded_image = None
+                self._write_in_order(seq, encoded_image)
+            finally:
+                self._queue.task_done()
+
+    def _write_in_order(self, seq, encoded_image):
+        """Write encoded image seq, and any after it waiting for it
+
+        encoded_image is the arguments for _write_image, or None for an
+        image not to write.
 
+        """
+        with self._write_lock:
+            self._encoded[seq] = encoded_image
+            with self._counts_lock:
+                dropped, self._dropped = self._dropped, []
+            for dropped_seq in dropped:
+                self._encoded[dropped_seq] = None
+            while self._next_to_write in self._encoded:
+                encoded_image = self._encoded.pop(self._next_to_write)
+                self._next_to_write += 1
+                if encoded_image is None:
+                    continue
+                try:
+                    self._write_image(*encoded_image)
+                except OSError as e:
+                    log.warning('Recording %s failed: %s',
+                                encoded_image[1], e)
+
+    def _write_image(self,  # pylint: disable=R0913, R0914
+                     encoded,
+                     timestamp_string,
+                     recorded_at,
+                     ptz_state,
+                     detected_class,
+                     target_lbox):
+        """Write an encoded image and its line of the CSV file
+
+        """
         pan_angle, tilt_angle, zoom = ptz_state
 
-        timestamp_string = prep_timestamp(include_milliseconds=True)
-        image_filename = timestamp_string + '.jpg'
+        if self._segments is not None:
+            image_filename = self._segments.write(encoded,
+                                                  recorded_at,
+                                                  ptz_state,
+                                                  detected_class,
+                                                  target_lbox)
+        else:
+            image_filename = timestamp_string + '.jpg'
 
-        # full_path = os.path.join(self.path, 'images')
-        # if not os.path.exists(full_path):
-        #     os.mkdir(full_path)
+            # full_path = os.path.join(self.path, 'images')
+            # if not os.path.exists(full_path):
+            #     os.mkdir(full_path)
 
-        image_filename_w_path = os.path.join(self.image_path,
-                                             image_filename)
-        cv2.imwrite(image_filename_w_path, image)
+            image_filename_w_path = os.path.join(self.image_path,
+                                                 image_filename)
+            with open(image_filename_w_path, 'wb') as image_file:
+                image_file.write(encoded)
 
         if target_lbox:
             score = 100 * target_lbox['confidence']
@@ -133,5 +430,95 @@ class ImageStreamRecorder():  # pylint: disable=too-few-public-methods
                                   box_width,
                                   box_height)
 
-        with open(self.record_filename, 'a', encoding='utf-8') as record_file:
-            record_file.write(record_line)
+        if self._database is not None:
+            self._database.add((image_filename,
+                                recorded_at,
+                                pan_angle,
+                                tilt_angle,
+                                zoom,
+                                str(detected_class),
+                                score,
+                                box_x_coord,
+                                box_y_coord,
+                                box_width,
+                                box_height))
+        self._write_row(record_line)
+        self._count('written')
+
+    def _write_row(self, record_line):
+        """Buffer a row of the CSV file, writing the rows out when due
+
+        """
+        with self._record_lock:
+            self._record_file.write(record_line)
+            self._unflushed_rows += 1
+            if self._unflushed_rows >= self.flush_rows:
+                self._flush_rows()
+            elif self._flush_timer is None and self.flush_interval:
+                self._flush_timer = threading.Timer(self.flush_interval,
+                                                    self._flush_when_due)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _flush_rows(self):
+        """Write out the rows buffered (with _record_lock held)
+
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        # the images before the rows referring to them
+        if self._segments is not None:
+            self._segments.flush()
+        if self._database is not None:
+            self._database.flush()
+        if not self._record_file.closed:
+            self._record_file.flush()
+        self._unflushed_rows = 0
+
+    def _flush_when_due(self):
+        """Timer function writing out rows buffered for flush_interval
+
+        """
+        with self._record_lock:
+            self._flush_timer = None
+            self._flush_rows()
+
+    def flush(self):
+        """Write the images queued so far and the CSV rows buffered
+
+        """
+        if self._queue is not None:
+            self._queue.join()
+        with self._record_lock:
+            self._flush_rows()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Write everything recorded, stop the writer threads, and close
+        the CSV file
+
+        The recorder can't be used afterwards.
+
+        """
+        if self._queue is not None:
+            for _ in self._writers:
+                self._queue.put(None)
+            for writer in self._writers:
+                writer.join()
+            self._writers = []
+            self._queue = None
+        with self._record_lock:
+            self._flush_rows()
+            self._record_file.close()
+        if self._segments is not None:
+            self._segments.close()
+        if self._database is not None:
+            self._database.close()
+            self._database = None
+        atexit.unregister(self._exit_hook)
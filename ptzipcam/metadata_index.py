@@ -0,0 +1,313 @@
+"""Indexes recorded images' metadata in an SQLite database
+
+ImageStreamRecorder's CSV file has to be read whole (and gone through
+row by row) to find anything in it.  With database=True the recorder
+also inserts each row into an SQLite database next to it (NAME.db),
+with the time each image was recorded and indexes on that time, the
+detected class, and the score, so a MetadataIndex can pick out, say,
+the frames of one class above a score in an hour near a pan angle (in
+degrees) without reading the rest:
+
+    with MetadataIndex('2024-05-01T06-00-00.db') as index:
+        rows = index.query(class_name='bird', min_score=50,
+                           start=datetime(2024, 5, 1, 7),
+                           end=datetime(2024, 5, 1, 8),
+                           pan=120)
+
+The columns are the CSV file's (see COLUMNS) plus TIMESTAMP, so the
+rows can stand in for it, e.g. pandas.DataFrame(rows).  As there,
+PAN_ANGLE, TILT_ANGLE, and ZOOM_POWER are the PTZ commands (pan and
+tilt in [-1, 1]), not degrees or zoom power.  index_csv builds a
+database for a recording made without one.
+
+The database is in WAL mode, so it can be queried while the recorder
+is still writing to it, and rows are inserted in batches, as the CSV
+file's are written.
+
+"""
+import csv
+import logging
+import os
+import sqlite3
+import threading
+
+from datetime import datetime
+
+from ptzipcam import convert
+from ptzipcam.segments import SegmentReader, parse_image_reference
+
+log = logging.getLogger(__name__)
+
+DATABASE_SUFFIX = '.db'
+
+COLUMNS = ('IMAGE_FILE', 'TIMESTAMP', 'PAN_ANGLE', 'TILT_ANGLE',
+           'ZOOM_POWER', 'CLASS', 'SCORE', 'X', 'Y', 'W', 'H')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    IMAGE_FILE TEXT,
+    TIMESTAMP REAL,
+    PAN_ANGLE REAL,
+    TILT_ANGLE REAL,
+    ZOOM_POWER REAL,
+    CLASS TEXT,
+    SCORE REAL,
+    X INTEGER,
+    Y INTEGER,
+    W INTEGER,
+    H INTEGER
+);
+CREATE INDEX IF NOT EXISTS images_timestamp ON images (TIMESTAMP);
+CREATE INDEX IF NOT EXISTS images_class_score ON images (CLASS, SCORE);
+CREATE INDEX IF NOT EXISTS images_score ON images (SCORE);
+"""
+
+INSERT = (f'INSERT INTO images ({", ".join(COLUMNS)}) '
+          f'VALUES ({", ".join("?" * len(COLUMNS))})')
+
+# the CSV file's images are named for when they were recorded
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H-%M-%S_%f'
+
+
+def _connect(filename):
+    connection = sqlite3.connect(filename, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _seconds(time_point):
+    """time.time() seconds of a datetime (or seconds already)
+
+    """
+    if isinstance(time_point, datetime):
+        return time_point.timestamp()
+    return time_point
+
+
+class MetadataWriter():
+    """Inserts rows of image metadata into a database in batches
+
+    Rows added are inserted (in one transaction) when flush() is
+    called; ImageStreamRecorder does so as it writes out its CSV rows.
+
+    Parameters
+    ----------
+    filename : str
+        The database, created if it doesn't exist.
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._rows = []
+        self._connection = _connect(filename)
+
+    def add(self, row):
+        """Add a row to be inserted, with values in the order of COLUMNS
+
+        """
+        with self._lock:
+            self._rows.append(row)
+
+    def flush(self):
+        """Insert the rows added
+
+        If that fails (e.g. the database is locked by a long query),
+        the rows are kept to be inserted with the next ones.
+
+        """
+        with self._lock:
+            if not self._rows:
+                return
+            try:
+                with self._connection:
+                    self._connection.executemany(INSERT, self._rows)
+            except sqlite3.Error as e:
+                log.warning('Inserting %d rows into %s failed: %s',
+                            len(self._rows), self.filename, e)
+                return
+            self._rows = []
+
+    def close(self):
+        """Insert the rows added and close the database
+
+        """
+        self.flush()
+        with self._lock:
+            self._connection.close()
+
+
+class MetadataIndex():
+    """Queries a database of recorded images' metadata
+
+    Parameters
+    ----------
+    filename : str
+        The database (NAME.db) of a recording.
+
+    """
+
+    def __init__(self, filename):
+        if not os.path.exists(filename):
+            raise FileNotFoundError(f'No metadata database {filename}')
+        self.filename = filename
+        self._connection = _connect(filename)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.create_function('command_to_degrees',
+                                         2,
+                                         convert.command_to_degrees,
+                                         deterministic=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def query(self,  # pylint: disable=too-many-arguments
+              class_name=None,
+              min_score=None,
+              start=None,
+              end=None,
+              pan=None,
+              pan_tolerance=5.0,
+              pan_range=360.0,
+              limit=None):
+        """Rows of the images matching all the criteria given
+
+        Parameters
+        ----------
+        class_name : str, optional
+            Detected class.
+        min_score : float, optional
+            Lowest score (0-100).
+        start, end : datetime or float, optional
+            Recorded from start up to end, as datetimes or time.time()
+            seconds.
+        pan : float, optional
+            Recorded within pan_tolerance degrees of this pan angle, in
+            degrees (as in the configs' INIT_POS).  The PAN_ANGLE
+            commands recorded are converted to degrees with
+            convert.command_to_degrees.  For a camera panning all the
+            way around (pan_range of 360), angles are compared around
+            the circle, so 355 is near 5; otherwise the ends of its
+            travel are far apart.
+        pan_tolerance : float
+            See pan.
+        pan_range : float
+            Full range of the camera's pan axis in degrees, for
+            converting the PAN_ANGLE commands.
+        limit : int, optional
+            Most rows to return.
+
+        Returns
+        -------
+        list of dict
+            Rows with the keys of COLUMNS, in the order recorded.
+
+        """
+        conditions = []
+        params = []
+        if class_name is not None:
+            conditions.append('CLASS = ?')
+            params.append(class_name)
+        if min_score is not None:
+            conditions.append('SCORE >= ?')
+            params.append(min_score)
+        if start is not None:
+            conditions.append('TIMESTAMP >= ?')
+            params.append(_seconds(start))
+        if end is not None:
+            conditions.append('TIMESTAMP < ?')
+            params.append(_seconds(end))
+        if pan is not None and pan_range >= 360:
+            # both in [0, 360], so the shorter way around is the
+            # lesser of the difference and 360 less it
+            conditions.append('MIN(ABS(command_to_degrees(PAN_ANGLE, ?) - ?),'
+                              ' 360 - ABS(command_to_degrees(PAN_ANGLE, ?)'
+                              ' - ?)) <= ?')
+            params.extend((pan_range, pan % 360, pan_range, pan % 360,
+                           pan_tolerance))
+        elif pan is not None:
+            conditions.append('ABS(command_to_degrees(PAN_ANGLE, ?) - ?) <= ?')
+            params.extend((pan_range, pan, pan_tolerance))
+
+        sql = f'SELECT {", ".join(COLUMNS)} FROM images'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY TIMESTAMP, rowid'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        return [dict(row) for row in self._connection.execute(sql, params)]
+
+    def close(self):
+        """Close the database
+
+        """
+        self._connection.close()
+
+
+def _image_timestamp(image_file, image_path, readers):
+    """time.time() seconds an image in the CSV file was recorded at
+
+    From the image's record for images in segments, or else its name.
+
+    """
+    segment_name, index = parse_image_reference(image_file)
+    if segment_name is not None:
+        if segment_name not in readers:
+            readers[segment_name] = SegmentReader(
+                os.path.join(image_path, segment_name))
+        reader = readers[segment_name]
+        if index < len(reader):
+            return float(reader.index['timestamp'][index])
+        return None
+    # less any _N added to tell apart images named in the same
+    # millisecond
+    name = '_'.join(os.path.splitext(image_file)[0].split('_')[:2])
+    try:
+        return datetime.strptime(name, TIMESTAMP_FORMAT).timestamp()
+    except ValueError:
+        return None
+
+
+def index_csv(csv_filename, filename=None):
+    """Build a database of the metadata in a recording's CSV file
+
+    Parameters
+    ----------
+    csv_filename : str
+        ImageStreamRecorder's CSV file (NAME.csv).
+    filename : str, optional
+        The database to build; NAME.db if not given.
+
+    Returns
+    -------
+    str
+        Filename of the database.
+
+    """
+    basename = os.path.splitext(csv_filename)[0]
+    if filename is None:
+        filename = basename + DATABASE_SUFFIX
+    image_path = basename + '_images'
+
+    writer = MetadataWriter(filename)
+    readers = {}
+    with open(csv_filename, newline='', encoding='utf-8') as csv_file:
+        for row in csv.DictReader(csv_file):
+            timestamp = _image_timestamp(row['IMAGE_FILE'],
+                                         image_path,
+                                         readers)
+            writer.add(tuple(timestamp if column == 'TIMESTAMP'
+                             else row[column] for column in COLUMNS))
+    for reader in readers.values():
+        reader.close()
+    writer.close()
+    log.info('Indexed %s in %s', csv_filename, filename)
+    return filename
@@ -0,0 +1,293 @@
+"""Motor controllers turning a detection into PTZ velocities
+
+Each controller takes the labeled box of a tracked target and works out
+the pan and tilt velocities (and zoom command) that bring it toward the
+center of the frame, for PtzCam.move_w_zoom.
+
+"""
+import logging
+
+import numpy as np
+from camml import draw
+
+log = logging.getLogger(__name__)
+
+
+class MotorController():
+    """Base class for motor controllers
+
+    """
+    # pylint: disable='too-few-public-methods'
+
+    def __init__(self,
+                 pid_gains,
+                 orientation,
+                 example_frame):
+        """Constructor for MotorController class
+
+        """
+
+        self.pid_gains = pid_gains
+        self.orientation = orientation
+
+        self.frame_width = example_frame.shape[1]
+        self.frame_height = example_frame.shape[0]
+
+        self.total_frame_pixels = self.frame_width * self.frame_height
+
+    def _calc_errors(self,
+                     target_lbox):
+        """Calculate errors from box coordinates
+
+        Given a labeled box that is the bounding box of a detected
+        target, this function calculates an error for each of x and y
+        (pan and tilt) based on the offset of the centroid of the
+        bounding box from the center of the frame.
+
+        """
+        if target_lbox:
+            x_c, y_c = draw.box_to_coords(target_lbox['box'],
+                                          return_kind='center')
+            ret = draw.box_to_coords(target_lbox['box'])
+            self.box_x, self.box_y, self.box_width, self.box_height = ret
+            x_err = self.frame_width/2 - x_c
+            y_err = self.frame_height/2 - y_c
+
+            # normalize errors
+            x_err = x_err/self.frame_width
+            y_err = y_err/self.frame_height
+        else:
+            x_err = 0.0
+            y_err = 0.0
+
+        return x_err, y_err
+
+    def update(self, target_lbox, zoom_command):
+        """Update the camera commands
+
+        Generates commands for pan, tilt, and zoom given the current
+        target_lbox (which is None when no detection) and the current
+        zoom_command.
+
+        Parameters
+        ----------
+        target_lbox :
+
+        zoom_command : float
+            Current zoom_command
+
+        Returns
+        -------
+        x_velocity :
+
+        y_velocity :
+
+        zoom_command :
+
+        """
+        errors = self._calc_errors(target_lbox)
+        x_err, y_err = errors
+
+        if self.orientation == 'down':
+            x_err = -x_err
+            y_err = -y_err
+
+        x_velocity = self._calc_command(x_err, self.pid_gains[0])
+        y_velocity = self._calc_command(y_err, self.pid_gains[1])
+        zoom_command = self._calc_zoom_command(target_lbox,
+                                               x_err,
+                                               y_err,
+                                               zoom_command)
+
+        log.debug('x_err: %.2f || y_err: %.2f', x_err, y_err)
+        log.debug('x_vel: %.2f || y_vel: %.2f', x_velocity, y_velocity)
+        log.debug('zoom_command: %.2f', zoom_command)
+
+        return (x_velocity, y_velocity, zoom_command)
+
+    def _ensure_command_in_bounds(self, command):
+        """Util to force command is within necessary bounds
+
+        """
+        if command >= 1.0:
+            command = 1.0
+        if command <= -1.0:
+            command = -1.0
+
+        return command
+
+    def _calc_command(self, err, k):
+        """Implements actual controller math
+
+        This basic implementation in the base class is a mere
+        proportional controller.  If need PI, PID, or such, this
+        method should be replaced in the child class.  It is not
+        currently imagined that controllers outside the PID space will
+        be pursued.
+
+        """
+        command = k * err
+        command = self._ensure_command_in_bounds(command)
+        return command
+
+    def _calc_zoom_command(self, target_lbox, x_err, y_err, zoom_command):
+        """Calculate the next zoom command
+
+        Not implemented in the base class. But should be implemented
+        to effect zoom control based on position/size of target_lbox.
+
+        """
+        raise NotImplementedError
+
+
+class CalmMotorController(MotorController):
+    """MotorController with calm movements/behaviors
+
+    In certain instances, the desire is not for rapid and exacting
+    tracking but for tracking that doesn't distract from the scene
+    through quick movements and jitteriness.  This subclass is
+    intended to be that sort of calm tracker.
+
+    """
+
+    def __init__(self,
+                 pid_gains,
+                 orientation,
+                 example_frame):
+
+        super().__init__(pid_gains,
+                         orientation,
+                         example_frame)
+
+        self.zoom_stop_ratio = .6
+        self.stop_range = .1
+
+    def _calc_command(self, err, k):
+        """Override controller command method
+
+        The meat here is that the controller stops moving axis under
+        control if error is inside of some range.  This range is
+        currently hardcoded but maybe should be given as an argument
+        to the constructor.
+
+        """
+
+        if np.abs(err) < self.stop_range:
+            command = 0
+        else:
+            command = k * err
+
+        command = self._ensure_command_in_bounds(command)
+
+        return command
+
+    def _calc_zoom_command(self, target_lbox, x_err, y_err, zoom_command):
+        """Calculate the zoom command give pan/tilt errors
+
+        This is where most of the behavior of the tracking is
+        implemented.
+
+        """
+
+        if (x_err <= 0.5 and y_err <= 0.5
+           and target_lbox):
+            target_bb_pixels = self.box_width * self.box_height
+
+            box_ratio = target_bb_pixels / self.total_frame_pixels
+            log.debug('Ratio of box to whole %.2f', box_ratio)
+
+            if box_ratio < .3:
+                zoom_command = 1.0
+            else:
+                zoom_command = 0.0
+
+            ratio = self.zoom_stop_ratio
+            spans_much_width = self.box_width >= ratio * self.frame_width
+            spans_much_height = self.box_height >= ratio * self.frame_height
+            if spans_much_width or spans_much_height:
+                zoom_command = 0.0
+
+            margin = 20
+            if ((self.box_y + self.box_height) >= (self.frame_height - margin)
+               or (self.box_y <= margin)):
+                zoom_command = -1.0
+
+        return zoom_command
+
+
+class TwitchyMotorController(MotorController):
+
+    def __init__(self,
+                 pid_gains,
+                 orientation,
+                 example_frame):
+
+        super().__init__(pid_gains,
+                         orientation,
+                         example_frame)
+
+        self.zoom_stop_ratio = .7
+
+    def _calc_zoom_command(self, target_lbox, x_err, y_err, zoom_command):
+        """Calculate the zoom command give pan/tilt errors
+
+        """
+        if x_err != 0.0 and y_err != 0.0:
+            target_bb_pixels = self.box_width * self.box_height
+
+            # ratio of bb pixels over whole frame pixels is below a
+            # threshold then zoom
+            ratio = target_bb_pixels / self.total_frame_pixels
+            error = 1 - ratio
+            zoom_command = 0.05 * error
+
+            # stop zoom if either dimension of bounding box is
+            l_ratio = self.zoom_stop_ratio  # length ratio
+            spans_much_width = self.box_width >= l_ratio * self.frame_width
+            spans_much_height = self.box_height >= l_ratio * self.frame_height
+            if spans_much_width or spans_much_height:
+                zoom_command = -0.1
+
+            # margin = 100
+            # if((self.box_y + self.box_height) >= (self.frame_height - margin)
+            #    or (self.box_y <= margin)):
+            #     zoom_command = 0.0
+        else:
+            zoom_command = 0.0
+
+        return zoom_command
+
+
+class BouncyZoomMotorController(MotorController):
+
+    def __init__(self,
+                 pid_gains,
+                 orientation,
+                 example_frame):
+
+        super().__init__(pid_gains,
+                         orientation,
+                         example_frame)
+
+        self.zoom_stop_ratio = .7
+
+    def _calc_zoom_command(self, target_lbox, x_err, y_err, zoom_command):
+        """Calculate the zoom command give pan/tilt errors
+
+        """
+        if x_err != 0.0 and y_err != 0.0:
+            target_bb_pixels = self.box_width * self.box_height
+
+            # ratio of bb pixels over whole frame pixels is below a
+            # threshold then zoom
+            ratio = target_bb_pixels / self.total_frame_pixels
+            if ratio < .1:
+                zoom_command = 0.01
+            elif ratio > .3:
+                zoom_command = -0.01
+            else:
+                zoom_command = 0.0
+        else:
+            zoom_command = 0.0
+
+        return zoom_command
@@ -2,12 +2,19 @@
 
 """
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-from onvif import ONVIFCamera
 
-from camml import draw
+from ptzipcam.command_dedup import STOP_VELOCITY, CommandDeduplicator
+from ptzipcam.discovery import (CACHE_DIR, create_service, discover,
+                                get_default_transport, get_firmware_version,
+                                load_discovery, save_discovery)
+from ptzipcam.soap import FastPtzTransport
+from ptzipcam.status_poller import (PtzStatus, StatusPoller,
+                                    summarize_move_status)
 
 log = logging.getLogger(__name__)
 
@@ -38,459 +45,589 @@ def _check_zeroness(number):
     return number
 
 
-class MotorController():
-    """Base class for motor controllers
-
-    """
-    # pylint: disable='too-few-public-methods'
-
-    def __init__(self,
-                 pid_gains,
-                 orientation,
-                 example_frame):
-        """Constructor for MotorController class
-
-        """
-
-        self.pid_gains = pid_gains
-        self.orientation = orientation
+class PtzCam():
+    """Class to control PTZ on ONVIF-compliant PTZ IP Camera
 
-        self.frame_width = example_frame.shape[1]
-        self.frame_height = example_frame.shape[0]
+    Allows control of the pan, tilt, and zoom of an ONVIF-compliant IP
+    camera that has PTZ capability.
 
-        self.total_frame_pixels = self.frame_width * self.frame_height
+    A PtzCam can be shared between threads: PTZ commands are sent one
+    at a time and imaging settings changes are likewise serialized.
+    See ptzipcam.shared_ptz_cams for sharing one per camera across
+    a process.  Something sending PTZ commands to the camera on its own
+    (e.g. AsyncPtzCam) can share a PtzCam's command bookkeeping with
+    claim_command and rollback_command, and its status cache with
+    cached_status.
 
-    def _calc_errors(self,
-                     target_lbox):
-        """Calculate errors from box coordinates
+    """
+    def __init__(self,
+                 ip_address=None,
+                 port='80',
+                 user=None,
+                 pword=None,
+                 transport=None,
+                 fast_transport=False,
+                 status_poll_rate=None,
+                 command_tolerance=None,
+                 keepalive_interval=None,
+                 discovery_cache=None):
+        """ PtzCam constructor
 
-        Given a labeled box that is the bounding box of a detected
-        target, this function calculates an error for each of x and y
-        (pan and tilt) based on the offset of the centroid of the
-        bounding box from the center of the frame.
+        Parameters
+        ----------
+        ip_address : str
+           The IP address of the camera to connect to.
+        port : str
+           ONVIF port on the camera. This is usually 80
+        user : str
+           Valid username of account on the IP camera being connected to.
+        pword : str
+           Password for the account on the IP camera.
+        transport : zeep.Transport, optional
+           Transport handed through to the ONVIF client. Mostly useful
+           for pointing PtzCam at a stand-in camera when benchmarking.
+           If not given, a transport shared by every PtzCam in the
+           process is used so connections are kept alive and pooled.
+        fast_transport : bool
+           If True, ContinuousMove, AbsoluteMove, Stop, and GetStatus
+           are sent as pre-serialized SOAP over a persistent HTTP
+           session instead of through zeep. zeep is still used for
+           discovery and imaging settings.
+        status_poll_rate : float, optional
+           If given, a background thread refreshes the PTZ status this
+           many times a second and get_position/get_status answer from
+           that cache instead of asking the camera.
+        command_tolerance : float, optional
+           If given, continuous moves (and stops) within this
+           tolerance of the last velocity sent are not sent again,
+           and a stop immediately followed by a move is folded into
+           the move. See command_counts for what that saved.
+        keepalive_interval : float, optional
+           Seconds after which an unchanged continuous move is sent
+           again anyway, for cameras that time out continuous moves.
+           Only relevant along with command_tolerance.
+        discovery_cache : bool or str, optional
+           If True (or a directory to use instead of
+           ~/.cache/ptzipcam), what is learned about the camera when
+           connecting is saved and reused on later connections to the
+           same camera with the same firmware, skipping most of the
+           round trips and WSDL parsing. Services are then created as
+           they are first used.
 
         """
-        if target_lbox:
-            x_c, y_c = draw.box_to_coords(target_lbox['box'],
-                                          return_kind='center')
-            ret = draw.box_to_coords(target_lbox['box'])
-            self.box_x, self.box_y, self.box_width, self.box_height = ret
-            x_err = self.frame_width/2 - x_c
-            y_err = self.frame_height/2 - y_c
-
-            # normalize errors
-            x_err = x_err/self.frame_width
-            y_err = y_err/self.frame_height
+        self.fast_transport = None
+
+        self._status_poller = StatusPoller(self._fetch_status)
+
+        self._commands = CommandDeduplicator(command_tolerance,
+                                             keepalive_interval)
+        self.command_counts = self._commands.counts
+        # held while sending, so commands go out one at a time
+        self._command_lock = threading.RLock()
+
+        self.min_done_poll_interval = .02
+        self.max_done_poll_interval = .25
+        self._move_waiter = None
+
+        if transport is None:
+            transport = get_default_transport()
+
+        self.ip_address = ip_address
+        self.port = port
+        self._user = user
+        self._pword = pword
+        self._transport = transport
+        self._imaging_lock = threading.RLock()
+        self._services = {}
+        self._services_lock = threading.Lock()
+        self._media_profile = None
+        self._video_source = None
+        self._imaging_settings = None
+
+        discovery = None
+        cache_dir = None
+        if discovery_cache:
+            cache_dir = (CACHE_DIR if discovery_cache is True
+                         else discovery_cache)
+            firmware_version = get_firmware_version(ip_address, port,
+                                                    user, pword,
+                                                    transport)
+            discovery = load_discovery(cache_dir, ip_address, port,
+                                       firmware_version)
+
+        if discovery is None:
+            discovery, self._services = discover(ip_address, port,
+                                                 user, pword,
+                                                 transport)
+            if cache_dir is not None:
+                save_discovery(cache_dir, ip_address, port, discovery)
         else:
-            x_err = 0.0
-            y_err = 0.0
+            log.info('Using cached discovery for %s:%s.', ip_address, port)
 
-        return x_err, y_err
+        self.xaddrs = discovery['xaddrs']
+        self.profile_token = discovery['profile_token']
+        self.video_source_token = discovery['video_source_token']
+        self.default_speed = discovery['default_speed']
+        self.iris_bounds = discovery['iris_bounds']
+        self.exposure_time_bounds = discovery['exposure_time_bounds']
 
-    def update(self, target_lbox, zoom_command):
-        """Update the camera commands
-
-        Generates commands for pan, tilt, and zoom given the current
-        target_lbox (which is None when no detection) and the current
-        zoom_command.
-
-        Parameters
-        ----------
-        target_lbox :
+        self.pan_bounds = [-1.0, 1.0]
+        self.tilt_bounds = [-1.0, 1.0]
+        self.zoom_bounds = [0.0, 1.0]
 
-        zoom_command : float
-            Current zoom_command
+        if fast_transport:
+            self.fast_transport = FastPtzTransport(self.xaddrs['ptz'],
+                                                   user,
+                                                   pword,
+                                                   self.profile_token,
+                                                   self.default_speed,
+                                                   session=transport.session)
+            log.info('Using fast transport for PTZ commands.')
 
-        Returns
-        -------
-        x_velocity :
+        self._prep_request_templates()
 
-        y_velocity :
+        if status_poll_rate:
+            self.start_status_poller(status_poll_rate)
 
-        zoom_command :
+    def _get_service(self, name):
+        """Get an ONVIF service, creating it on first use
 
         """
-        errors = self._calc_errors(target_lbox)
-        x_err, y_err = errors
+        with self._services_lock:
+            service = self._services.get(name)
+            if service is None:
+                service = create_service(name,
+                                         self.xaddrs[name],
+                                         self._user,
+                                         self._pword,
+                                         self._transport)
+                self._services[name] = service
+
+        return service
+
+    @property
+    def ptz_service(self):
+        return self._get_service('ptz')
+
+    @property
+    def imaging_service(self):
+        return self._get_service('imaging')
+
+    @property
+    def media_profile(self):
+        """The media profile PTZ commands are sent for (fetched on use)
 
-        if self.orientation == 'down':
-            x_err = -x_err
-            y_err = -y_err
+        """
+        if self._media_profile is None:
+            profiles = self._get_service('media').GetProfiles()
+            self._media_profile = next(profile for profile in profiles
+                                       if profile.token == self.profile_token)
+        return self._media_profile
 
-        x_velocity = self._calc_command(x_err, self.pid_gains[0])
-        y_velocity = self._calc_command(y_err, self.pid_gains[1])
-        zoom_command = self._calc_zoom_command(target_lbox,
-                                               x_err,
-                                               y_err,
-                                               zoom_command)
+    @property
+    def video_source(self):
+        """The camera's video source (fetched on use)
 
-        log.debug('x_err: %.2f || y_err: %.2f', x_err, y_err)
-        log.debug('x_vel: %.2f || y_vel: %.2f', x_velocity, y_velocity)
-        log.debug('zoom_command: %.2f', zoom_command)
+        """
+        if self._video_source is None:
+            sources = self._get_service('media').GetVideoSources()
+            self._video_source = next(
+                source for source in sources
+                if source.token == self.video_source_token)
+        return self._video_source
 
-        return (x_velocity, y_velocity, zoom_command)
+    @property
+    def imaging_settings(self):
+        """Imaging settings as last fetched from or sent to the camera
 
-    def _ensure_command_in_bounds(self, command):
-        """Util to force command is within necessary bounds
+        """
+        with self._imaging_lock:
+            if self._imaging_settings is None:
+                vst = {'VideoSourceToken': self.video_source_token}
+                self._imaging_settings = (self.imaging_service
+                                          .GetImagingSettings(vst))
+        return self._imaging_settings
+
+    def _prep_request_templates(self):
+        """Build the PTZ request objects reused by every command
+
+        Building a request with create_type is surprisingly costly
+        and the control loops send commands every frame, so each
+        request is built once here and only its numeric fields are
+        mutated on each call.  With the fast transport there are no
+        zeep requests to build (and so no PTZ service to create) and
+        only the AbsoluteMove position is kept.  That position is
+        filled in from the camera before the first move commanding
+        only some axes so that the others stay where they are.
 
         """
-        if command >= 1.0:
-            command = 1.0
-        if command <= -1.0:
-            command = -1.0
+        token = self.profile_token
+        self._status_request = {'ProfileToken': token}
+        self._stop_request = {'ProfileToken': token}
+
+        self._abs_move_position = {'PanTilt': {'x': 0.0, 'y': 0.0},
+                                   'Zoom': {'x': 0.0}}
+        self._abs_move_position_stale = True
+
+        self._continuous_move_request = None
+        self._absolute_move_request = None
+        if self.fast_transport:
+            return
+
+        self._continuous_move_request = self.ptz_service.create_type(
+            'ContinuousMove')
+        self._continuous_move_request.ProfileToken = token
+        self._continuous_move_request.Velocity = {'PanTilt': {'x': 0.0,
+                                                              'y': 0.0},
+                                                  'Zoom': {'x': 0.0}}
+
+        self._absolute_move_request = self.ptz_service.create_type(
+            'AbsoluteMove')
+        self._absolute_move_request.ProfileToken = token
+        if self.default_speed is not None:
+            pan_speed, tilt_speed, zoom_speed = self.default_speed
+            self._absolute_move_request.Speed = {
+                'PanTilt': {'x': pan_speed, 'y': tilt_speed},
+                'Zoom': {'x': zoom_speed}}
+        self._absolute_move_request.Position = self._abs_move_position
 
-        return command
+    def __del__(self):
+        log.info('PtzCam object deletion.')
 
-    def _calc_command(self, err, k):
-        """Implements actual controller math
+    def start_status_poller(self, rate):
+        """Start refreshing the cached PTZ status in the background
 
-        This basic implementation in the base class is a mere
-        proportional controller.  If need PI, PID, or such, this
-        method should be replaced in the child class.  It is not
-        currently imagined that controllers outside the PID space will
-        be pursued.
+        Parameters
+        ----------
+        rate : float
+            Status requests per second.
 
         """
-        command = k * err
-        command = self._ensure_command_in_bounds(command)
-        return command
-
-    def _calc_zoom_command(self, target_lbox, x_err, y_err, zoom_command):
-        """Calculate the next zoom command
+        self._status_poller.start(rate)
 
-        Not implemented in the base class. But should be implemented
-        to effect zoom control based on position/size of target_lbox.
+    def stop_status_poller(self):
+        """Stop the background status poller if it is running
 
         """
-        raise NotImplementedError
-
+        self._status_poller.stop()
 
-class CalmMotorController(MotorController):
-    """MotorController with calm movements/behaviors
+    def _fetch_status(self):
+        """Ask the camera for its status
 
-    In certain instances, the desire is not for rapid and exacting
-    tracking but for tracking that doesn't distract from the scene
-    through quick movements and jitteriness.  This subclass is
-    intended to be that sort of calm tracker.
-
-    """
+        """
+        if self.fast_transport:
+            pan, tilt, zoom, move_status = self.fast_transport.get_status()
+        else:
+            status = self.ptz_service.GetStatus(self._status_request)
+            position = status.Position
+            pan = position['PanTilt']['x']
+            tilt = position['PanTilt']['y']
+            zoom = position['Zoom']['x']
+            move_status = summarize_move_status(status.MoveStatus)
 
-    def __init__(self,
-                 pid_gains,
-                 orientation,
-                 example_frame):
+        return PtzStatus(pan, tilt, zoom, move_status, time.monotonic())
 
-        super().__init__(pid_gains,
-                         orientation,
-                         example_frame)
+    def cached_status(self, max_age=None):
+        """Get the status poller's last PTZ state if it is fresh enough
 
-        self.zoom_stop_ratio = .6
-        self.stop_range = .1
+        Never asks the camera.
 
-    def _calc_command(self, err, k):
-        """Override controller command method
+        Parameters
+        ----------
+        max_age : float, optional
+            Oldest (in seconds) the status may be. If None, any age
+            will do.
 
-        The meat here is that the controller stops moving axis under
-        control if error is inside of some range.  This range is
-        currently hardcoded but maybe should be given as an argument
-        to the constructor.
+        Returns
+        -------
+        status : PtzStatus or None
+            None if the status poller isn't running, hasn't heard from
+            the camera yet, or last did longer than max_age ago.
 
         """
+        return self._status_poller.cached(max_age)
 
-        if np.abs(err) < self.stop_range:
-            command = 0
-        else:
-            command = k * err
-
-        command = self._ensure_command_in_bounds(command)
-
-        return command
+    def get_status(self, max_age=None):
+        """Get the PTZ state, from the poller's cache when possible
 
-    def _calc_zoom_command(self, target_lbox, x_err, y_err, zoom_command):
-        """Calculate the zoom command give pan/tilt errors
+        Parameters
+        ----------
+        max_age : float, optional
+            Oldest (in seconds) a cached status may be and still be
+            returned. If None, any cached status will do. Only
+            relevant when the status poller is running; otherwise the
+            camera is always asked.
 
-        This is where most of the behavior of the tracking is
-        implemented.
+        Returns
+        -------
+        status : PtzStatus
+            Pan, tilt, zoom, move status, and when they were read.
 
         """
+        status = self.cached_status(max_age)
+        if status is None:
+            status = self._fetch_status()
+            self._status_poller.update(status)
 
-        if (x_err <= 0.5 and y_err <= 0.5
-           and target_lbox):
-            target_bb_pixels = self.box_width * self.box_height
-
-            box_ratio = target_bb_pixels / self.total_frame_pixels
-            log.debug('Ratio of box to whole %.2f', box_ratio)
-
-            if box_ratio < .3:
-                zoom_command = 1.0
-            else:
-                zoom_command = 0.0
+        return status
 
-            ratio = self.zoom_stop_ratio
-            spans_much_width = self.box_width >= ratio * self.frame_width
-            spans_much_height = self.box_height >= ratio * self.frame_height
-            if spans_much_width or spans_much_height:
-                zoom_command = 0.0
+    def get_exposure(self):
+        with self._imaging_lock:
+            vst = {'VideoSourceToken': self.video_source_token}
+            self._imaging_settings = self.imaging_service.GetImagingSettings(
+                vst)
 
-            margin = 20
-            if ((self.box_y + self.box_height) >= (self.frame_height - margin)
-               or (self.box_y <= margin)):
-                zoom_command = -1.0
+            exp_time = self.imaging_settings.Exposure.ExposureTime
+            gain = self.imaging_settings.Exposure.Gain
+            iris = self.imaging_settings.Exposure.Iris
 
-        return zoom_command
+            return exp_time, gain, iris
 
+    def _send_imaging_settings(self):
+        command_dict = {'VideoSourceToken': self.video_source_token,
+                        'ImagingSettings': self.imaging_settings}
+        self.imaging_service.SetImagingSettings(command_dict)
 
-class TwitchyMotorController(MotorController):
+    def set_exposure_to_auto(self):
+        with self._imaging_lock:
+            self.imaging_settings.Exposure['Mode'] = 'AUTO'
+            self._send_imaging_settings()
 
-    def __init__(self,
-                 pid_gains,
-                 orientation,
-                 example_frame):
+    def set_focus_to_auto(self):
+        with self._imaging_lock:
+            self.imaging_settings.Focus['AutoFocusMode'] = 'AUTO'
+            self._send_imaging_settings()
 
-        super().__init__(pid_gains,
-                         orientation,
-                         example_frame)
+    def set_focus_to_manual(self):
+        with self._imaging_lock:
+            self.imaging_settings.Focus['AutoFocusMode'] = 'MANUAL'
+            self._send_imaging_settings()
 
-        self.zoom_stop_ratio = .7
+    def set_exposure_time(self, exposure_time):
+        # need to implement bound checking using bounds gotten in constructor
+        with self._imaging_lock:
+            self.imaging_settings.Exposure['Mode'] = 'MANUAL'
+            self.imaging_settings.Exposure['ExposureTime'] = exposure_time
+            self._send_imaging_settings()
 
-    def _calc_zoom_command(self, target_lbox, x_err, y_err, zoom_command):
-        """Calculate the zoom command give pan/tilt errors
+    def set_iris(self, iris):
+        # need to implement bound checking using bounds gotten in constructor
+        with self._imaging_lock:
+            self.imaging_settings.Exposure['Mode'] = 'MANUAL'
+            self.imaging_settings.Exposure['Iris'] = iris
+            self._send_imaging_settings()
 
-        """
-        if x_err != 0.0 and y_err != 0.0:
-            target_bb_pixels = self.box_width * self.box_height
-
-            # ratio of bb pixels over whole frame pixels is below a
-            # threshold then zoom
-            ratio = target_bb_pixels / self.total_frame_pixels
-            error = 1 - ratio
-            zoom_command = 0.05 * error
-
-            # stop zoom if either dimension of bounding box is
-            l_ratio = self.zoom_stop_ratio  # length ratio
-            spans_much_width = self.box_width >= l_ratio * self.frame_width
-            spans_much_height = self.box_height >= l_ratio * self.frame_height
-            if spans_much_width or spans_much_height:
-                zoom_command = -0.1
-
-            # margin = 100
-            # if((self.box_y + self.box_height) >= (self.frame_height - margin)
-            #    or (self.box_y <= margin)):
-            #     zoom_command = 0.0
-        else:
-            zoom_command = 0.0
+    def set_gain(self, gain):
+        # need to implement bound checking using bounds
+        with self._imaging_lock:
+            self.imaging_settings.Exposure['Mode'] = 'MANUAL'
+            self.imaging_settings.Exposure['Gain'] = gain
+            self._send_imaging_settings()
 
-        return zoom_command
+    def focus_out(self):
+        focus_request = self.imaging_service.create_type('Move')
+        focus_request.VideoSourceToken = self.video_source_token
+        focus_request.Focus = {'Continuous': {'Speed': 0.1}}
+        self.imaging_service.Move(focus_request)
 
+    def focus_in(self):
+        focus_request = self.imaging_service.create_type('Move')
+        focus_request.VideoSourceToken = self.video_source_token
+        focus_request.Focus = {'Continuous': {'Speed': -0.1}}
+        self.imaging_service.Move(focus_request)
 
-class BouncyZoomMotorController(MotorController):
+    def focus_stop(self):
+        self.imaging_service.Stop(self.video_source_token)
 
-    def __init__(self,
-                 pid_gains,
-                 orientation,
-                 example_frame):
+    @property
+    def command_tolerance(self):
+        """See PtzCam.__init__
 
-        super().__init__(pid_gains,
-                         orientation,
-                         example_frame)
+        """
+        return self._commands.tolerance
 
-        self.zoom_stop_ratio = .7
+    @command_tolerance.setter
+    def command_tolerance(self, tolerance):
+        self._commands.tolerance = tolerance
 
-    def _calc_zoom_command(self, target_lbox, x_err, y_err, zoom_command):
-        """Calculate the zoom command give pan/tilt errors
+    @property
+    def keepalive_interval(self):
+        """See PtzCam.__init__
 
         """
-        if x_err != 0.0 and y_err != 0.0:
-            target_bb_pixels = self.box_width * self.box_height
-
-            # ratio of bb pixels over whole frame pixels is below a
-            # threshold then zoom
-            ratio = target_bb_pixels / self.total_frame_pixels
-            if ratio < .1:
-                zoom_command = 0.01
-            elif ratio > .3:
-                zoom_command = -0.01
-            else:
-                zoom_command = 0.0
-        else:
-            zoom_command = 0.0
+        return self._commands.keepalive_interval
 
-        return zoom_command
+    @keepalive_interval.setter
+    def keepalive_interval(self, interval):
+        self._commands.keepalive_interval = interval
 
+    @property
+    def stop_coalesce_window(self):
+        """Seconds a stop is held back for a move to replace it
 
-class PtzCam():
-    """Class to control PTZ on ONVIF-compliant PTZ IP Camera
+        """
+        return self._commands.stop_coalesce_window
 
-    Allows control of the pan, tilt, and zoom of an ONVIF-compliant IP
-    camera that has PTZ capability.
+    @stop_coalesce_window.setter
+    def stop_coalesce_window(self, window):
+        self._commands.stop_coalesce_window = window
 
-    """
-    def __init__(self,
-                 ip_address=None,
-                 port='80',
-                 user=None,
-                 pword=None):
-        """ PtzCam constructor
+    def claim_command(self, operation, velocity=None):
+        """Do the bookkeeping for a PTZ command about to be sent
+
+        A move replaces any stop being held back for coalescing and,
+        with command_tolerance set, a continuous move (or stop)
+        repeating the last one sent is suppressed.  Otherwise the
+        command is taken for sent.  Only holds a lock for that
+        bookkeeping, never while anything is sent, so it can be
+        called from an event loop.
 
         Parameters
         ----------
-        ip_address : str
-           The IP address of the camera to connect to.
-        port : str
-           ONVIF port on the camera. This is usually 80
-        user : str
-           Valid username of account on the IP camera being connected to.
-        pword : str
-           Password for the account on the IP camera.
-
-        """
+        operation : str
+            'ContinuousMove', 'Stop', or 'AbsoluteMove'.
+        velocity : 3-tuple, optional
+            Pan, tilt, and zoom velocity of a continuous move or
+            (all zero) stop. None for an absolute move.
 
-        mycam = ONVIFCamera(ip_address, port, user, pword)
-        media_service = mycam.create_media_service()
-        self.ptz_service = mycam.create_ptz_service()
-        self.imaging_service = mycam.create_imaging_service()
+        Returns
+        -------
+        operation : str or None
+            What to send: operation, 'Stop' for a zero velocity
+            continuous move replacing a stop held back, or None if
+            nothing should be sent.
 
-        # on hikvision cameras there have been 3 profiles: one for each stream
-        self.media_profile = media_service.GetProfiles()[0]
+        """
+        operation = self._commands.claim(operation, velocity)
+        if operation is not None:
+            # the camera is no longer where the AbsoluteMove template
+            # says (a move of this PtzCam's own resets this once sent)
+            self._abs_move_position_stale = True
 
-        self.video_source = media_service.GetVideoSources()[0]
+        return operation
 
-        self.pan_bounds = [-1.0, 1.0]
-        self.tilt_bounds = [-1.0, 1.0]
-        self.zoom_bounds = [0.0, 1.0]
+    def rollback_command(self, velocity=None):
+        """Undo claim_command's bookkeeping for a command that failed
 
-        vst = {'VideoSourceToken': self.video_source.token}
-        self.imaging_settings = self.imaging_service.GetImagingSettings(vst)
+        So that it isn't taken for sent and a retry suppressed.
 
-        min_iris = self.imaging_settings.Exposure.MinIris,
-        max_iris = self.imaging_settings.Exposure.MaxIris,
-        self.iris_bounds = [min_iris,
-                            max_iris]
+        Parameters
+        ----------
+        velocity : 3-tuple, optional
+            As given to claim_command.
 
-        min_exposure_time = self.imaging_settings.Exposure.MinExposureTime
-        max_exposure_time = self.imaging_settings.Exposure.MaxExposureTime
-        self.exposure_time_bounds = [min_exposure_time,
-                                     max_exposure_time]
+        """
+        self._commands.rollback(velocity)
 
-        # self.moverequest = self.ptz.create_type('ContinuousMove')
-        # self.moverequest.ProfileToken = media_profile.token
-        # # if self.moverequest.Velocity is None:
-        #     # self.moverequest.Velocity = {'PanTilt': {'x': -1, 'y': -1},
-        #     #                              'Zoom': {'x': 0.0}}
+    def _send_request(self, operation, velocity):
+        if operation == 'Stop':
+            if self.fast_transport:
+                self.fast_transport.stop()
+            else:
+                self.ptz_service.Stop(self._stop_request)
+        elif operation == 'ContinuousMove':
+            if self.fast_transport:
+                self.fast_transport.continuous_move(*velocity)
+            else:
+                request_velocity = self._continuous_move_request.Velocity
+                request_velocity['PanTilt']['x'] = velocity[0]
+                request_velocity['PanTilt']['y'] = velocity[1]
+                request_velocity['Zoom']['x'] = velocity[2]
+                self.ptz_service.ContinuousMove(self._continuous_move_request)
+        elif self.fast_transport:
+            position = self._abs_move_position
+            self.fast_transport.absolute_move(position['PanTilt']['x'],
+                                              position['PanTilt']['y'],
+                                              position['Zoom']['x'])
+        else:
+            self.ptz_service.AbsoluteMove(self._absolute_move_request)
 
-        # self.moverequest.Velocity = {'PanTilt': {'x': -1, 'y': 1},
-        #                              'Zoom': {'x': 0.0}}
+    def _send_command(self, operation, velocity=None):
+        """Claim and send a PTZ command, returning whether it was sent
 
-    def __del__(self):
-        log.info('PtzCam object deletion.')
+        An AbsoluteMove is sent as its template is filled in.
 
-    def get_exposure(self):
-        vst = {'VideoSourceToken': self.video_source.token}
-        self.imaging_settings = self.imaging_service.GetImagingSettings(vst)
+        """
+        with self._command_lock:
+            operation = self.claim_command(operation, velocity)
+            if operation is None:
+                return False
 
-        exp_time = self.imaging_settings.Exposure.ExposureTime
-        gain = self.imaging_settings.Exposure.Gain
-        iris = self.imaging_settings.Exposure.Iris
+            try:
+                self._send_request(operation, velocity)
+            except Exception:
+                self.rollback_command(velocity)
+                raise
 
-        return exp_time, gain, iris
+        return True
 
-    def _send_imaging_settings(self):
-        command_dict = {'VideoSourceToken': self.video_source.token,
-                        'ImagingSettings': self.imaging_settings}
-        self.imaging_service.SetImagingSettings(command_dict)
+    def _send_continuous_move(self, x_velocity, y_velocity, zoom_command):
+        self._send_command('ContinuousMove',
+                           (x_velocity, y_velocity, zoom_command))
 
-    def set_exposure_to_auto(self):
-        self.imaging_settings.Exposure['Mode'] = 'AUTO'
-        self._send_imaging_settings()
+    def move(self, x_velocity, y_velocity):
+        self._send_continuous_move(x_velocity, y_velocity, 0.0)
 
-    def set_focus_to_auto(self):
-        self.imaging_settings.Focus['AutoFocusMode'] = 'AUTO'
-        self._send_imaging_settings()
+    def move_w_zoom(self, x_velocity, y_velocity, zoom_command):
+        x_velocity = float(_check_zeroness(x_velocity))
+        y_velocity = float(_check_zeroness(y_velocity))
+        zoom_command = _check_zeroness(zoom_command)
 
-    def set_focus_to_manual(self):
-        self.imaging_settings.Focus['AutoFocusMode'] = 'MANUAL'
-        self._send_imaging_settings()
+        self._send_continuous_move(x_velocity, y_velocity, zoom_command)
 
-    def set_exposure_time(self, exposure_time):
-        # need to implement bound checking using bounds gotten in constructor
-        self.imaging_settings.Exposure['Mode'] = 'MANUAL'
-        self.imaging_settings.Exposure['ExposureTime'] = exposure_time
-        self._send_imaging_settings()
+    def _refresh_abs_move_position(self):
+        """Fill the AbsoluteMove template with the current position
 
-    def set_iris(self, iris):
-        # need to implement bound checking using bounds gotten in constructor
-        self.imaging_settings.Exposure['Mode'] = 'MANUAL'
-        self.imaging_settings.Exposure['Iris'] = iris
-        self._send_imaging_settings()
+        """
+        pan, tilt, zoom = self.get_position()
+        position = self._abs_move_position
+        position['PanTilt']['x'] = pan
+        position['PanTilt']['y'] = tilt
+        position['Zoom']['x'] = zoom
+        self._abs_move_position_stale = False
 
-    def set_gain(self, gain):
-        # need to implement bound checking using bounds
-        self.imaging_settings.Exposure['Mode'] = 'MANUAL'
-        self.imaging_settings.Exposure['Gain'] = gain
-        self._send_imaging_settings()
+    def _send_absolute_move(self, pan_pos=None, tilt_pos=None, zoom_pos=None):
+        """Send an AbsoluteMove using the cached request
 
-    def focus_out(self):
-        focus_request = self.imaging_service.create_type('Move')
-        focus_request.VideoSourceToken = self.video_source.token
-        focus_request.Focus = {'Continuous': {'Speed': 0.1}}
-        self.imaging_service.Move(focus_request)
+        Axes left as None stay where they are.  Unless every axis is
+        given, the template's position is first refreshed from the
+        camera if a continuous move may have taken the camera away
+        from the last commanded position.
 
-    def focus_in(self):
-        focus_request = self.imaging_service.create_type('Move')
-        focus_request.VideoSourceToken = self.video_source.token
-        focus_request.Focus = {'Continuous': {'Speed': -0.1}}
-        self.imaging_service.Move(focus_request)
+        """
+        full_move = None not in (pan_pos, tilt_pos, zoom_pos)
 
-    def focus_stop(self):
-        self.imaging_service.Stop(self.video_source.token)
+        with self._command_lock:
+            if self._abs_move_position_stale and not full_move:
+                self._refresh_abs_move_position()
 
-    def move(self, x_velocity, y_velocity):
-        move_request = self.ptz_service.create_type('ContinuousMove')
-        move_request.ProfileToken = self.media_profile.token
-        move_request.Velocity = {'PanTilt': {'x': x_velocity, 'y': y_velocity},
-                                 'Zoom': {'x': 0.0}}
-        self.ptz_service.ContinuousMove(move_request)
+            position = self._abs_move_position
+            if pan_pos is not None:
+                position['PanTilt']['x'] = pan_pos
+            if tilt_pos is not None:
+                position['PanTilt']['y'] = tilt_pos
+            if zoom_pos is not None:
+                position['Zoom']['x'] = zoom_pos
 
-    def move_w_zoom(self, x_velocity, y_velocity, zoom_command):
-        x_velocity = float(_check_zeroness(x_velocity))
-        y_velocity = float(_check_zeroness(y_velocity))
-        zoom_command = _check_zeroness(zoom_command)
+            # the absolute move overrides any stop still waiting to go
+            self._send_command('AbsoluteMove')
+            self._abs_move_position_stale = False
 
-        move_request = self.ptz_service.create_type('ContinuousMove')
-        move_request.ProfileToken = self.media_profile.token
-        move_request.Velocity = {'PanTilt': {'x': x_velocity, 'y': y_velocity},
-                                 'Zoom': {'x': zoom_command}}
-        self.ptz_service.ContinuousMove(move_request)
+    def get_position(self, max_age=None):
+        """Get pan, tilt, and zoom
 
-    def _prep_abs_move(self):
-        """Prep move request
+        With the status poller running this answers from its cache
+        (see get_status for max_age) rather than blocking on a
+        GetStatus round trip.
 
         """
-        mov_req = self.ptz_service.create_type('AbsoluteMove')
-        mov_req.ProfileToken = self.media_profile.token
-        if mov_req.Position is None:
-            t_dict = {'ProfileToken': self.media_profile.token}
-            mov_req.Position = self.ptz_service.GetStatus(t_dict).Position
-            mov_req.Speed = self.media_profile.PTZConfiguration.DefaultPTZSpeed
-
-        return mov_req
-
-    def get_position(self):
-        move_request = self.ptz_service.create_type('AbsoluteMove')
-        move_request.ProfileToken = self.media_profile.token
-        token_dict = {'ProfileToken': self.media_profile.token}
-        position = self.ptz_service.GetStatus(token_dict).Position
+        status = self.get_status(max_age)
 
         # x = pan, y = tilt
-        return (position['PanTilt']['x'],
-                position['PanTilt']['y'],
-                position['Zoom']['x'])
+        return status.pan, status.tilt, status.zoom
 
     def absmove(self, x_pos, y_pos):
-        move_request = self._prep_abs_move()
-        move_request.Position.PanTilt.x = x_pos
-        move_request.Position.PanTilt.y = y_pos
-        self.ptz_service.AbsoluteMove(move_request)
+        self._send_absolute_move(pan_pos=x_pos, tilt_pos=y_pos)
 
     def twitch(self):
         pan, tilt, zoom = self.get_position()
@@ -536,51 +673,142 @@ class PtzCam():
         pan_pos = _check_zeroness(pan_pos)
         tilt_pos = _check_zeroness(tilt_pos)
 
-        move_request = self._prep_abs_move()
-        move_request.Position.PanTilt.x = pan_pos
-        move_request.Position.PanTilt.y = tilt_pos
-        move_request.Position.Zoom.x = zoom_pos
-        self.ptz_service.AbsoluteMove(move_request)
+        self._send_absolute_move(pan_pos, tilt_pos, zoom_pos)
+
+    def _wait_for_done(self,
+                       pan_goal,
+                       tilt_goal,
+                       zoom_goal,
+                       close_enough=.01,
+                       timeout=None):
+        """Wait for an absolute move to finish
 
-    def _wait_for_done(self, pan_goal, tilt_goal, zoom_goal, close_enough=.01):
-        """Note: zoom_goal finishing not implemented
+        The move is done when every axis is within close_enough of its
+        goal or when the camera's MoveStatus goes back to IDLE after
+        having reported MOVING (e.g. the goal was past an axis limit).
+        Rather than polling at a fixed rate, the time to the next poll
+        is estimated from the remaining distance and the speed seen so
+        far.
+
+        Returns
+        -------
+        bool
+            False if timeout (seconds) expired before the move was done.
 
         """
-        pan, tilt, zoom = self.get_position()
-        while (pan >= pan_goal + close_enough
-               or pan <= pan_goal - close_enough
-               or tilt >= tilt_goal + close_enough
-               or tilt <= tilt_goal - close_enough
-               or zoom >= zoom_goal + close_enough
-               or zoom <= zoom_goal - close_enough):
-            time.sleep(.1)
-            pan, tilt, zoom = self.get_position()
-
-    def absmove_w_zoom_waitfordone(self,
+        goal = (pan_goal, tilt_goal, zoom_goal)
+        start = time.monotonic()
+        seen_moving = False
+        speed = None
+        last_distance = None
+        last_time = None
+
+        while True:
+            status = self.get_status(max_age=self.min_done_poll_interval)
+            distance = max(abs(status.pan - goal[0]),
+                           abs(status.tilt - goal[1]),
+                           abs(status.zoom - goal[2]))
+            if distance < close_enough:
+                return True
+
+            if status.move_status == 'MOVING':
+                seen_moving = True
+            elif status.move_status == 'IDLE' and seen_moving:
+                log.debug('Camera went idle %.3f from goal.', distance)
+                return True
+
+            now = time.monotonic()
+            if timeout is not None and now - start > timeout:
+                log.warning('Timed out waiting for move to (%.2f, %.2f, '
+                            '%.2f).', *goal)
+                return False
+
+            if last_time is not None and now > last_time:
+                covered = last_distance - distance
+                if covered > 0:
+                    speed = covered / (now - last_time)
+            last_distance = distance
+            last_time = now
+
+            if speed:
+                # check back about halfway through the estimated
+                # remaining time so as not to overshoot by much
+                interval = 0.5 * (distance - close_enough) / speed
+            else:
+                interval = self.max_done_poll_interval
+            interval = min(max(interval, self.min_done_poll_interval),
+                           self.max_done_poll_interval)
+            time.sleep(interval)
+
+    def absmove_w_zoom_waitfordone(self,  # pylint: disable=too-many-arguments
                                    pan_pos,
                                    tilt_pos,
                                    zoom_pos,
-                                   close_enough=.01):
+                                   close_enough=.01,
+                                   timeout=30.0,
+                                   block=True):
+        """Move to an absolute pan, tilt, zoom state and wait until there
+
+        Parameters
+        ----------
+        pan_pos, tilt_pos, zoom_pos : float
+            See absmove_w_zoom.
+        close_enough : float
+            How close each axis must get to its goal.
+        timeout : float
+            Seconds to wait at most (None to wait indefinitely).
+        block : bool
+            If False, return right away with a Future that resolves to
+            the result instead of waiting.
+
+        Returns
+        -------
+        bool or concurrent.futures.Future
+            Whether the move finished before the timeout (or a Future
+            of that if not block).
+
+        """
         self.absmove_w_zoom(pan_pos, tilt_pos, zoom_pos)
-        self._wait_for_done(pan_pos, tilt_pos, zoom_pos, close_enough)
+
+        if block:
+            return self._wait_for_done(pan_pos, tilt_pos, zoom_pos,
+                                       close_enough, timeout)
+
+        if self._move_waiter is None:
+            self._move_waiter = ThreadPoolExecutor(max_workers=1)
+        return self._move_waiter.submit(self._wait_for_done,
+                                        pan_pos, tilt_pos, zoom_pos,
+                                        close_enough, timeout)
 
     def zoom_out_full(self):
-        move_request = self._prep_abs_move()
-        move_request.Position.Zoom.x = 0.0
-        self.ptz_service.AbsoluteMove(move_request)
+        self._send_absolute_move(zoom_pos=0.0)
 
     def zoom_in_full(self):
-        move_request = self._prep_abs_move()
-        move_request.Position.Zoom.x = 1.0
-        self.ptz_service.AbsoluteMove(move_request)
+        self._send_absolute_move(zoom_pos=1.0)
 
     def zoom(self, zoom_command):
         zoom_command = _check_zeroness(zoom_command)
 
-        move_request = self._prep_abs_move()
-        move_request.Position.Zoom.x = zoom_command
-        self.ptz_service.AbsoluteMove(move_request)
+        self._send_absolute_move(zoom_pos=zoom_command)
 
     def stop(self):
-        move_request = self._prep_abs_move()
-        self.ptz_service.Stop({'ProfileToken': move_request.ProfileToken})
+        """Stop all PTZ motion
+
+        With command_tolerance set, a stop while already stopped is
+        suppressed and otherwise the stop is held back briefly
+        (stop_coalesce_window) so that a move sent right after it
+        replaces it rather than following it.
+
+        """
+        if self.command_tolerance is None:
+            self._send_command('Stop', STOP_VELOCITY)
+            return
+
+        self._commands.defer_stop(self.flush)
+
+    def flush(self):
+        """Send any stop still being held back for coalescing
+
+        """
+        if self._commands.take_pending_stop():
+            self._send_command('Stop', STOP_VELOCITY)
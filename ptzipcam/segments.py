@@ -0,0 +1,380 @@
+"""Records encoded images into segment files instead of a file each
+
+A segment is a pair of append-only files: NAME.seg, the encoded images
+(e.g. JPEGs) one after another, and NAME.idx, an index of fixed-size
+records, one per image, of where the image is in NAME.seg along with
+when it was recorded, the PTZ state, and the detection.  Since the
+records are all the same size, image i's is at a known offset, so a
+SegmentReader, which memory-maps both files, gets to any image
+without reading the others.
+
+A SegmentWriter starts a new segment once the current one reaches
+segment_bytes or segment_seconds, so a long recording is a few large
+files rather than hundreds of thousands of small ones.
+
+Images are referred to as 'NAME.seg:i' (see image_reference), e.g. in
+the IMAGE_FILE column of ImageStreamRecorder's CSV file, and
+RecordedImages reads images by such references (or plain image
+filenames).
+
+"""
+import logging
+import mmap
+import os
+import threading
+import time
+
+from datetime import datetime
+import cv2
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+MAGIC = 0x5054_5a53  # 'PTZS'
+VERSION = 1
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+HEADER_DTYPE = np.dtype([('magic', '<u4'),
+                         ('version', '<u4'),
+                         ('record_size', '<u4'),
+                         ('reserved', '<u4')])
+
+INDEX_DTYPE = np.dtype([('offset', '<u8'),
+                        ('size', '<u4'),
+                        ('timestamp', '<f8'),
+                        ('pan', '<f8'),
+                        ('tilt', '<f8'),
+                        ('zoom', '<f8'),
+                        ('class', 'S32'),
+                        ('score', '<f4'),
+                        ('x', '<i4'),
+                        ('y', '<i4'),
+                        ('w', '<i4'),
+                        ('h', '<i4')])
+
+SEGMENT_BYTES = 256 * 2**20
+SEGMENT_SECONDS = 3600.0
+
+# segments are named for when they were started, as ptzipcam.io names
+# images (with milliseconds)
+NAME_FORMAT = '%Y-%m-%dT%H-%M-%S_%f'
+
+
+def image_reference(segment_filename, index):
+    """Reference to image index of a segment, e.g. 'NAME.seg:12'
+
+    """
+    return f'{os.path.basename(segment_filename)}:{index}'
+
+
+def parse_image_reference(reference):
+    """Segment filename and index of an image reference
+
+    Returns (None, None) for anything else, e.g. a JPEG filename.
+
+    """
+    name, _, index = reference.rpartition(':')
+    if not name.endswith(SEGMENT_SUFFIX) or not index.isdigit():
+        return None, None
+    return name, int(index)
+
+
+def list_segments(path):
+    """Filenames of the segments in folder path, oldest first
+
+    """
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.endswith(SEGMENT_SUFFIX))
+
+
+class SegmentWriter():  # pylint: disable=too-many-instance-attributes
+    """Appends encoded images and their metadata to segments
+
+    Parameters
+    ----------
+    path : str
+        Folder to write the segments into.
+    segment_bytes : int
+        Start a new segment before one would grow past this size.
+    segment_seconds : float
+        Start a new segment once one is this old.
+
+    Attributes
+    ----------
+    segment_filename : str
+        Filename of the segment being written (None before the
+        first image).
+
+    """
+
+    def __init__(self,
+                 path,
+                 segment_bytes=SEGMENT_BYTES,
+                 segment_seconds=SEGMENT_SECONDS):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.segment_filename = None
+
+        self._lock = threading.Lock()
+        self._data_file = None
+        self._index_file = None
+        self._offset = 0
+        self._count = 0
+        self._started = None
+
+    def _open_segment(self):
+        """Start a new segment, named for the time now
+
+        """
+        basename = os.path.join(self.path,
+                                datetime.now().strftime(NAME_FORMAT)[:-3])
+        while os.path.exists(basename + SEGMENT_SUFFIX):
+            basename += '_'
+        self.segment_filename = basename + SEGMENT_SUFFIX
+        # pylint: disable=consider-using-with
+        self._data_file = open(self.segment_filename, 'wb')
+        self._index_file = open(basename + INDEX_SUFFIX, 'wb')
+        header = np.zeros((), HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['record_size'] = INDEX_DTYPE.itemsize
+        self._index_file.write(header.tobytes())
+        self._offset = 0
+        self._count = 0
+        self._started = time.monotonic()
+        log.info('Recording into segment %s', self.segment_filename)
+
+    def _close_segment(self):
+        if self._data_file is None:
+            return
+        self._data_file.close()
+        self._index_file.close()
+        self._data_file = self._index_file = None
+
+    def _is_full(self, size):
+        """Whether an image of size would go in a new segment
+
+        """
+        if not self._count:
+            return False
+        return (self._offset + size > self.segment_bytes
+                or time.monotonic() - self._started >= self.segment_seconds)
+
+    def write(self,  # pylint: disable=too-many-arguments
+              encoded,
+              timestamp,
+              ptz_state,
+              detected_class,
+              target_lbox):
+        """Append an encoded image and its metadata
+
+        Parameters
+        ----------
+        encoded : bytes-like
+            The encoded image.
+        timestamp : float
+            time.time() the image was recorded at.
+        ptz_state, detected_class, target_lbox
+            As for ImageStreamRecorder.record_image.
+
+        Returns
+        -------
+        str
+            Reference to the image (see image_reference).
+
+        """
+        record = np.zeros((), INDEX_DTYPE)
+        record['size'] = len(encoded)
+        record['timestamp'] = timestamp
+        record['pan'], record['tilt'], record['zoom'] = ptz_state
+        record['class'] = str(detected_class).encode()[:32]
+        if target_lbox:
+            record['score'] = 100 * target_lbox['confidence']
+            (record['x'], record['y'],
+             record['w'], record['h']) = target_lbox['box']
+
+        with self._lock:
+            if self._data_file is None or self._is_full(len(encoded)):
+                self._close_segment()
+                self._open_segment()
+
+            record['offset'] = self._offset
+            # the image goes in before the record pointing at it
+            self._data_file.write(encoded)
+            self._index_file.write(record.tobytes())
+            reference = image_reference(self.segment_filename, self._count)
+            self._offset += len(encoded)
+            self._count += 1
+        return reference
+
+    def flush(self):
+        """Write out what is buffered, images before their records
+
+        """
+        with self._lock:
+            if self._data_file is not None:
+                self._data_file.flush()
+                self._index_file.flush()
+
+    def close(self):
+        """Close the segment being written
+
+        """
+        with self._lock:
+            self._close_segment()
+
+
+class SegmentReader():
+    """Reads the images of a segment by memory-mapping it
+
+    Only images whose record and data were both written when the
+    segment was opened are read, so a segment still being written (or
+    cut short) can be read up to there.
+
+    Parameters
+    ----------
+    filename : str
+        The segment's .seg (or .idx) file.
+
+    Attributes
+    ----------
+    index : numpy.ndarray
+        The records of the segment's images (of INDEX_DTYPE), mapped
+        onto the index file; e.g. index['timestamp'] is when each was
+        recorded.
+
+    """
+
+    def __init__(self, filename):
+        basename = os.path.splitext(filename)[0]
+        self.segment_filename = basename + SEGMENT_SUFFIX
+
+        with open(basename + INDEX_SUFFIX, 'rb') as index_file:
+            header = np.frombuffer(index_file.read(HEADER_DTYPE.itemsize),
+                                   HEADER_DTYPE)
+        if (len(header) != 1 or header['magic'][0] != MAGIC
+           or header['record_size'][0] != INDEX_DTYPE.itemsize):
+            raise ValueError(f'{basename + INDEX_SUFFIX} is not a segment '
+                             'index.')
+
+        num_records = ((os.path.getsize(basename + INDEX_SUFFIX)
+                        - HEADER_DTYPE.itemsize) // INDEX_DTYPE.itemsize)
+        if num_records > 0:
+            self.index = np.memmap(basename + INDEX_SUFFIX,
+                                   INDEX_DTYPE,
+                                   mode='r',
+                                   offset=HEADER_DTYPE.itemsize,
+                                   shape=(num_records,))
+        else:
+            self.index = np.zeros(0, INDEX_DTYPE)
+
+        # pylint: disable=consider-using-with
+        self._data_file = open(self.segment_filename, 'rb')
+        data_size = os.fstat(self._data_file.fileno()).st_size
+        self._data = None
+        if data_size:
+            self._data = mmap.mmap(self._data_file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        # drop records of images not (completely) written
+        ends = self.index['offset'] + self.index['size']
+        self.index = self.index[:np.count_nonzero(ends <= data_size)]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_encoded(self, i):
+        """Encoded image i, as a memoryview onto the segment
+
+        """
+        record = self.index[i]
+        offset = int(record['offset'])
+        return memoryview(self._data)[offset:offset + int(record['size'])]
+
+    def get_image(self, i):
+        """Decoded image i
+
+        """
+        encoded = np.frombuffer(self.get_encoded(i), np.uint8)
+        return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+    def get_record(self, i):
+        """Metadata of image i as a dict (see INDEX_DTYPE)
+
+        """
+        record = self.index[i]
+        metadata = {name: record[name].item()
+                    for name in INDEX_DTYPE.names}
+        metadata['class'] = metadata['class'].decode(errors='replace')
+        return metadata
+
+    def close(self):
+        """Unmap the segment
+
+        """
+        self.index = np.zeros(0, INDEX_DTYPE)
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._data_file.close()
+
+
+class RecordedImages():
+    """Reads recorded images by filename or segment reference
+
+    For players of ImageStreamRecorder's recordings, whose IMAGE_FILE
+    column has either JPEG filenames or references into segments.
+
+    Parameters
+    ----------
+    path : str
+        Folder the images or segments are in.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._readers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, image_file):
+        """Read the image image_file refers to
+
+        Returns None if it can't be read.
+
+        """
+        segment_name, index = parse_image_reference(image_file)
+        if segment_name is None:
+            return cv2.imread(os.path.join(self.path, image_file))
+
+        reader = self._readers.get(segment_name)
+        if reader is None or index >= len(reader):
+            if reader is not None:
+                # reopened to pick up images written since
+                reader.close()
+            reader = SegmentReader(os.path.join(self.path, segment_name))
+            self._readers[segment_name] = reader
+        if index >= len(reader):
+            return None
+        return reader.get_image(index)
+
+    def close(self):
+        """Close the segments opened
+
+        """
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = {}
@@ -0,0 +1,58 @@
+"""One PtzCam per camera, shared across a process
+
+Every PtzCam connects to its camera on its own, so separate parts of a
+program controlling the same camera (e.g. a tracking loop and a
+timelapse) would each pay for discovery, keep their own connections,
+and poll the status separately.  get_shared_ptz_cam hands them all the
+same PtzCam instead.
+
+"""
+import logging
+import threading
+
+from ptzipcam.ptz_camera import PtzCam
+
+log = logging.getLogger(__name__)
+
+_shared_ptz_cams = {}
+_shared_ptz_cam_locks = {}
+_shared_ptz_cams_lock = threading.Lock()
+
+
+def get_shared_ptz_cam(ip_address, port='80', user=None, pword=None,
+                       **kwargs):
+    """Get the process-wide PtzCam for a camera, connecting if need be
+
+    Every caller asking for the same (ip_address, port, user) gets the
+    same PtzCam, so the camera is only connected to once per process
+    and its services, keep-alive connection, and status cache are
+    shared rather than duplicated.
+
+    Parameters
+    ----------
+    ip_address, port, user, pword
+        See PtzCam.
+    **kwargs
+        Passed on to PtzCam when it is first created and ignored
+        after that.
+
+    Returns
+    -------
+    ptz_cam : PtzCam
+
+    """
+    key = (ip_address, str(port), user)
+    with _shared_ptz_cams_lock:
+        key_lock = _shared_ptz_cam_locks.setdefault(key, threading.Lock())
+
+    # connecting is slow, so only hold up callers after the same camera
+    with key_lock:
+        ptz_cam = _shared_ptz_cams.get(key)
+        if ptz_cam is None:
+            ptz_cam = PtzCam(ip_address, port, user, pword, **kwargs)
+            _shared_ptz_cams[key] = ptz_cam
+        elif kwargs:
+            log.debug('Reusing PtzCam for %s:%s; ignoring %s.',
+                      ip_address, port, ', '.join(kwargs))
+
+    return ptz_cam
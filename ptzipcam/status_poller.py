@@ -0,0 +1,139 @@
+"""Background polling of a PTZ camera's status
+
+A GetStatus round trip takes long enough that a control loop asking
+for the position every frame spends much of its time waiting on the
+camera.  StatusPoller asks from a thread of its own instead and keeps
+the last answer for PtzCam (and anything sharing it, e.g. AsyncPtzCam)
+to read.
+
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+PtzStatus = namedtuple('PtzStatus',
+                       ['pan', 'tilt', 'zoom', 'move_status', 'timestamp'])
+PtzStatus.__doc__ = """PTZ state as of timestamp (from time.monotonic)
+
+move_status is 'IDLE', 'MOVING', or 'UNKNOWN'.
+
+"""
+
+
+def summarize_move_status(move_status):
+    """Collapse an ONVIF MoveStatus into a single string
+
+    'MOVING' if either pan/tilt or zoom is moving, 'IDLE' if both are
+    idle, and 'UNKNOWN' otherwise (plenty of cameras leave MoveStatus
+    out or only fill in one axis).
+
+    """
+    if move_status is None:
+        return 'UNKNOWN'
+
+    values = [move_status.PanTilt, move_status.Zoom]
+    if 'MOVING' in values:
+        return 'MOVING'
+    if all(value == 'IDLE' for value in values):
+        return 'IDLE'
+
+    return 'UNKNOWN'
+
+
+class StatusPoller():
+    """Keeps the latest PtzStatus, refreshed by a thread while running
+
+    Parameters
+    ----------
+    fetch : callable
+        Asks the camera for its status, returning a PtzStatus.
+
+    """
+
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._status = None
+        self._status_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self, rate):
+        """Start refreshing the status in the background
+
+        Parameters
+        ----------
+        rate : float
+            Status requests per second.
+
+        """
+        if self._thread is not None:
+            self.stop()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll,
+                                        args=(1.0/rate,))
+        self._thread.daemon = True
+        self._thread.start()
+        log.info('Polling PTZ status %.1f times a second.', rate)
+
+    def stop(self):
+        """Stop the polling thread if it is running
+
+        """
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _poll(self, period):
+        """Thread function refreshing the status
+
+        """
+        while not self._stop.is_set():
+            try:
+                self.update(self._fetch())
+            except Exception as err:  # pylint: disable=broad-except
+                log.warning('Status poll failed: %s', err)
+            self._stop.wait(period)
+
+    def update(self, status):
+        """Keep status as the latest
+
+        """
+        with self._status_lock:
+            self._status = status
+
+    def cached(self, max_age=None):
+        """Get the latest status if polling and it is fresh enough
+
+        Parameters
+        ----------
+        max_age : float, optional
+            Oldest (in seconds) the status may be. If None, any age
+            will do.
+
+        Returns
+        -------
+        status : PtzStatus or None
+            None if not polling, nothing has been heard from the
+            camera yet, or the last was longer than max_age ago.
+
+        """
+        if self._thread is None:
+            return None
+
+        with self._status_lock:
+            status = self._status
+
+        if status is None:
+            return None
+        age = time.monotonic() - status.timestamp
+        if max_age is not None and age > max_age:
+            return None
+
+        return status
@@ -0,0 +1,137 @@
+"""Health of a camera stream, and when to reopen it
+
+RTSP streams stall without failing: the camera reboots, Wi-Fi drops
+out for a while, or the connection is silently dropped by something
+in between, and reads then time out forever.  StreamHealth keeps
+track of when frames last came in so that Camera can tell a stall
+from a slow frame, reopen the stream with backoff, and report how the
+stream is doing (see Camera.get_health).
+
+"""
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# seconds without a frame before a stream is reopened
+STALL_TIMEOUT = 5.0
+# seconds to wait before reopening a stream, doubling with each attempt
+# that brings no frames, up to MAX_RECONNECT_DELAY
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+
+
+class StreamHealth():  # pylint: disable=too-many-instance-attributes
+    """State of a stream and the backoff for reopening it
+
+    Only the capture thread updates it; anyone may call report().
+
+    Parameters
+    ----------
+    stall_timeout : float
+        Seconds without a frame before the stream is considered
+        stalled.
+
+    Attributes
+    ----------
+    state : str
+        'connecting', 'connected', 'reconnecting', or 'stopped'.
+    reconnects : int
+        Number of times the stream was reopened.
+
+    """
+
+    def __init__(self, stall_timeout=STALL_TIMEOUT):
+        self.stall_timeout = stall_timeout
+        self.state = 'connecting'
+        self.reconnects = 0
+        self._opened_time = time.monotonic()
+        self._last_frame_time = None
+        self._time_to_first_frame = None
+        self._last_alive = self._opened_time
+        self._delay = RECONNECT_DELAY
+
+    def opening(self):
+        """Note that the stream is being (re)opened
+
+        """
+        self._opened_time = time.monotonic()
+
+    def opened(self):
+        """Note that (re)opening the stream is done, whether it worked
+
+        Reopening only counts as a reconnect (and makes the next
+        attempt wait longer) once the wait for it is over (see
+        reconnecting).
+
+        """
+        self._last_alive = time.monotonic()
+        if self.state == 'reconnecting':
+            self.reconnects += 1
+            self._delay = min(2 * self._delay, MAX_RECONNECT_DELAY)
+
+    def frame_arrived(self, now):
+        """Note that frames are coming in (again)
+
+        """
+        self._last_frame_time = now
+        self._last_alive = now
+        self._delay = RECONNECT_DELAY
+        if self.state != 'connected':
+            self.state = 'connected'
+            self._time_to_first_frame = now - self._opened_time
+            log.info('Stream connected; first frame after %.2f s.',
+                     self._time_to_first_frame)
+
+    def stalled(self, now):
+        """Whether there have been no frames for stall_timeout
+
+        """
+        return now - self._last_alive >= self.stall_timeout
+
+    def reconnecting(self, now):
+        """Note that the stream is to be reopened
+
+        Returns the seconds to wait before reopening it.
+
+        """
+        self.state = 'reconnecting'
+        log.warning('No frames for %.1f s; reopening stream in %.1f s.',
+                    now - self._last_alive, self._delay)
+        return self._delay
+
+    def stopped(self):
+        """Note that the stream is no longer read
+
+        """
+        self.state = 'stopped'
+
+    def report(self):
+        """Get the health of the stream
+
+        Returns
+        -------
+        dict
+            'state': 'connecting', 'connected', 'stalled' (connected
+            but no frame for stall_timeout), 'reconnecting', or
+            'stopped';
+            'last_frame_age': seconds since the last frame came in
+            (None before the first);
+            'reconnects': number of times the stream was reopened;
+            'time_to_first_frame': seconds from (re)opening the stream
+            to its first frame (None before the first).
+
+        """
+        last_frame_time = self._last_frame_time
+        last_frame_age = None
+        if last_frame_time is not None:
+            last_frame_age = time.monotonic() - last_frame_time
+        state = self.state
+        if (state == 'connected'
+           and (last_frame_age is None
+                or last_frame_age > self.stall_timeout)):
+            state = 'stalled'
+        return {'state': state,
+                'last_frame_age': last_frame_age,
+                'reconnects': self.reconnects,
+                'time_to_first_frame': self._time_to_first_frame}
@@ -12,7 +12,7 @@ mouseY = 250
 zoom_command = None
 
 
-def orient_frame(frame, orientation):
+def orient_frame(frame, orientation, out=None):
     """Rotates the image frame based on orientation string
 
     Helper function to quickly re-orient the image frame from the
@@ -20,6 +20,9 @@ def orient_frame(frame, orientation):
     orientation is usually provided in the user config yaml file as
     the orientation is assumed to be fixed for any given run.
 
+    The result is written into out instead of a new array if out is
+    given and of the right shape, so a loop can reuse one array.
+
     """
     if orientation == 'left':
         frame = np.rot90(frame)
@@ -32,6 +35,9 @@ def orient_frame(frame, orientation):
     # one from drawing on the resultant frame but might also allay
     # other problems that spawn from the same source.  The underlying
     # bug might be in the opencv library.
+    if out is not None and out.shape == frame.shape:
+        np.copyto(out, frame)
+        return out
     return frame.copy()
 
 
@@ -1,9 +1,29 @@
 """Classes for writing outputs to video files
 
+DilationVideoWriter re-encodes decoded frames; PassthroughRecorder
+writes a stream's compressed packets as they come, without decoding or
+re-encoding them.
+
 """
+import logging
+import os
+import threading
+import time
 
 import cv2
 
+from ptzipcam.io import prep_timestamp
+
+try:
+    import av
+except ImportError:
+    av = None
+
+log = logging.getLogger(__name__)
+
+# most packets kept back for starting a recording at the last keyframe
+MAX_KEPT_PACKETS = 1000
+
 
 class DilationVideoWriter():
     """Manages writing of video with built in time dilation
@@ -57,3 +77,248 @@ class DilationVideoWriter():
 
         """
         self.out.release()
+
+
+def _copy_packet(packet, stream, start_dts):
+    """Copy of packet for stream, with timestamps from start_dts
+
+    Muxing a packet takes its data, so kept packets are muxed as
+    copies.
+
+    """
+    copy = av.Packet(bytes(packet))
+    copy.time_base = packet.time_base
+    if packet.pts is not None:
+        copy.pts = packet.pts - start_dts
+    if packet.dts is not None:
+        copy.dts = packet.dts - start_dts
+    copy.duration = packet.duration
+    copy.is_keyframe = packet.is_keyframe
+    copy.stream = stream
+    return copy
+
+
+class PassthroughRecorder():  # pylint: disable=too-many-instance-attributes
+    """Records a stream's compressed packets without re-encoding them
+
+    A packet sink for a Camera with the 'pyav' backend (see
+    Camera.add_packet_sink): the camera's H.264/H.265 packets are
+    remuxed as they are demuxed into MKV or MP4 segments, so recording
+    costs next to no CPU, unlike decoding frames and encoding them
+    again.  Detections and PTZ state go into a CSV file alongside each
+    segment (see annotate).
+
+    A recording can only start at a keyframe, so the packets since the
+    last one are kept: start() begins the segment with them, which
+    also gives up to a keyframe interval of pre-roll.  Segments are
+    split at the first keyframe after segment_seconds, and when the
+    stream is reopened.
+
+    Requires PyAV.
+
+    Parameters
+    ----------
+    path : str
+        Folder to record into.
+    segment_seconds : float
+        Length of each segment.
+    container : str
+        'mkv', or 'mp4' (written fragmented, so a segment cut short,
+        e.g. by a power cut, still plays).
+
+    Attributes
+    ----------
+    recording : bool
+        Whether start() has been called without stop().
+    segment_filename : str
+        Filename of the segment being written, None between segments.
+
+    """
+
+    def __init__(self, path, segment_seconds=600.0, container='mkv'):
+        if av is None:
+            raise ImportError('PassthroughRecorder requires PyAV. '
+                              'Install it with: pip install av')
+
+        self.path = path
+        self.segment_seconds = segment_seconds
+        self.container = container
+        self.recording = False
+        self.segment_filename = None
+
+        self._lock = threading.Lock()
+        self._in_stream = None
+        # (packet, time.monotonic() it came in) since the last keyframe
+        self._kept = []
+        self._output = None
+        self._out_stream = None
+        self._sidecar = None
+        self._start_dts = 0
+        self._start_time = None
+
+    def __call__(self, packet):
+        """Take a packet of the stream (called by the capture)
+
+        """
+        if not packet.size:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if packet.stream is not self._in_stream:
+                # reopened: the new stream's packets don't go with the
+                # old one's
+                self._close_segment()
+                self._kept = []
+                self._in_stream = packet.stream
+
+            if packet.is_keyframe:
+                self._kept = []
+                if (self._output is not None
+                   and now - self._start_time >= self.segment_seconds):
+                    self._close_segment()
+            # only keep packets that can be played from a kept keyframe
+            if packet.is_keyframe or self._kept:
+                if len(self._kept) < MAX_KEPT_PACKETS:
+                    self._kept.append((packet, now))
+                else:
+                    self._kept = []
+
+            if not self.recording:
+                return
+            if self._output is not None:
+                self._mux(packet)
+            elif self._kept:
+                self._open_segment()
+
+    def _open_segment(self):
+        """Start a segment with the packets kept
+
+        """
+        basename = os.path.join(self.path, prep_timestamp())
+        self.segment_filename = basename + '.' + self.container
+        options = {}
+        if self.container == 'mp4':
+            options['movflags'] = 'frag_keyframe+empty_moov'
+        self._output = av.open(self.segment_filename,
+                               mode='w',
+                               options=options)
+        self._out_stream = self._output.add_stream_from_template(
+            self._in_stream)
+
+        first_packet, self._start_time = self._kept[0]
+        self._start_dts = first_packet.dts or first_packet.pts or 0
+        # pylint: disable=consider-using-with
+        self._sidecar = open(basename + '.csv', 'w', encoding='utf-8')
+        self._sidecar.write('TIME,PAN_ANGLE,TILT_ANGLE,ZOOM_POWER,'
+                            'CLASS,SCORE,X,Y,W,H\n')
+
+        log.info('Recording segment %s', self.segment_filename)
+        for packet, _ in self._kept:
+            self._mux(packet)
+
+    def _mux(self, packet):
+        try:
+            self._output.mux(_copy_packet(packet,
+                                          self._out_stream,
+                                          self._start_dts))
+        except av.error.FFmpegError as e:
+            log.warning('Dropped a packet of %s: %s',
+                        self.segment_filename, e)
+
+    def _close_segment(self):
+        if self._output is None:
+            return
+        try:
+            self._output.close()
+        except av.error.FFmpegError as e:
+            log.warning('Closing %s failed: %s', self.segment_filename, e)
+        self._sidecar.close()
+        log.info('Closed segment %s', self.segment_filename)
+        self._output = self._out_stream = self._sidecar = None
+        self.segment_filename = None
+
+    def start(self):
+        """Start recording, from the last keyframe
+
+        If no keyframe has come in yet, the segment starts with the
+        next one.
+
+        """
+        with self._lock:
+            self.recording = True
+            if self._output is None and self._kept:
+                self._open_segment()
+
+    def stop(self):
+        """Stop recording, closing the segment
+
+        """
+        with self._lock:
+            self.recording = False
+            self._close_segment()
+
+    def annotate(self,  # pylint: disable=too-many-arguments
+                 timestamp,
+                 ptz_state,
+                 detected_class,
+                 target_lbox):
+        """Record the PTZ state and detection for a frame
+
+        Written to the segment's CSV file with the frame's time in the
+        segment, in seconds, as ImageStreamRecorder records them for
+        an image.
+
+        Parameters
+        ----------
+        timestamp : float
+            time.monotonic() the frame was captured at (as returned by
+            Camera.wait_for_new_frame).  Its time in the segment is
+            taken from when its packet came in, so it is late by the
+            time taken to decode it.
+        ptz_state, detected_class, target_lbox
+            As for ImageStreamRecorder.record_image.
+
+        Returns
+        -------
+        bool
+            Whether there was a segment to annotate.
+
+        """
+        pan_angle, tilt_angle, zoom = ptz_state
+        if target_lbox:
+            score = 100 * target_lbox['confidence']
+            box_x_coord, box_y_coord, box_width, box_height = \
+                target_lbox['box']
+        else:
+            score = 0
+            box_x_coord = box_y_coord = box_width = box_height = 0
+
+        with self._lock:
+            if self._sidecar is None:
+                return False
+            strg = '{:.3f},{:.2f},{:.2f},{:.2f},{},{:.1f},{},{},{},{}\n'
+            self._sidecar.write(strg.format(timestamp - self._start_time,
+                                            pan_angle,
+                                            tilt_angle,
+                                            zoom,
+                                            detected_class,
+                                            score,
+                                            box_x_coord,
+                                            box_y_coord,
+                                            box_width,
+                                            box_height))
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop recording and drop the packets kept
+
+        """
+        self.stop()
+        with self._lock:
+            self._kept = []
@@ -48,12 +48,21 @@ setuptools.setup(
         'onvif-zeep',
         'camml',
     ],
-    extra_require={
+    extras_require={
         'examples': [
             'pyyaml',
             'imutils',
             'screeninfo',
         ],
+        'async': [
+            'aiohttp',
+        ],
+        'stream': [
+            'av',
+        ],
+        'pyav': [
+            'av',
+        ],
     },
     classifiers=[
         "Programming Language :: Python :: 3",
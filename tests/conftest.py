@@ -0,0 +1,48 @@
+"""Fixtures shared by the tests
+
+"""
+import pytest
+
+from ptzipcam import shared_ptz_cams
+from ptzipcam.fake_camera import FakePtzCamera
+from ptzipcam.ptz_camera import PtzCam
+
+USER = 'admin'
+PWORD = 'pw'
+
+
+@pytest.fixture
+def fake_camera():
+    """A FakePtzCamera serving on a free port"""
+    with FakePtzCamera() as camera:
+        yield camera
+
+
+@pytest.fixture
+def make_ptz_cam(fake_camera):  # pylint: disable=redefined-outer-name
+    """Factory of PtzCams connected to fake_camera
+
+    Status pollers started are stopped afterwards.
+
+    """
+    ptz_cams = []
+
+    def make(**kwargs):
+        ptz_cam = PtzCam(fake_camera.host, fake_camera.port,
+                         USER, PWORD, **kwargs)
+        ptz_cams.append(ptz_cam)
+        return ptz_cam
+
+    yield make
+
+    for ptz_cam in ptz_cams:
+        ptz_cam.stop_status_poller()
+
+
+@pytest.fixture(autouse=True)
+def forget_shared_ptz_cams():
+    """Drop the PtzCams get_shared_ptz_cam made during a test"""
+    yield
+    # pylint: disable=protected-access
+    shared_ptz_cams._shared_ptz_cams.clear()
+    shared_ptz_cams._shared_ptz_cam_locks.clear()
@@ -0,0 +1,114 @@
+"""Round trips through the shared-memory frame bus
+
+"""
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from ptzipcam.frame_bus import FrameBus, FrameBusReader, FrameBusWorker
+
+SHAPE = (12, 16, 3)
+
+READ_IN_OTHER_PROCESS = """
+import sys
+from ptzipcam.frame_bus import FrameBusReader
+reader = FrameBusReader(sys.argv[1])
+frame, seq, _, position = reader.get()
+print(seq, int(frame.sum()), position[0])
+reader.close()
+"""
+
+
+def _frame(value):
+    return np.full(SHAPE, value, dtype=np.uint8)
+
+
+def make_sum():
+    """Function for FrameBusWorker to run on frames"""
+    return lambda frame: int(frame.sum())
+
+
+def make_failing():
+    """make_function that fails as the worker starts"""
+    raise ValueError('no model')
+
+
+def test_write_then_read():
+    """Frames and their metadata come back as written"""
+    with FrameBus(SHAPE, num_slots=3) as bus, \
+            FrameBusReader(bus.name) as reader:
+        assert reader.latest_seq == 0
+        assert reader.get()[0] is None
+
+        seq = bus.write(_frame(7), position=(.1, .2, .3), timestamp=5.0)
+        frame, read_seq, timestamp, position = reader.get()
+        assert read_seq == seq == 1
+        np.testing.assert_array_equal(frame, _frame(7))
+        assert timestamp == 5.0
+        assert position == pytest.approx((.1, .2, .3))
+        assert not frame.flags.writeable
+        del frame
+
+
+def test_overwritten_frames():
+    """Frames are valid until the ring comes back around to them"""
+    with FrameBus(SHAPE, num_slots=3) as bus, \
+            FrameBusReader(bus.name) as reader:
+        for value in range(1, 4):
+            bus.write(_frame(value))
+        assert reader.is_valid(2)
+        assert reader.is_valid(3)
+
+        bus.write(_frame(4))
+        assert not reader.is_valid(1)
+        assert reader.get(1)[0] is None
+        np.testing.assert_array_equal(reader.get(4)[0], _frame(4))
+        assert reader.wait_for_new_frame(4, timeout=.01)[0] is None
+
+
+def test_grayscale():
+    """Two-dimensional frames are given a channel"""
+    with FrameBus(SHAPE[:2], dtype=np.uint16) as bus, \
+            FrameBusReader(bus.name) as reader:
+        bus.write(np.arange(12 * 16, dtype=np.uint16).reshape(SHAPE[:2]))
+        frame = reader.get()[0]
+        assert frame.shape == SHAPE[:2] + (1,)
+        assert frame.dtype == np.uint16
+        assert frame[1, 0, 0] == 16
+        del frame
+
+
+def test_reader_in_independent_process():
+    """Another program reads frames without removing the bus"""
+    with FrameBus(SHAPE) as bus:
+        bus.write(_frame(2), position=(.5, 0.0, 0.0))
+        env = dict(os.environ,
+                   PYTHONPATH=os.pathsep.join(filter(None, sys.path)))
+        result = subprocess.run([sys.executable, '-c',
+                                 READ_IN_OTHER_PROCESS, bus.name],
+                                capture_output=True, check=True,
+                                text=True, env=env)
+        assert result.stdout.split() == ['1',
+                                         str(2 * int(np.prod(SHAPE))),
+                                         '0.5']
+
+        # still there after the reader's process exited
+        with FrameBusReader(bus.name) as reader:
+            assert reader.latest_seq == 1
+
+
+def test_worker():
+    """FrameBusWorker runs a function on frames in another process"""
+    with FrameBusWorker(make_sum, SHAPE) as worker:
+        assert worker(_frame(1), timeout=30) == int(np.prod(SHAPE))
+        assert worker(_frame(3), timeout=30) == 3 * int(np.prod(SHAPE))
+
+
+def test_worker_startup_error():
+    """An error building the function is raised to the submitter"""
+    with FrameBusWorker(make_failing, SHAPE) as worker:
+        with pytest.raises(ValueError):
+            worker(_frame(1), timeout=30)
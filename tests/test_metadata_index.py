@@ -0,0 +1,114 @@
+"""Round trips through the metadata database
+
+"""
+import csv
+from datetime import datetime
+
+import pytest
+
+from ptzipcam import metadata_index, segments
+
+START = datetime(2024, 5, 1, 7).timestamp()
+
+
+def _row(i, pan=0.0, class_name='bird', score=50.0):
+    return (f'image_{i}.jpg', START + i, pan, 0.0, 1.0, class_name,
+            score, 1, 2, 3, 4)
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Filename of a database of a few rows"""
+    filename = str(tmp_path / 'recording.db')
+    writer = metadata_index.MetadataWriter(filename)
+    for i, (pan, class_name, score) in enumerate([(-1.0, 'bird', 90.0),
+                                                  (.99, 'bird', 40.0),
+                                                  (0.0, 'cat', 80.0),
+                                                  (.5, 'bird', 60.0)]):
+        writer.add(_row(i, pan, class_name, score))
+    writer.close()
+    return filename
+
+
+def test_rows_come_back(tmp_path):
+    """Rows added are inserted on flush and read back whole"""
+    filename = str(tmp_path / 'recording.db')
+    writer = metadata_index.MetadataWriter(filename)
+    writer.add(_row(0))
+    with metadata_index.MetadataIndex(filename) as index:
+        assert not index.query()
+        writer.flush()
+        rows = index.query()
+    writer.close()
+
+    assert rows == [dict(zip(metadata_index.COLUMNS, _row(0)))]
+
+
+def test_query(database):  # pylint: disable=redefined-outer-name
+    """Rows are picked out by class, score, and time"""
+    with metadata_index.MetadataIndex(database) as index:
+        assert len(index.query()) == 4
+        assert [row['IMAGE_FILE'] for row in index.query(
+            class_name='bird', min_score=50)] == ['image_0.jpg',
+                                                  'image_3.jpg']
+        assert [row['IMAGE_FILE'] for row in index.query(
+            start=START + 1, end=datetime.fromtimestamp(START + 3))] == [
+                'image_1.jpg', 'image_2.jpg']
+        assert len(index.query(limit=2)) == 2
+
+
+def test_pan_wraps_around(database):  # pylint: disable=redefined-outer-name
+    """With a full circle of pan, 358 degrees is near 2"""
+    with metadata_index.MetadataIndex(database) as index:
+        rows = index.query(pan=2.0, pan_tolerance=6.0)
+        assert [row['IMAGE_FILE'] for row in rows] == ['image_0.jpg',
+                                                       'image_1.jpg']
+        rows = index.query(pan=-2.0, pan_tolerance=6.0)
+        assert len(rows) == 2
+        rows = index.query(pan=270.0, pan_tolerance=1.0)
+        assert [row['IMAGE_FILE'] for row in rows] == ['image_3.jpg']
+
+
+def test_pan_without_wrap(database):  # pylint: disable=redefined-outer-name
+    """Short of a full circle, the ends of pan travel are far apart"""
+    with metadata_index.MetadataIndex(database) as index:
+        rows = index.query(pan=2.0, pan_tolerance=6.0, pan_range=350.0)
+        assert [row['IMAGE_FILE'] for row in rows] == ['image_0.jpg']
+
+
+def test_missing_database(tmp_path):
+    """Querying a database that doesn't exist fails"""
+    with pytest.raises(FileNotFoundError):
+        metadata_index.MetadataIndex(str(tmp_path / 'missing.db'))
+
+
+def test_index_csv(tmp_path):
+    """A database is built from a recording's CSV file"""
+    image_path = tmp_path / 'recording_images'
+    image_path.mkdir()
+    writer = segments.SegmentWriter(str(image_path))
+    reference = writer.write(b'not really an image', START + 10,
+                             (0.0, 0.0, 1.0), 'bird', None)
+    writer.close()
+
+    csv_filename = str(tmp_path / 'recording.csv')
+    columns = [column for column in metadata_index.COLUMNS
+               if column != 'TIMESTAMP']
+    with open(csv_filename, 'w', newline='', encoding='utf-8') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(columns)
+        for image_file in ['2024-05-01T07-00-00_250.jpg',
+                           '2024-05-01T07-00-00_250_001.jpg',
+                           reference]:
+            csv_writer.writerow([image_file, 0.0, 0.0, 1.0, 'bird', 50.0,
+                                 1, 2, 3, 4])
+
+    filename = metadata_index.index_csv(csv_filename)
+    assert filename == str(tmp_path / 'recording.db')
+    with metadata_index.MetadataIndex(filename) as index:
+        rows = index.query(class_name='bird')
+
+    assert [row['TIMESTAMP'] for row in rows] == [
+        pytest.approx(START + .25), pytest.approx(START + .25),
+        pytest.approx(START + 10)]
+    assert rows[2]['IMAGE_FILE'] == reference
@@ -0,0 +1,291 @@
+"""Tests of PtzCam and its helpers against a FakePtzCamera
+
+"""
+import asyncio
+import os
+import time
+
+import pytest
+
+from ptzipcam.async_ptz_camera import AsyncPtzCam, aiohttp
+from ptzipcam.command_queue import PtzCommandQueue
+from ptzipcam.shared_ptz_cams import get_shared_ptz_cam
+from ptzipcam.soap import PtzRequestTemplates
+
+# as make_ptz_cam connects with (the fake camera doesn't check them)
+USER = 'admin'
+PWORD = 'pw'
+
+
+def _wait_until_idle(ptz_cam, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while ptz_cam.get_status().move_status != 'IDLE':
+        assert time.monotonic() < deadline, 'camera never went idle'
+        time.sleep(.02)
+
+
+@pytest.mark.parametrize('fast_transport', [False, True])
+def test_move_and_stop(make_ptz_cam, fast_transport):
+    """Continuous moves and stops reach the camera"""
+    ptz_cam = make_ptz_cam(fast_transport=fast_transport)
+
+    ptz_cam.move(.5, 0.0)
+    time.sleep(.1)
+    status = ptz_cam.get_status()
+    assert status.move_status == 'MOVING'
+    assert status.pan > 0.0
+
+    ptz_cam.stop()
+    _wait_until_idle(ptz_cam)
+
+
+def test_requests_are_prebuilt(make_ptz_cam, monkeypatch):
+    """Commands reuse the requests built when connecting"""
+    ptz_cam = make_ptz_cam()
+    request = ptz_cam._continuous_move_request  # pylint: disable=W0212
+
+    def create_type(name):
+        raise AssertionError(f'{name} request built per command')
+    monkeypatch.setattr(ptz_cam.ptz_service, 'create_type', create_type)
+
+    ptz_cam.move(.2, .1)
+    ptz_cam.move_w_zoom(.3, 0.0, .1)
+    ptz_cam.absmove_w_zoom(.1, .1, .1)
+    ptz_cam.stop()
+
+    assert ptz_cam._continuous_move_request is request  # pylint: disable=W0212
+    assert request.Velocity['PanTilt']['x'] == .3
+
+
+@pytest.mark.parametrize('fast_transport', [False, True])
+def test_absmove_keeps_other_axes(make_ptz_cam, fast_transport):
+    """Axes left out of an absolute move stay where they are"""
+    ptz_cam = make_ptz_cam(fast_transport=fast_transport)
+
+    assert ptz_cam.absmove_w_zoom_waitfordone(0.0, 0.0, .5, timeout=10)
+    ptz_cam.move(.5, 0.0)
+    time.sleep(.1)
+    ptz_cam.stop()
+    _wait_until_idle(ptz_cam)
+
+    ptz_cam.absmove(-.2, .1)
+    time.sleep(.1)
+    _wait_until_idle(ptz_cam)
+
+    pan, tilt, zoom = ptz_cam.get_position()
+    assert pan == pytest.approx(-.2, abs=.01)
+    assert tilt == pytest.approx(.1, abs=.01)
+    assert zoom == pytest.approx(.5, abs=.01)
+
+
+def test_templates_without_user():
+    """Requests go out without a security header when user is None"""
+    templates = PtzRequestTemplates(None, None, 'profile')
+    assert b'Security' not in templates.continuous_move(.1, .2, 0.0)
+    assert b'Security' not in templates.stop()
+
+    templates = PtzRequestTemplates(USER, PWORD, 'profile')
+    assert b'Security' in templates.continuous_move(.1, .2, 0.0)
+
+
+def test_status_poller(make_ptz_cam, fake_camera):
+    """get_status answers from the poller's cache while it runs"""
+    ptz_cam = make_ptz_cam(fast_transport=True, status_poll_rate=50)
+    deadline = time.monotonic() + 5.0
+    while ptz_cam.cached_status() is None:
+        assert time.monotonic() < deadline, 'no status polled'
+        time.sleep(.01)
+
+    assert ptz_cam.cached_status(max_age=-1.0) is None
+
+    ptz_cam.stop_status_poller()
+    assert ptz_cam.cached_status() is None
+
+    fake_camera.reset_counts()
+    ptz_cam.get_position()
+    assert fake_camera.counts == {'GetStatus': 1}
+
+
+def test_duplicate_moves_are_suppressed(make_ptz_cam, fake_camera):
+    """Moves repeating the last one are not sent again"""
+    ptz_cam = make_ptz_cam(fast_transport=True, command_tolerance=.01)
+    fake_camera.reset_counts()
+
+    ptz_cam.move(.5, 0.0)
+    ptz_cam.move(.5, .005)
+    ptz_cam.move(.4, 0.0)
+
+    assert ptz_cam.command_counts['sent'] == 2
+    assert ptz_cam.command_counts['suppressed'] == 1
+    assert fake_camera.counts['ContinuousMove'] == 2
+
+
+def test_keepalive(make_ptz_cam):
+    """An unchanged move is sent again after keepalive_interval"""
+    ptz_cam = make_ptz_cam(fast_transport=True,
+                           command_tolerance=.01,
+                           keepalive_interval=.1)
+
+    ptz_cam.move(.5, 0.0)
+    ptz_cam.move(.5, 0.0)
+    time.sleep(.15)
+    ptz_cam.move(.5, 0.0)
+
+    assert ptz_cam.command_counts['sent'] == 2
+    assert ptz_cam.command_counts['suppressed'] == 1
+
+
+def test_stop_then_move_is_coalesced(make_ptz_cam, fake_camera):
+    """A move right after a stop replaces the stop"""
+    ptz_cam = make_ptz_cam(fast_transport=True, command_tolerance=.01)
+    ptz_cam.stop_coalesce_window = 1.0
+    fake_camera.reset_counts()
+
+    ptz_cam.move(.5, 0.0)
+    ptz_cam.stop()
+    ptz_cam.move(.3, 0.0)
+
+    assert ptz_cam.command_counts['coalesced'] == 1
+    assert 'Stop' not in fake_camera.counts
+
+    ptz_cam.stop()
+    ptz_cam.flush()
+    assert fake_camera.counts['Stop'] == 1
+
+    # already stopped
+    ptz_cam.stop()
+    ptz_cam.flush()
+    assert fake_camera.counts['Stop'] == 1
+
+
+def test_rollback_lets_retry_through(make_ptz_cam):
+    """A command that failed isn't taken for sent"""
+    ptz_cam = make_ptz_cam(command_tolerance=.01)
+    velocity = (.5, 0.0, 0.0)
+
+    assert ptz_cam.claim_command('ContinuousMove', velocity)
+    ptz_cam.rollback_command(velocity)
+
+    assert ptz_cam.command_counts['sent'] == 0
+    assert ptz_cam.claim_command('ContinuousMove', velocity)
+
+
+def test_command_queue(make_ptz_cam, fake_camera):
+    """Queued commands are sent or dropped for newer ones"""
+    fake_camera.latency = .02
+    ptz_cam = make_ptz_cam(fast_transport=True)
+    fake_camera.reset_counts()
+    command_queue = PtzCommandQueue(ptz_cam)
+
+    for i in range(20):
+        command_queue.move(i / 40, 0.0)
+    assert command_queue.wait_until_sent(timeout=5.0)
+    command_queue.close()
+
+    counts = command_queue.counts
+    assert counts['submitted'] == 20
+    assert counts['sent'] + counts['dropped'] == 20
+    assert counts['failed'] == 0
+    assert fake_camera.counts['ContinuousMove'] == counts['sent']
+
+    with pytest.raises(RuntimeError):
+        command_queue.stop()
+
+
+def test_wait_for_done(make_ptz_cam):
+    """Absolute moves can be waited on, blocking or not"""
+    ptz_cam = make_ptz_cam(fast_transport=True)
+
+    assert not ptz_cam.absmove_w_zoom_waitfordone(.8, .5, .5, timeout=0.0)
+    assert ptz_cam.absmove_w_zoom_waitfordone(-.3, .2, .1, timeout=10)
+    pan, tilt, zoom = ptz_cam.get_position()
+    assert pan == pytest.approx(-.3, abs=.01)
+    assert tilt == pytest.approx(.2, abs=.01)
+    assert zoom == pytest.approx(.1, abs=.01)
+
+    future = ptz_cam.absmove_w_zoom_waitfordone(.3, .1, .2, block=False)
+    assert future.result(timeout=10)
+
+
+def test_discovery_cache(make_ptz_cam, fake_camera, tmp_path):
+    """A second connection reuses what the first discovered"""
+    first = make_ptz_cam(discovery_cache=str(tmp_path))
+    assert os.listdir(tmp_path)
+
+    fake_camera.reset_counts()
+    second = make_ptz_cam(discovery_cache=str(tmp_path),
+                          fast_transport=True)
+    assert 'GetProfiles' not in fake_camera.counts
+    assert second.profile_token == first.profile_token
+    assert second.xaddrs == first.xaddrs
+
+    second.move(.2, 0.0)
+    assert fake_camera.counts['ContinuousMove'] == 1
+
+    fake_camera.firmware_version = 'V2.0.0'
+    fake_camera.reset_counts()
+    make_ptz_cam(discovery_cache=str(tmp_path))
+    assert fake_camera.counts['GetProfiles'] == 1
+
+
+def test_shared_ptz_cam(fake_camera):
+    """Everyone asking for the same camera gets the same PtzCam"""
+    ptz_cam = get_shared_ptz_cam(fake_camera.host, fake_camera.port,
+                                 USER, PWORD)
+    assert get_shared_ptz_cam(fake_camera.host, str(fake_camera.port),
+                              USER, PWORD) is ptz_cam
+    assert get_shared_ptz_cam(fake_camera.host, fake_camera.port,
+                              'other', PWORD) is not ptz_cam
+
+
+@pytest.mark.skipif(aiohttp is None, reason='aiohttp is not installed')
+def test_async_ptz_cam(fake_camera):
+    """AsyncPtzCam moves the camera, sharing the PtzCam's bookkeeping"""
+    async def run():
+        async_cam = await AsyncPtzCam.create(fake_camera.host,
+                                             fake_camera.port,
+                                             USER, PWORD)
+        try:
+            assert async_cam.ptz_cam is get_shared_ptz_cam(
+                fake_camera.host, fake_camera.port, USER, PWORD)
+            async_cam.ptz_cam.command_tolerance = .01
+
+            await async_cam.move(.5, 0.0)
+            await async_cam.move(.5, 0.0)
+            await asyncio.sleep(.1)
+            status = await async_cam.get_status()
+            await async_cam.stop()
+        finally:
+            await async_cam.close()
+        return async_cam.ptz_cam.command_counts, status
+
+    counts, status = asyncio.run(run())
+    assert counts['sent'] == 2
+    assert counts['suppressed'] == 1
+    assert status.move_status == 'MOVING'
+    assert fake_camera.counts['ContinuousMove'] == 1
+    assert fake_camera.counts['Stop'] == 1
+
+
+@pytest.mark.skipif(aiohttp is None, reason='aiohttp is not installed')
+def test_async_rollback(make_ptz_cam, fake_camera, monkeypatch):
+    """A move the camera rejects is rolled back and can be retried"""
+    def reject(_):
+        raise KeyError('ContinuousMove')
+
+    ptz_cam = make_ptz_cam(command_tolerance=.01)
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            async_cam = AsyncPtzCam(ptz_cam, USER, PWORD, session)
+            with monkeypatch.context() as patch:
+                patch.setattr(fake_camera, '_ptz_ContinuousMove', reject)
+                with pytest.raises(Exception):
+                    await async_cam.move(.5, 0.0)
+            assert ptz_cam.command_counts['sent'] == 0
+            await async_cam.move(.5, 0.0)
+
+    fake_camera.reset_counts()
+    asyncio.run(run())
+    assert ptz_cam.command_counts['sent'] == 1
+    assert fake_camera.counts['ContinuousMove'] == 2
@@ -0,0 +1,141 @@
+"""Round trips through segment files
+
+"""
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from ptzipcam import segments
+
+LBOX = {'box': (10, 20, 30, 40), 'confidence': .75}
+
+
+def _images(count, shape=(24, 32, 3)):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, shape, dtype=np.uint8)
+            for _ in range(count)]
+
+
+def _encode(image):
+    # lossless, so images come back exactly
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def test_write_then_read(tmp_path):
+    """Images and their records come back as written"""
+    images = _images(5)
+    writer = segments.SegmentWriter(str(tmp_path))
+    references = [writer.write(_encode(image),
+                               1000.0 + i,
+                               (.1 * i, -.2, .5),
+                               'bird',
+                               LBOX)
+                  for i, image in enumerate(images)]
+    writer.close()
+
+    assert len(segments.list_segments(str(tmp_path))) == 1
+    segment_name, index = segments.parse_image_reference(references[3])
+    assert index == 3
+    assert segment_name == os.path.basename(writer.segment_filename)
+
+    with segments.SegmentReader(writer.segment_filename) as reader:
+        assert len(reader) == len(images)
+        for i, image in enumerate(images):
+            np.testing.assert_array_equal(reader.get_image(i), image)
+        record = reader.get_record(2)
+        np.testing.assert_array_equal(reader.index['timestamp'],
+                                      1000.0 + np.arange(5))
+
+    assert record['pan'] == pytest.approx(.2)
+    assert record['tilt'] == pytest.approx(-.2)
+    assert record['zoom'] == pytest.approx(.5)
+    assert record['class'] == 'bird'
+    assert record['score'] == pytest.approx(75.0)
+    assert (record['x'], record['y'], record['w'], record['h']) == LBOX['box']
+
+
+def test_no_detection(tmp_path):
+    """Images recorded without a detection have empty boxes"""
+    writer = segments.SegmentWriter(str(tmp_path))
+    writer.write(_encode(_images(1)[0]), 0.0, (0.0, 0.0, 0.0), '', None)
+    writer.close()
+
+    with segments.SegmentReader(writer.segment_filename) as reader:
+        record = reader.get_record(0)
+    assert record['class'] == ''
+    assert record['score'] == 0.0
+    assert record['w'] == 0
+
+
+def test_new_segment_when_full(tmp_path):
+    """Writing moves on to a new segment past segment_bytes"""
+    images = _images(6)
+    encoded = [_encode(image) for image in images]
+    writer = segments.SegmentWriter(str(tmp_path),
+                                    segment_bytes=2 * len(encoded[0]) + 10)
+    references = [writer.write(data, 0.0, (0.0, 0.0, 0.0), '', None)
+                  for data in encoded]
+    writer.close()
+
+    filenames = segments.list_segments(str(tmp_path))
+    assert len(filenames) == 3
+    with segments.RecordedImages(str(tmp_path)) as recorded:
+        for reference, image in zip(references, images):
+            np.testing.assert_array_equal(recorded.read(reference), image)
+
+
+def test_read_while_writing(tmp_path):
+    """Images written after a segment was opened are picked up"""
+    images = _images(3)
+    writer = segments.SegmentWriter(str(tmp_path))
+    recorded = segments.RecordedImages(str(tmp_path))
+
+    first = writer.write(_encode(images[0]), 0.0, (0.0, 0.0, 0.0), '', None)
+    writer.flush()
+    np.testing.assert_array_equal(recorded.read(first), images[0])
+
+    later = [writer.write(_encode(image), 0.0, (0.0, 0.0, 0.0), '', None)
+             for image in images[1:]]
+    writer.flush()
+    np.testing.assert_array_equal(recorded.read(later[-1]), images[-1])
+
+    writer.close()
+    recorded.close()
+
+
+def test_cut_short(tmp_path):
+    """Records of images not completely written are left out"""
+    encoded = [_encode(image) for image in _images(3)]
+    writer = segments.SegmentWriter(str(tmp_path))
+    for data in encoded:
+        writer.write(data, 0.0, (0.0, 0.0, 0.0), '', None)
+    writer.close()
+
+    with open(writer.segment_filename, 'r+b') as data_file:
+        data_file.truncate(len(encoded[0]) + len(encoded[1]) - 1)
+
+    with segments.SegmentReader(writer.segment_filename) as reader:
+        assert len(reader) == 1
+    with segments.RecordedImages(str(tmp_path)) as recorded:
+        name = os.path.basename(writer.segment_filename)
+        assert recorded.read(segments.image_reference(name, 2)) is None
+
+
+def test_plain_image_files(tmp_path):
+    """RecordedImages reads images not in segments by filename"""
+    image = _images(1)[0]
+    cv2.imwrite(str(tmp_path / 'image.png'), image)
+
+    assert segments.parse_image_reference('image.png') == (None, None)
+    with segments.RecordedImages(str(tmp_path)) as recorded:
+        np.testing.assert_array_equal(recorded.read('image.png'), image)
+
+
+def test_not_a_segment(tmp_path):
+    """Opening something other than a segment fails"""
+    (tmp_path / 'bogus.idx').write_bytes(b'\0' * 64)
+    (tmp_path / 'bogus.seg').write_bytes(b'')
+    with pytest.raises(ValueError):
+        segments.SegmentReader(str(tmp_path / 'bogus.seg'))
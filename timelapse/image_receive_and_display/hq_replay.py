@@ -8,11 +8,19 @@ parser = argparse.ArgumentParser()
 parser.add_argument('-c',
                     '--csv_file',
                     required=True,
-                    help='CSV file containing image names and metadata')
+                    help=('CSV file (or metadata database) containing image '
+                          'names and metadata'))
 parser.add_argument('-b',
                     '--base_path',
                     required=True,
                     help='Base path of image file location')
+parser.add_argument('--class',
+                    dest='class_name',
+                    help='Only show images of this class (needs a database)')
+parser.add_argument('--min_score',
+                    type=float,
+                    help='Only show images scoring at least this (needs a '
+                    'database)')
 args = parser.parse_args()
 
 JUMP_SCREENS = False
@@ -33,7 +41,9 @@ display = GridDisplay("HQ Replay", JUMP_SCREENS, layout)
 pics = io_hq.read_in_pics(args.base_path,
                           args.csv_file,
                           layout,
-                          320)
+                          320,
+                          query={'class_name': args.class_name,
+                                 'min_score': args.min_score})
 
 
 while True:
@@ -1,27 +1,33 @@
-import os
-
-import cv2
 import imutils
 
 import pandas as pd
 
 from viztools.visualization import init_pics
 
+from ptzipcam.metadata_index import DATABASE_SUFFIX, MetadataIndex
+from ptzipcam.segments import RecordedImages
+
 
-def read_in_pics(path, csv_file, layout, image_width):
+def read_in_pics(path, csv_file, layout, image_width, query=None):
     pics = init_pics(layout)
 
-    df = pd.read_csv(csv_file)
+    if csv_file.endswith(DATABASE_SUFFIX):
+        # only the images matching query (MetadataIndex.query's
+        # arguments), e.g. {'class_name': 'bird', 'min_score': 50}
+        with MetadataIndex(csv_file) as metadata_index:
+            df = pd.DataFrame(metadata_index.query(**(query or {})))
+    else:
+        df = pd.read_csv(csv_file)
 
     # df = df.loc[1:1000]
 
-    for index, row in df.iterrows():
-        print('[INFO] Reading image {}'.format(index))
-        full_path = os.path.join(path,
-                                 row['IMAGE_FILE'])
+    # images can be JPEG files or in segments
+    with RecordedImages(path) as images:
+        for index, row in df.iterrows():
+            print('[INFO] Reading image {}'.format(index))
 
-        img = cv2.imread(full_path)
-        img = imutils.resize(img, image_width)
-        pics[index % len(layout)].append(img)
+            img = images.read(row['IMAGE_FILE'])
+            img = imutils.resize(img, image_width)
+            pics[index % len(layout)].append(img)
 
     return pics
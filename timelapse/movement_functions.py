@@ -1,14 +1,16 @@
+import asyncio
 import time
 
 import yaml
 
 import numpy as np
 
-from ptzipcam.ptz_camera import PtzCam
-
 import convert
 import globalvars
 
+from ptzipcam.shared_ptz_cams import get_shared_ptz_cam
+from ptzipcam.async_ptz_camera import AsyncPtzCam
+
 
 def _read_configs(config_file):
     with open(config_file) as f:
@@ -46,7 +48,7 @@ def mow_the_lawn(zoom_power, config_file):
     globalvars.grid = (PAN_STEPS, TILT_STEPS)
     
     # global globalvars.camera_still
-    ptz = PtzCam(IP, ONVIF_PORT, USER, PASS)
+    ptz = get_shared_ptz_cam(IP, ONVIF_PORT, USER, PASS, discovery_cache=True)
     print('[INFO] Connected to camera.') 
     ptz.twitch()
     print('[INFO] Twitching camera so user has some indication things are OK.') 
@@ -125,7 +127,7 @@ def visit_spots(zoom_power, config_file):
         spots = np.array(spots)
     
     # global globalvars.camera_still
-    ptz = PtzCam(IP, ONVIF_PORT, USER, PASS)
+    ptz = get_shared_ptz_cam(IP, ONVIF_PORT, USER, PASS, discovery_cache=True)
 
     while True:
         for num, spot in enumerate(spots):
@@ -152,8 +154,14 @@ def visit_spots_two_cameras(zoom_power):
     """Thread function for moving two cameras through a series of spots of
     interest
 
+    Both cameras are driven from one event loop so they are commanded
+    in parallel rather than one after the other.
+
     """
+    asyncio.run(_visit_spots_two_cameras(zoom_power))
+
 
+async def _visit_spots_two_cameras(zoom_power):
     spots = [[210.0, 90.0, 4.0],
              [288.75, 90.0, 4.0],
              [91.88, 85.0, 4.0],
@@ -163,8 +171,9 @@ def visit_spots_two_cameras(zoom_power):
              # [345.0, 85.0, 3.5]]
     
     # global globalvars.camera_still
-    ptz = PtzCam(IP, ONVIF_PORT, USER, PASS)
-    ptz_2 = PtzCam('192.168.1.63', ONVIF_PORT, USER, PASS)
+    ptz, ptz_2 = await asyncio.gather(
+        AsyncPtzCam.create(IP, ONVIF_PORT, USER, PASS),
+        AsyncPtzCam.create('192.168.1.63', ONVIF_PORT, USER, PASS))
 
     while True:
         for num, spot in enumerate(spots):
@@ -177,13 +186,13 @@ def visit_spots_two_cameras(zoom_power):
             tilt_command = convert.degrees_to_command(tilt_degrees, 90.0)
             zoom_command = zoom_factor/zoom_power
 
-            ptz.absmove_w_zoom(pan_command, tilt_command, zoom_command)
-            ptz_2.absmove_w_zoom(pan_command, tilt_command, zoom_command)
-            time.sleep(2)
+            await asyncio.gather(
+                ptz.absmove_w_zoom(pan_command, tilt_command, zoom_command),
+                ptz_2.absmove_w_zoom(pan_command, tilt_command, zoom_command))
+            await asyncio.sleep(2)
             globalvars.camera_still = True
-            time.sleep(1)
+            await asyncio.sleep(1)
             globalvars.camera_still = False
-            time.sleep(STEP_DUR)
+            await asyncio.sleep(STEP_DUR)
 
-    ptz.stop()
-    ptz_2.stop()
+    await asyncio.gather(ptz.stop(), ptz_2.stop())
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""Throughput benchmark of the capture and processing path
+
+Feeds Camera from a synthetic frame source (directly, or encoded and
+streamed through a local stand-in for a camera's RTSP stream) and
+runs each new frame through the stages the applications do: orient,
+detect, and record.  Reports the sustained frame rate, the share of
+frames the source produced that never made it through, and per-stage
+times and latencies, and the CPU time the process used.  With
+--on_demand, Camera only decodes the frames the loop asks for; add
+--inference_ms to stand in for a detector slower than the stream to
+see what that saves.  With --ring, frames are captured into a ring of
+reused arrays and borrowed rather than copied.  --low_latency opens the
+stream with Camera's low-latency FFmpeg options; capture latency is
+then from the source producing a frame to the loop receiving it (the
+glass-to-frame latency, less the camera's own).  --record_queue records
+asynchronously from a queue of that size (see ImageStreamRecorder).
+
+Detection is a simple threshold-and-contours stand-in that finds the
+synthetic targets, so no model files are needed.
+
+No camera or network is needed.
+
+"""
+import argparse
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from ptzipcam import ui
+from ptzipcam.camera import Camera
+from ptzipcam.frame_sources import (SyntheticSource, StreamStandIn,
+                                    read_frame_index)
+from ptzipcam.io import ImageStreamRecorder
+
+
+def detect_targets(frame):
+    """Find the synthetic targets, returning labeled boxes
+
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    _, mask = cv2.threshold(gray, 120, 255, cv2.THRESH_BINARY)
+    contours, _ = cv2.findContours(mask,
+                                   cv2.RETR_EXTERNAL,
+                                   cv2.CHAIN_APPROX_SIMPLE)
+    lboxes = []
+    for contour in contours:
+        box = cv2.boundingRect(contour)
+        if box[2] * box[3] > 400:
+            lboxes.append({'box': box, 'confidence': 1.0, 'class_id': 0})
+    return lboxes
+
+
+def summarize(name, times):
+    """Format mean and 95th percentile of times (seconds) in ms
+
+    """
+    if not times:
+        return f'{name:<20}{"-":>10}{"-":>10}'
+    times = 1000 * np.array(times)
+    return (f'{name:<20}{times.mean():>10.2f}'
+            f'{np.percentile(times, 95):>10.2f}')
+
+
+def main():  # pylint: disable=R0912, R0914, R0915
+    """Main function of utility
+
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r',
+                        '--resolution',
+                        default='1280x720',
+                        help='Resolution of the synthetic frames.')
+    parser.add_argument('-f',
+                        '--fps',
+                        type=float,
+                        default=25.0,
+                        help='Frame rate of the synthetic source.')
+    parser.add_argument('-d',
+                        '--duration',
+                        type=float,
+                        default=10.0,
+                        help='Seconds to run for.')
+    parser.add_argument('-s',
+                        '--stream',
+                        action='store_true',
+                        help=('Encode the frames and capture them from a '
+                              'local stream (requires PyAV).'))
+    parser.add_argument('--on_demand',
+                        action='store_true',
+                        help='Only decode the frames that are asked for.')
+    parser.add_argument('--low_latency',
+                        action='store_true',
+                        help='Open the stream with low-latency options.')
+    parser.add_argument('--ring',
+                        type=int,
+                        default=0,
+                        help=('Capture into a ring of this many reused frames '
+                              'and borrow them instead of copying.'))
+    parser.add_argument('-i',
+                        '--inference_ms',
+                        type=float,
+                        default=0.0,
+                        help=('Extra milliseconds to spend per frame in the '
+                              'detect stage, standing in for a slower '
+                              'detector.'))
+    parser.add_argument('--no_record',
+                        action='store_true',
+                        help='Skip the recording stage.')
+    parser.add_argument('--record_queue',
+                        type=int,
+                        help=('Record in background threads from a queue '
+                              'of this size.'))
+    parser.add_argument('--record_overflow',
+                        default='drop_oldest',
+                        help=('When the record queue is full: block, '
+                              'drop_oldest, or drop_newest.'))
+    parser.add_argument('-o',
+                        '--orientation',
+                        default='down',
+                        help='Orientation passed to orient_frame.')
+    args = parser.parse_args()
+
+    width, height = (int(n) for n in args.resolution.split('x'))
+    synthetic = SyntheticSource(width, height, args.fps)
+
+    stand_in = None
+    if args.stream:
+        stand_in = StreamStandIn(synthetic)
+        stand_in.start()
+        cam = Camera(source=stand_in.address,
+                     decode_on_demand=args.on_demand,
+                     ring_size=args.ring,
+                     low_latency=args.low_latency)
+    else:
+        cam = Camera(source=synthetic,
+                     decode_on_demand=args.on_demand,
+                     ring_size=args.ring)
+
+    stage_times = {'orient': [], 'detect': [], 'record': []}
+    capture_latencies = []
+    total_latencies = []
+    seen = set()
+    seq = 0
+    oriented = None
+
+    with tempfile.TemporaryDirectory() as record_dir:
+        recorder = None
+        if not args.no_record:
+            recorder = ImageStreamRecorder(record_dir,
+                                           queue_size=args.record_queue,
+                                           overflow=args.record_overflow)
+
+        start = time.monotonic()
+        cpu_start = time.process_time()
+        first_index = None
+        while time.monotonic() - start < args.duration:
+            if args.ring:
+                frame, seq, _ = cam.borrow_frame(seq, timeout=.5)
+            else:
+                frame, seq, _ = cam.wait_for_new_frame(seq, timeout=.5)
+            if frame is None:
+                continue
+            received = time.monotonic()
+            index = read_frame_index(frame)
+            if first_index is None:
+                first_index = index
+            seen.add(index)
+
+            produced = synthetic.produced_at(index)
+            if produced is not None:
+                capture_latencies.append(received - produced)
+
+            tick = time.monotonic()
+            if args.ring:
+                # orient into the same array every time (unless frames
+                # are recorded later, from the queue) and give the
+                # camera its frame straight back
+                if args.record_queue and recorder is not None:
+                    oriented = None
+                oriented = ui.orient_frame(frame, args.orientation, oriented)
+                cam.release_frame(seq)
+                frame = oriented
+            else:
+                frame = ui.orient_frame(frame, args.orientation)
+            tock = time.monotonic()
+            stage_times['orient'].append(tock - tick)
+
+            tick = tock
+            lboxes = detect_targets(frame)
+            if args.inference_ms:
+                time.sleep(args.inference_ms / 1000)
+            tock = time.monotonic()
+            stage_times['detect'].append(tock - tick)
+
+            if recorder is not None:
+                tick = tock
+                recorder.record_image(frame,
+                                      (0.0, 0.0, 0.0),
+                                      'target',
+                                      lboxes[0] if lboxes else None)
+                tock = time.monotonic()
+                stage_times['record'].append(tock - tick)
+
+            if produced is not None:
+                total_latencies.append(tock - produced)
+
+        elapsed = time.monotonic() - start
+        cpu = time.process_time() - cpu_start
+        if recorder is not None:
+            recorder.close()
+        time_to_first_frame = cam.get_health()['time_to_first_frame']
+        produced_count = synthetic.frame_index - (first_index or 0) + 1
+
+    cam.release()
+    if stand_in is not None:
+        stand_in.close()
+
+    processed = len(seen)
+    print(f'{args.resolution} @ {args.fps:.0f} fps '
+          f'{"streamed" if args.stream else "direct"}'
+          f'{", decode on demand" if args.on_demand else ""}'
+          f'{f", ring of {args.ring}" if args.ring else ""}'
+          f'{", low latency" if args.low_latency else ""}, '
+          f'{elapsed:.1f} s')
+    print(f'first frame after {1000 * time_to_first_frame:.0f} ms')
+    print(f'cpu: {100 * cpu / elapsed:.0f}% of a core')
+    print(f'sustained: {processed / elapsed:.1f} fps, '
+          f'{processed} of {produced_count} frames processed '
+          f'({100 * (1 - processed / max(produced_count, 1)):.1f}% dropped)')
+    if recorder is not None and args.record_queue:
+        print(f'recorded: {recorder.counts["written"]} written, '
+              f'{recorder.counts["dropped"]} dropped from the queue')
+    print(f'{"stage (ms)":<20}{"mean":>10}{"p95":>10}')
+    for name, times in stage_times.items():
+        print(summarize(name, times))
+    print(summarize('capture latency', capture_latencies))
+    print(summarize('total latency', total_latencies))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""Benchmark of the capture backends decoding a recorded clip
+
+Decodes the same H.264 clip as fast as possible with OpenCV's
+cv2.VideoCapture and with PyAV (ptzipcam.av_capture.AvCapture) with
+different decoder threading, at the clip's resolution and, with
+--size, converted to a smaller one as a detector would want it
+(cv2.resize after decoding for OpenCV, in the conversion for PyAV).
+Reports frames decoded a second and CPU time per frame and, for PyAV,
+the latency its threading costs: the frames the decoder holds back
+(packets demuxed but not yet out as frames), each of which is a frame
+interval of latency on a live stream.
+
+Without a clip, a synthetic one is recorded first (requires PyAV,
+which the PyAV cases need anyway).
+
+No camera or network is needed.
+
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+
+from ptzipcam.av_capture import LIVE_STREAM_THREADS, AvCapture, av
+from ptzipcam.frame_sources import SyntheticSource
+
+
+def record_clip(filename, width, height, fps, seconds):
+    """Record a synthetic H.264 clip to filename
+
+    """
+    source = SyntheticSource(width, height, fps, realtime=False)
+    with av.open(filename, mode='w') as output:
+        stream = output.add_stream('libx264', rate=int(fps))
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = 'yuv420p'
+        for _ in range(int(fps * seconds)):
+            _, frame = source.read()
+            video_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+            for packet in stream.encode(video_frame):
+                output.mux(packet)
+        for packet in stream.encode():
+            output.mux(packet)
+
+
+def time_decode(cap, size=None, resize=False):
+    """Decode every frame of cap
+
+    With resize, frames are resized to size with cv2.resize.
+
+    Returns
+    -------
+    tuple
+        Frames, seconds, CPU seconds, and, for an AvCapture, the mean
+        number of frames held back in the decoder (None otherwise).
+
+    """
+    demuxed = 0
+
+    def count_packet(_):
+        nonlocal demuxed
+        demuxed += 1
+
+    held_back = None
+    if isinstance(cap, AvCapture):
+        held_back = 0
+        cap.packet_sinks.append(count_packet)
+
+    count = 0
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if resize:
+            frame = cv2.resize(frame, size)
+        count += 1
+        if held_back is not None:
+            # packets demuxed past this frame's
+            held_back += demuxed - count
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    cap.release()
+    if held_back is not None:
+        held_back /= max(count, 1)
+    return count, elapsed, cpu, held_back
+
+
+def main():
+    """Main function of utility
+
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('clip',
+                        nargs='?',
+                        help=('H.264 clip to decode; a synthetic one is '
+                              'recorded if not given.'))
+    parser.add_argument('-r',
+                        '--resolution',
+                        default='1920x1080',
+                        help='Resolution of the synthetic clip.')
+    parser.add_argument('-d',
+                        '--duration',
+                        type=float,
+                        default=10.0,
+                        help='Seconds of synthetic clip.')
+    parser.add_argument('-s',
+                        '--size',
+                        help='Also decode to this size, e.g. 640x360.')
+    args = parser.parse_args()
+
+    if av is None:
+        raise ImportError('This benchmark requires PyAV. '
+                          'Install it with: pip install av')
+
+    with tempfile.TemporaryDirectory() as clip_dir:
+        clip = args.clip
+        if clip is None:
+            clip = os.path.join(clip_dir, 'clip.mp4')
+            width, height = (int(n) for n in args.resolution.split('x'))
+            print(f'Recording {args.duration:.0f} s synthetic clip '
+                  f'at {args.resolution}...')
+            record_clip(clip, width, height, 25, args.duration)
+
+        cases = [
+            ('opencv', lambda: cv2.VideoCapture(clip), {}),
+            ('pyav, 1 thread',
+             lambda: AvCapture(clip, threads=1, thread_type='SLICE'), {}),
+            ('pyav, slice threads',
+             lambda: AvCapture(clip, threads=0, thread_type='SLICE'), {}),
+            (f'pyav, {LIVE_STREAM_THREADS} threads (live default)',
+             lambda: AvCapture(clip, threads=LIVE_STREAM_THREADS), {}),
+            ('pyav, frame threads',
+             lambda: AvCapture(clip, threads=0), {}),
+        ]
+        if args.size:
+            size = tuple(int(n) for n in args.size.split('x'))
+            cases += [
+                (f'opencv + resize to {args.size}',
+                 lambda: cv2.VideoCapture(clip),
+                 {'size': size, 'resize': True}),
+                (f'pyav at {args.size}',
+                 lambda: AvCapture(clip, width=size[0], height=size[1]),
+                 {}),
+            ]
+
+        print(f'{"backend":<34}{"frames":>8}{"fps":>10}'
+              f'{"cpu ms/frame":>14}{"frames held":>13}')
+        for name, open_cap, kwargs in cases:
+            count, elapsed, cpu, held_back = time_decode(open_cap(),
+                                                         **kwargs)
+            held_back = '-' if held_back is None else f'{held_back:.1f}'
+            print(f'{name:<34}{count:>8}{count / elapsed:>10.1f}'
+                  f'{1000 * cpu / max(count, 1):>14.2f}{held_back:>13}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""Benchmark of ImageStreamRecorder's JPEG encoding throughput
+
+Records a burst of synthetic frames (with sensor-like noise, so they
+take about as long to encode as a camera's) as fast as the recorder
+takes them: synchronously, then asynchronously with 1 up to --threads
+writer threads encoding in parallel, and at a lower --burst_quality.
+Reports frames recorded a second, the cores the process kept busy,
+and frames a second per core, along with the size of the JPEGs.
+
+No camera or network is needed.
+
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from ptzipcam.frame_sources import SyntheticSource
+from ptzipcam.io import ImageStreamRecorder
+
+
+def make_frames(width, height, count):
+    """Distinct synthetic frames with noise added
+
+    """
+    source = SyntheticSource(width, height, realtime=False)
+    rng = np.random.default_rng(0)
+    frames = []
+    for _ in range(count):
+        _, frame = source.read()
+        noise = rng.normal(0, 4, frame.shape)
+        frames.append(np.clip(frame + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+def time_burst(frames, num_frames, **recorder_kwargs):
+    """Record num_frames of frames, returning seconds, CPU seconds, and
+    mean JPEG size
+
+    """
+    with tempfile.TemporaryDirectory() as record_dir:
+        recorder = ImageStreamRecorder(record_dir, **recorder_kwargs)
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        for i in range(num_frames):
+            recorder.record_image(frames[i % len(frames)],
+                                  (0.0, 0.0, 0.0),
+                                  'target',
+                                  None,
+                                  burst=True)
+        recorder.close()
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        sizes = [entry.stat().st_size
+                 for entry in os.scandir(recorder.image_path)]
+    return elapsed, cpu, np.mean(sizes)
+
+
+def main():
+    """Main function of utility
+
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r',
+                        '--resolution',
+                        default='1920x1080',
+                        help='Resolution of the frames.')
+    parser.add_argument('-n',
+                        '--frames',
+                        type=int,
+                        default=200,
+                        help='Frames in the burst.')
+    parser.add_argument('-t',
+                        '--threads',
+                        type=int,
+                        default=os.cpu_count(),
+                        help='Most writer threads to try.')
+    parser.add_argument('-q',
+                        '--quality',
+                        type=int,
+                        default=95,
+                        help='JPEG quality.')
+    parser.add_argument('-b',
+                        '--burst_quality',
+                        type=int,
+                        default=75,
+                        help='Lower JPEG quality to try for bursts.')
+    args = parser.parse_args()
+
+    width, height = (int(n) for n in args.resolution.split('x'))
+    frames = make_frames(width, height, 8)
+
+    cases = [('synchronous', {'jpeg_quality': args.quality})]
+    for threads in range(1, args.threads + 1):
+        cases.append((f'{threads} thread(s)',
+                      {'queue_size': 2 * threads,
+                       'writer_threads': threads,
+                       'jpeg_quality': args.quality}))
+    cases.append((f'{args.threads} thread(s), q{args.burst_quality}',
+                  {'queue_size': 2 * args.threads,
+                   'writer_threads': args.threads,
+                   'jpeg_quality': args.quality,
+                   'burst_quality': args.burst_quality}))
+
+    print(f'{args.frames} frames at {args.resolution}, quality '
+          f'{args.quality}, {os.cpu_count()} core(s)')
+    print(f'{"recorder":<24}{"fps":>8}{"cores":>8}{"fps/core":>10}'
+          f'{"KB/frame":>10}')
+    for name, kwargs in cases:
+        elapsed, cpu, size = time_burst(frames, args.frames, **kwargs)
+        print(f'{name:<24}{args.frames / elapsed:>8.1f}'
+              f'{cpu / elapsed:>8.2f}{args.frames / cpu:>10.1f}'
+              f'{size / 1000:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
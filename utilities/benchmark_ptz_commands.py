@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""Micro-benchmark of the per-command cost of PtzCam
+
+Runs PtzCam against a local fake camera (ptzipcam.fake_camera) with a
+simulated network round trip and times the commands the tracking
+loops send every frame.  Each command is timed the way PtzCam used to
+build it (a fresh create_type per call and, for absolute moves and
+stops, a GetStatus round trip), the way it does now (reusing the
+request templates built at construction), and with the fast
+transport.
+
+No camera or network is needed.
+
+"""
+import argparse
+import time
+
+from ptzipcam.fake_camera import FakePtzCamera
+from ptzipcam.ptz_camera import PtzCam
+
+
+def legacy_move_w_zoom(ptz, x_velocity, y_velocity, zoom_command):
+    """move_w_zoom as it was before request templates were cached
+
+    """
+    move_request = ptz.ptz_service.create_type('ContinuousMove')
+    move_request.ProfileToken = ptz.profile_token
+    move_request.Velocity = {'PanTilt': {'x': x_velocity, 'y': y_velocity},
+                             'Zoom': {'x': zoom_command}}
+    ptz.ptz_service.ContinuousMove(move_request)
+
+
+def _legacy_prep_abs_move(ptz):
+    mov_req = ptz.ptz_service.create_type('AbsoluteMove')
+    mov_req.ProfileToken = ptz.profile_token
+    if mov_req.Position is None:
+        t_dict = {'ProfileToken': ptz.profile_token}
+        mov_req.Position = ptz.ptz_service.GetStatus(t_dict).Position
+        mov_req.Speed = ptz.media_profile.PTZConfiguration.DefaultPTZSpeed
+
+    return mov_req
+
+
+def legacy_absmove_w_zoom(ptz, pan_pos, tilt_pos, zoom_pos):
+    """absmove_w_zoom as it was before request templates were cached
+
+    """
+    move_request = _legacy_prep_abs_move(ptz)
+    move_request.Position.PanTilt.x = pan_pos
+    move_request.Position.PanTilt.y = tilt_pos
+    move_request.Position.Zoom.x = zoom_pos
+    ptz.ptz_service.AbsoluteMove(move_request)
+
+
+def legacy_stop(ptz):
+    """stop as it was before request templates were cached
+
+    """
+    move_request = _legacy_prep_abs_move(ptz)
+    ptz.ptz_service.Stop({'ProfileToken': move_request.ProfileToken})
+
+
+def time_command(camera, command, num_commands):
+    """Time repeated calls of command
+
+    Returns the mean milliseconds per call and the number of requests
+    each call put on the wire.
+
+    """
+    camera.reset_counts()
+    start = time.perf_counter()
+    for i in range(num_commands):
+        command(i)
+    elapsed = time.perf_counter() - start
+
+    requests_sent = sum(camera.counts.values())
+    return 1000 * elapsed / num_commands, requests_sent / num_commands
+
+
+def main():  # pylint: disable=R0914
+    """Main function of utility
+
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n',
+                        '--num_commands',
+                        type=int,
+                        default=500,
+                        help='Number of each command to time.')
+    parser.add_argument('-l',
+                        '--latency',
+                        type=float,
+                        default=0.0,
+                        help=('Simulated round trip per request in '
+                              'milliseconds.'))
+    args = parser.parse_args()
+
+    with FakePtzCamera(latency=args.latency/1000) as camera:
+        ptz = PtzCam(camera.host, camera.port, 'admin', 'password')
+        fast_ptz = PtzCam(camera.host, camera.port, 'admin', 'password',
+                          fast_transport=True)
+
+        def velocity(i):
+            return (i % 20)/20
+
+        cases = [
+            ('move_w_zoom',
+             lambda i: legacy_move_w_zoom(ptz, velocity(i), -velocity(i), 0),
+             lambda i: ptz.move_w_zoom(velocity(i), -velocity(i), 0.0),
+             lambda i: fast_ptz.move_w_zoom(velocity(i), -velocity(i), 0.0)),
+            ('absmove_w_zoom',
+             lambda i: legacy_absmove_w_zoom(ptz, velocity(i), .5, .1),
+             lambda i: ptz.absmove_w_zoom(velocity(i), .5, .1),
+             lambda i: fast_ptz.absmove_w_zoom(velocity(i), .5, .1)),
+            ('stop',
+             lambda i: legacy_stop(ptz),
+             lambda i: ptz.stop(),
+             lambda i: fast_ptz.stop()),
+        ]
+
+        print(f'{args.num_commands} calls each, '
+              f'{args.latency:.1f} ms simulated round trip')
+        print(f'{"command":<16}{"before (ms)":>14}{"after (ms)":>14}'
+              f'{"fast (ms)":>14}{"requests before":>18}'
+              f'{"requests after":>17}')
+        for name, legacy_command, command, fast_command in cases:
+            before, before_requests = time_command(camera,
+                                                   legacy_command,
+                                                   args.num_commands)
+            after, after_requests = time_command(camera,
+                                                 command,
+                                                 args.num_commands)
+            fast, _ = time_command(camera, fast_command, args.num_commands)
+            print(f'{name:<16}{before:>14.3f}{after:>14.3f}{fast:>14.3f}'
+                  f'{before_requests:>18.1f}{after_requests:>17.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Benchmark of how long it takes to construct a PtzCam
+
+Runs against a local fake camera (ptzipcam.fake_camera) with a
+simulated network round trip and times PtzCam construction without
+the discovery cache, with the cache empty (first connection), and with
+the cache filled (with and without the fast transport), along with the
+round trips each costs.  Also times how
+long the first command takes, since with the cache the services are
+only created when first used.
+
+No camera or network is needed.
+
+"""
+import argparse
+import tempfile
+import time
+
+from ptzipcam.fake_camera import FakePtzCamera
+from ptzipcam.ptz_camera import PtzCam
+
+
+def time_startup(camera, num_startups, **kwargs):
+    """Time constructing a PtzCam and sending it one move
+
+    Returns mean milliseconds to construct, mean milliseconds for the
+    first move, and requests put on the wire per construction.
+
+    """
+    construct_total = 0.0
+    first_move_total = 0.0
+    camera.reset_counts()
+    for _ in range(num_startups):
+        start = time.perf_counter()
+        ptz = PtzCam(camera.host, camera.port, 'admin', 'password',
+                     **kwargs)
+        constructed = time.perf_counter()
+        ptz.move_w_zoom(0.1, 0.0, 0.0)
+        moved = time.perf_counter()
+
+        construct_total += constructed - start
+        first_move_total += moved - constructed
+
+    requests_sent = (sum(camera.counts.values())
+                     - camera.counts.get('ContinuousMove', 0))
+    return (1000 * construct_total / num_startups,
+            1000 * first_move_total / num_startups,
+            requests_sent / num_startups)
+
+
+def main():
+    """Main function of utility
+
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n',
+                        '--num_startups',
+                        type=int,
+                        default=5,
+                        help='Number of constructions to time per case.')
+    parser.add_argument('-l',
+                        '--latency',
+                        type=float,
+                        default=20.0,
+                        help=('Simulated round trip per request in '
+                              'milliseconds.'))
+    args = parser.parse_args()
+
+    camera = FakePtzCamera(latency=args.latency/1000)
+    with camera, tempfile.TemporaryDirectory() as cache_dir:
+        cases = [
+            ('no cache', 1, {}),
+            ('cache, first run', 1, {'discovery_cache': cache_dir}),
+            ('cache', args.num_startups, {'discovery_cache': cache_dir}),
+            ('cache + fast', args.num_startups, {'discovery_cache': cache_dir,
+                                                 'fast_transport': True}),
+        ]
+
+        print(f'{args.latency:.1f} ms simulated round trip')
+        print(f'{"case":<18}{"construct (ms)":>16}{"first move (ms)":>17}'
+              f'{"requests":>10}')
+        for name, num_startups, kwargs in cases:
+            construct, first_move, requests_sent = time_startup(camera,
+                                                                num_startups,
+                                                                **kwargs)
+            print(f'{name:<18}{construct:>16.1f}{first_move:>17.1f}'
+                  f'{requests_sent:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
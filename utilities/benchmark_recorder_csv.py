@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Benchmark of how ImageStreamRecorder writes its CSV file
+
+Records the same frames (small ones by default, so the CSV file's part
+shows) with:
+
+- the CSV file opened, appended to, and closed for every row, as
+  ImageStreamRecorder used to;
+- the file kept open and every row written as it comes (flush_rows=1);
+- the file kept open and rows written in batches (the defaults).
+
+Reports wall time a frame and, on Linux, the write system calls made
+(from /proc/self/io), along with the files opened from Python.  Each
+JPEG written is one open and one write in every case; the differences
+are the CSV file's.
+
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from ptzipcam.io import ImageStreamRecorder
+
+opens = {'count': 0}
+
+
+def count_opens(event, _):
+    """Audit hook counting files opened from Python
+
+    """
+    if event == 'open':
+        opens['count'] += 1
+
+
+def write_syscalls():
+    """Write system calls made by this process so far (Linux only)
+
+    """
+    try:
+        with open('/proc/self/io', encoding='utf-8') as io_file:
+            for line in io_file:
+                if line.startswith('syscw:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class ReopeningRecorder(ImageStreamRecorder):  # pylint: disable=R0903
+    """ImageStreamRecorder writing its CSV file as it used to
+
+    """
+
+    def _write_row(self, record_line):
+        with open(self.record_filename, 'a', encoding='utf-8') as record_file:
+            record_file.write(record_line)
+
+
+def time_recording(recorder, frame, count):
+    """Record frame count times, returning seconds, writes, and opens
+
+    """
+    lbox = {'confidence': .9, 'box': (10, 20, 30, 40)}
+    writes_start = write_syscalls()
+    opens_start = opens['count']
+    start = time.perf_counter()
+    for _ in range(count):
+        recorder.record_image(frame, (.1, .2, .3), 'target', lbox)
+    recorder.close()
+    elapsed = time.perf_counter() - start
+    writes_end = write_syscalls()
+    writes = None if writes_end is None else writes_end - writes_start
+    return elapsed, writes, opens['count'] - opens_start
+
+
+def main():  # pylint: disable=R0914
+    """Main function of utility
+
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n',
+                        '--frames',
+                        type=int,
+                        default=10000,
+                        help='Frames to record in each case.')
+    parser.add_argument('-r',
+                        '--resolution',
+                        default='32x18',
+                        help='Resolution of the frames recorded.')
+    parser.add_argument('-d',
+                        '--directory',
+                        help=('Record into a temporary folder here (e.g. on '
+                              'the SD card) instead of the default one.'))
+    args = parser.parse_args()
+
+    width, height = (int(n) for n in args.resolution.split('x'))
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+    sys.addaudithook(count_opens)
+
+    cases = [
+        ('reopened every row', ReopeningRecorder, {}),
+        ('kept open, every row', ImageStreamRecorder, {'flush_rows': 1}),
+        ('kept open, batched', ImageStreamRecorder, {}),
+    ]
+    print(f'{"csv file":<24}{"ms/frame":>10}{"writes":>10}{"opens":>10}')
+    for name, recorder_class, kwargs in cases:
+        with tempfile.TemporaryDirectory(dir=args.directory) as record_dir:
+            recorder = recorder_class(record_dir, **kwargs)
+            elapsed, writes, opened = time_recording(recorder,
+                                                     frame,
+                                                     args.frames)
+            with open(recorder.record_filename, encoding='utf-8') as csv:
+                rows = sum(1 for _ in csv) - 1
+            if rows != args.frames:
+                print(f'{name}: only {rows} of {args.frames} rows written')
+        print(f'{name:<24}{1000 * elapsed / args.frames:>10.3f}'
+              f'{"-" if writes is None else writes:>10}{opened:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -37,6 +37,14 @@ IP = configs['IP']
 PORT = configs['PORT']
 RTSP_PORT = configs['RTSP_PORT']
 CAM_BRAND = configs['CAM_BRAND']
+# capture from e.g. a synthetic source instead of the camera
+FRAME_SOURCE = configs.get('FRAME_SOURCE')
+DECODE_ON_DEMAND = configs.get('DECODE_ON_DEMAND', False)
+DECODE_RATE = configs.get('DECODE_RATE')
+LOW_LATENCY = configs.get('LOW_LATENCY', False)
+RTSP_TRANSPORT = configs.get('RTSP_TRANSPORT')
+# opencv or pyav (see ptzipcam/av_capture.py)
+CAPTURE_BACKEND = configs.get('CAPTURE_BACKEND', 'opencv')
 USER = configs['USER']
 PASS = configs['PASS']
 if CAM_BRAND == 'hikvision':
@@ -70,7 +78,13 @@ def main():
                  passwd=PASS,
                  cam_brand=CAM_BRAND,
                  rtsp_port=RTSP_PORT,
-                 stream=STREAM)
+                 stream=STREAM,
+                 source=FRAME_SOURCE,
+                 decode_on_demand=DECODE_ON_DEMAND,
+                 decode_rate=DECODE_RATE,
+                 low_latency=LOW_LATENCY,
+                 rtsp_transport=RTSP_TRANSPORT,
+                 backend=CAPTURE_BACKEND)
 
     frame = cam.get_frame()
     frame = ui.orient_frame(frame, ORIENTATION)
@@ -91,11 +105,15 @@ def main():
     else:
         logging.info('Recording is OFF.')
 
+    seq = 0
     start_time = time.time()
     while True:
-        raw_frame = cam.get_frame()
+        # only process each frame once
+        raw_frame, seq, _ = cam.wait_for_new_frame(seq, timeout=1.0)
         if raw_frame is None:
-            logging.info('Frame is None.')
+            health = cam.get_health()
+            logging.info('No new frame: stream %s, reconnects: %d.',
+                         health['state'], health['reconnects'])
             continue
 
         raw_frame = ui.orient_frame(raw_frame, ORIENTATION)
@@ -30,6 +30,8 @@ IP = configs['IP']
 PORT = configs['PORT']
 RTSP_PORT = configs['RTSP_PORT']
 CAM_BRAND = configs['CAM_BRAND']
+# capture from e.g. a synthetic source instead of the camera
+FRAME_SOURCE = configs.get('FRAME_SOURCE')
 USER = configs['USER']
 PASS = configs['PASS']
 if CAM_BRAND == 'hikvision':
@@ -63,7 +65,8 @@ if __name__ == '__main__':
                  passwd=PASS,
                  cam_brand=CAM_BRAND,
                  rtsp_port=RTSP_PORT,
-                 stream=STREAM)
+                 stream=STREAM,
+                 source=FRAME_SOURCE)
 
     frame = cam.get_frame()
     frame = ui.orient_frame(frame, ORIENTATION)
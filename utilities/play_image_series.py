@@ -6,19 +6,37 @@ various tools in the ptzipcam package.
 
 Use second command line argument to "fast forward" by skipping that
 number of frames for every render.
+
+The series' images can be JPEG files or in segments (see
+ptzipcam/segments.py); a single segment (.seg file) can also be played
+on its own.
+
+With any of --class, --min_score, --start, --end, or --pan, only the
+frames matching them are played, as queried from the series' metadata
+database (see ptzipcam/metadata_index.py); one is built from the CSV
+file the first time if the series was recorded without one.  The
+database can also be given instead of the CSV file.
 """
 import os
 import argparse
 
+from datetime import datetime
+
 import cv2
 import pandas as pd
 
 from camml import draw
 
+from ptzipcam.metadata_index import (DATABASE_SUFFIX, MetadataIndex,
+                                     index_csv)
+from ptzipcam.segments import (SEGMENT_SUFFIX, RecordedImages,
+                               SegmentReader, image_reference,
+                               parse_image_reference)
+
 ap = argparse.ArgumentParser()
 
 ap.add_argument('filename',
-                help='CSV file of image series.')
+                help='CSV file (or database) of image series, or a segment.')
 ap.add_argument('-j',
                 '--jump',
                 default=0,
@@ -42,6 +60,29 @@ ap.add_argument('-b',
 ap.add_argument('-o',
                 '--output_path',
                 help="Path to store output frames")
+ap.add_argument('--class',
+                dest='class_name',
+                help='Only play frames of this detected class.')
+ap.add_argument('--min_score',
+                type=float,
+                help='Only play frames scoring at least this.')
+ap.add_argument('--start',
+                type=datetime.fromisoformat,
+                help='Only play frames from this time (e.g. 2024-05-01T07:00).')
+ap.add_argument('--end',
+                type=datetime.fromisoformat,
+                help='Only play frames before this time.')
+ap.add_argument('--pan',
+                type=float,
+                help='Only play frames near this pan angle (degrees).')
+ap.add_argument('--pan_tolerance',
+                type=float,
+                default=5.0,
+                help='Degrees from --pan to play frames within.')
+ap.add_argument('--pan_range',
+                type=float,
+                default=360.0,
+                help="Full range of the camera's pan in degrees.")
 
 print("[INFO]: don't forget that you can set stride and fps on cli")
 
@@ -53,19 +94,81 @@ stride = int(args.stride)
 msecs_per_frame = int(1000 * (1.0/int(args.rate)))
 
 
+def read_segment_series(segment_filename):
+    """Image series of a segment, as read from an image series' CSV file
+
+    """
+    with SegmentReader(segment_filename) as reader:
+        index = reader.index
+        return pd.DataFrame({
+            'IMAGE_FILE': [image_reference(segment_filename, i)
+                           for i in range(len(index))],
+            'PAN_ANGLE': index['pan'],
+            'TILT_ANGLE': index['tilt'],
+            'ZOOM_POWER': index['zoom'],
+            'CLASS': [name.decode(errors='replace')
+                      for name in index['class']],
+            'SCORE': index['score'],
+            'X': index['x'],
+            'Y': index['y'],
+            'W': index['w'],
+            'H': index['h']})
+
+
+def query_series(series_filename):
+    """Frames of an image series matching the query arguments
+
+    """
+    database_filename = os.path.splitext(series_filename)[0] + DATABASE_SUFFIX
+    if not os.path.exists(database_filename):
+        print(f'[INFO] Indexing {series_filename}')
+        index_csv(series_filename, database_filename)
+    with MetadataIndex(database_filename) as index:
+        return pd.DataFrame(index.query(class_name=args.class_name,
+                                        min_score=args.min_score,
+                                        start=args.start,
+                                        end=args.end,
+                                        pan=args.pan,
+                                        pan_tolerance=args.pan_tolerance,
+                                        pan_range=args.pan_range))
+
+
 def main():
     """Main function of script
 
     """
     print('[INFO] FPS results in '
           f'{msecs_per_frame} milliseconds per frame.')
-    main_timestamp = csv_filename.split('.')[0]
+    if csv_filename.endswith(SEGMENT_SUFFIX):
+        df_image_data = read_segment_series(csv_filename)
+        base_path = os.path.split(csv_filename)[0]
+    else:
+        main_timestamp = csv_filename.split('.')[0]
+
+        querying = (csv_filename.endswith(DATABASE_SUFFIX)
+                    or any(value is not None
+                           for value in (args.class_name, args.min_score,
+                                         args.start, args.end, args.pan)))
+        if querying:
+            df_image_data = query_series(csv_filename)
+            print(f'[INFO] {len(df_image_data)} frames match.')
+        else:
+            df_image_data = pd.read_csv(csv_filename)
+
+        base_path = os.path.split(csv_filename)[0]
+        base_path = os.path.join(base_path, main_timestamp + '_images')
+
+    # closed (unmapping any segments) however playback ends
+    with RecordedImages(base_path) as images:
+        play_series(df_image_data, base_path, images)
+    cv2.destroyAllWindows()
+    # sys.exit()
 
-    df_image_data = pd.read_csv(csv_filename)
 
-    base_path = os.path.split(csv_filename)[0]
-    base_path = os.path.join(base_path, main_timestamp + '_images')
+def play_series(df_image_data, base_path, images):
+    """Show (and optionally save) the frames of an image series
 
+    """
     count = -1
     for index, row in df_image_data.iterrows():
         if index < int(args.jump):
@@ -75,7 +178,7 @@ def main():
             count = 0
             filename = os.path.join(base_path, row.IMAGE_FILE)
             # print(filename)
-            img = cv2.imread(filename)
+            img = images.read(row.IMAGE_FILE)
             if (args.box
                and row.CLASS != 'nothing detected'
                and row.CLASS != 'n/a: timelapse frame'
@@ -101,6 +204,10 @@ def main():
                 if not os.path.isdir(args.output_path):
                     os.mkdir(args.output_path)
                 just_name = os.path.split(filename)[1]
+                segment_name, segment_index = parse_image_reference(
+                    row.IMAGE_FILE)
+                if segment_name is not None:
+                    just_name = f'{segment_name}_{segment_index}.jpg'
                 filename = os.path.join(args.output_path, just_name)
                 cv2.imwrite(filename, img)
 
@@ -109,9 +216,6 @@ def main():
             if key == ord('q'):
                 break
 
-    cv2.destroyAllWindows()
-    # sys.exit()
-
 
 if __name__ == "__main__":
     main()
@@ -11,7 +11,7 @@ import yaml
 import numpy as np
 
 from ptzipcam.ptz_camera import PtzCam
-from ptzipcam.ptz_camera import CalmMotorController
+from ptzipcam.motor_controllers import CalmMotorController
 from ptzipcam import convert
 
 parser = argparse.ArgumentParser()
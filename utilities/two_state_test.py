@@ -4,7 +4,7 @@ import yaml
 import curses
 
 from ptzipcam.ptz_camera import PtzCam
-from ptzipcam.ptz_camera import MotorController
+from ptzipcam.motor_controllers import MotorController
 
 parser = argparse.ArgumentParser()
 parser.add_argument('config',
@@ -5,7 +5,7 @@ import curses
 import random
 
 from ptzipcam.ptz_camera import PtzCam
-from ptzipcam.ptz_camera import MotorController
+from ptzipcam.motor_controllers import MotorController
 from ptzipcam.tracker import Tracker
 
 parser = argparse.ArgumentParser()
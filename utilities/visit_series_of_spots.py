@@ -113,6 +113,8 @@ if __name__ == '__main__':
 
     frames_since_last_target = 10000
 
+    # time at a spot is counted from when the camera gets there
+    move_done = None
     spot_start_time = time.time()
     while True:
         cycle_start_time = time.time()
@@ -130,16 +132,20 @@ if __name__ == '__main__':
                                   'N/A',
                                   None)
             
-        if time.time() - spot_start_time >= time_to_wait:
+        if move_done is not None and move_done.done():
+            move_done = None
             spot_start_time = time.time()
 
+        if move_done is None and time.time() - spot_start_time >= time_to_wait:
             spot = next(spot_cycle)
             pan_com, tilt_com, zoom_com = get_command_from_spot(spot)
             time_to_wait = spot[3]
 
-            ptz.absmove_w_zoom(pan_com,
-                               tilt_com,
-                               zoom_com)
+            move_done = ptz.absmove_w_zoom_waitfordone(pan_com,
+                                                       tilt_com,
+                                                       zoom_com,
+                                                       close_enough=.01,
+                                                       block=False)
 
         if not HEADLESS:
             key = uih.update(frame, hud=False)